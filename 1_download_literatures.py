@@ -18,5 +18,7 @@ if __name__ == '__main__':
     pdf_processor.load_existing_results()
     reactions_text = pdf_processor.process_pdfs_txt(save_batch_size=1)
     # pdf_processor.process_pdfs_img_txt(save_batch_size=1)
+    # concurrent extraction & LLM requests (resumes from the existing result JSON as well):
+    # reactions_text = pdf_processor.process_pdfs_pipeline(max_concurrency=4, tokens_per_minute=200000)
     # get 'results_Polyimide/gpt_results.json'
 
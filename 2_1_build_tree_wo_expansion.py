@@ -48,7 +48,7 @@ if __name__ == '__main__':
     result = tree.construct_tree()
 
     treeloader = TreeLoader()
-    tree_filename = material + '_wo_exp.pkl'
+    tree_filename = material + '_wo_exp.rstree'
     treeloader.save_tree(tree, tree_filename)
 
     img_suffix = '_40_modified'
@@ -59,7 +59,7 @@ if __name__ == '__main__':
     print(f'{len(all_path)} paths in this tree')
 
     reactions = tree.reactions
-    kg = KnowledgeGraph(reactions)
+    kg = KnowledgeGraph(reactions, table=tree.reaction_table)
     # kg.visualize_kg(html_name=f"KG_{material}.html")
     node_count = kg.G.number_of_nodes()
     print(f'{node_count} nodes in KnowledgeGraph')
@@ -1,14 +1,17 @@
 
 import json
-from RetroSynAgent.pdfprocessor import PDFProcessor
+from RetroSynAgent.pdfprocessor import extract_pdf_content
 from RetroSynAgent.reactionparser import ReactionParser
 from RetroSynAgent.treebuilder import Tree, TreeLoader
-from RetroSynAgent.GPTAPI import GPTAPI
-from RetroSynAgent.pdfdownloader import PDFDownloader
+from RetroSynAgent.GPTAPI import GPTAPI, llm_metrics
+from RetroSynAgent.pdfdownloader import PDFDownloader, load_browser_headers
+from RetroSynAgent.downloadmanager import DownloadManager
 from RetroSynAgent import prompts
 import re
 import os
+import glob
 import copy
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 from RetroSynAgent.knowledgegraph import KnowledgeGraph
 
 
@@ -29,7 +32,119 @@ def update_json_file(add_results_filepath, add_results):
         json.dump(existing_data, f, indent=4)
 
 
-def expand_reactions_from_lits(material, origin_result_dict, add_results_filepath, max_iter = 10):
+def download_substance_pdfs(substance, pdf_folder_path, download_manager=None):
+    '''
+    PDFs about substance in pdf_folder_path, searched and downloaded (5, 10, 15 results) when the folder has no pdf yet:
+    a folder left with partial downloads only (.pdf.part, manifest) is retried, the DownloadManager resumes them
+    download_manager: DownloadManager shared by the substances downloaded at the same time
+    return: [pdf file name, ...]
+    '''
+    pdf_name_list = []
+    num_results_tmp = 0
+    if len(glob.glob(os.path.join(glob.escape(pdf_folder_path), '*.pdf'))) == 0:
+        while len(pdf_name_list) == 0:
+            num_results_tmp += 5
+            downloader = PDFDownloader(substance, pdf_folder_name=pdf_folder_path,
+                                       num_results=num_results_tmp, n_thread=3, download_manager=download_manager)
+            pdf_name_list = downloader.main()
+            if num_results_tmp >= 15:
+                break
+        print(f'successfully downloaded {len(pdf_name_list)} pdfs for {substance}')
+    else:
+        # Traverse all files in the folder
+        for file_name in os.listdir(pdf_folder_path):
+            # Check if the file extension is .pdf
+            if file_name.endswith(".pdf"):
+                pdf_name_list.append(file_name)
+    return pdf_name_list
+
+
+def ask_add_reactions(llm, substance, long_string):
+    prompt = prompts.prompt_add_reactions_from_lits_template.format(material=substance)
+    return llm.answer_wo_vision(prompt, content=long_string)
+
+
+def expand_substances(substances, processed, llm=None, download_workers=2, extract_workers=None, max_concurrency=4):
+    '''
+    Download, extract and ask the LLM for the reactions of every substance, the three stages overlap across
+    substances and pdfs: a pdf is extracted as soon as the downloads of its substance are done, and sent to
+    the LLM as soon as it is extracted
+    substances: unexpandable substances
+    processed: names (without .pdf) of the pdfs already processed, skipped
+    download_workers: number of substances downloaded at the same time (each PDFDownloader runs 3 threads),
+                      all through one DownloadManager: the per-host limit holds for all of them
+    extract_workers: number of extraction processes, None for the number of CPUs
+    max_concurrency: maximum number of LLM requests in flight
+    return: {pdf_name: (reactions_txt, '')} of the new pdfs
+    '''
+    llm = llm if llm is not None else GPTAPI()
+    new_results = {}
+    scheduled = set(processed)
+    # Extracted texts waiting for an LLM slot are held in memory, extraction only runs a few pdfs ahead
+    max_ahead = 2 * max_concurrency
+    waiting = []  # (substance, pdf_path, pdf_name) to extract
+    downloading, extracting, asking = {}, {}, {}
+    os.makedirs('literatures_add', exist_ok=True)
+    download_manager = DownloadManager(*load_browser_headers(), per_host=2,
+                                       manifest_filename='literatures_add/download_manifest.json')
+    with ThreadPoolExecutor(max_workers=download_workers) as download_pool, \
+            ProcessPoolExecutor(max_workers=extract_workers) as extract_pool, \
+            ThreadPoolExecutor(max_workers=max_concurrency) as llm_pool:
+        for substance in substances:
+            pdf_folder_path = 'literatures_add/lits_pdf_add_' + substance
+            downloading[download_pool.submit(download_substance_pdfs, substance, pdf_folder_path,
+                                             download_manager)] = (substance, pdf_folder_path)
+        while downloading or waiting or extracting or asking:
+            while waiting and len(extracting) + len(asking) < max_ahead:
+                substance, pdf_path, pdf_name = waiting.pop(0)
+                extracting[extract_pool.submit(extract_pdf_content, pdf_path)] = (substance, pdf_name)
+            done, _ = wait(list(downloading) + list(extracting) + list(asking), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in downloading:
+                    substance, pdf_folder_path = downloading.pop(future)
+                    try:
+                        pdf_name_list = future.result()
+                    except Exception as e:
+                        print(f'{substance} download failed: {e}')
+                        continue
+                    for pdf_name in pdf_name_list:
+                        pdf_name_wo_suffix = pdf_name.replace('.pdf', '')
+                        # the same pdf can be found for several substances
+                        if pdf_name_wo_suffix in scheduled:
+                            print(f'{pdf_name_wo_suffix} has been processsed.')
+                            continue
+                        scheduled.add(pdf_name_wo_suffix)
+                        waiting.append((substance, pdf_folder_path + '/' + pdf_name, pdf_name_wo_suffix))
+                elif future in extracting:
+                    substance, pdf_name = extracting.pop(future)
+                    try:
+                        long_string, _ = future.result()
+                    except Exception as e:
+                        print(f'{pdf_name} extraction failed: {e}')
+                        continue
+                    asking[llm_pool.submit(ask_add_reactions, llm, substance, long_string)] = pdf_name
+                else:
+                    pdf_name = asking.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        # not recorded, the pdf is retried in the next iteration
+                        scheduled.discard(pdf_name)
+                        print(f'{pdf_name} LLM request failed: {e}')
+                        continue
+                    # {"source": (reactions_txt, properties_txt) }
+                    new_results[pdf_name] = (response, '')
+                    print(f'successfully processed {pdf_name}')
+    download_manager.close()
+    print(f'LLM calls: {llm_metrics.summary()}')
+    return new_results
+
+
+def expand_reactions_from_lits(material, origin_result_dict, add_results_filepath, max_iter = 10,
+                               download_workers=2, extract_workers=None, max_concurrency=4):
+    '''
+    download_workers / extract_workers / max_concurrency: parallelism of expand_substances
+    '''
     os.makedirs('literatures_add', exist_ok=True)
     result_dict = copy.deepcopy(origin_result_dict)
     # additional_reactions_txt = ''
@@ -37,60 +152,38 @@ def expand_reactions_from_lits(material, origin_result_dict, add_results_filepat
     result = False
     unexpandable_substances = set()
     iteration = 1
+    tree = None
+    llm = GPTAPI()
+    # read once, kept up to date in memory
+    processed = set()
+    if os.path.exists(add_results_filepath):
+        with open(add_results_filepath, 'r') as f:
+            processed.update(json.load(f))
     # Exit the while loop if result is true and unexpandable_substances is an empty set.
     # Enter the loop if result is false or unexpandable_substances is not an empty set.
     while not result or unexpandable_substances:
         print(f'\n===== iteration: {iteration}\n')
         # 3. build graph & tree
         # tree = Tree(material.lower(), reactions_txt=reactions_text)
-        if add_results:
-            result_dict.update(add_results)
-        tree = Tree(material.lower(), result_dict = result_dict)
-        result = tree.construct_tree()
+        if tree is None:
+            tree = Tree(material.lower(), result_dict = result_dict)
+            result = tree.construct_tree()
+        else:
+            # only the reactions of new pdfs are parsed, only the nodes depending on their products are expanded again
+            result = tree.add_results(add_results)
         if tree.unexpandable_substances != set():
             unexp_sub_list = list(tree.unexpandable_substances)
             # unexpandable_substances = '\n'.join(unexp_sub_list)
             # print(f"=== Unexpandable Substances:\n{unexpandable_substances}\n")
             # prompt = prompts.prompt_add_reactions.format(substances=unexpandable_substances)
-            for substance in unexp_sub_list:
-                pdf_name_list = []
-                num_results_tmp = 0
-                pdf_folder_path = 'literatures_add/lits_pdf_add_' + substance
-                if (not os.path.exists(pdf_folder_path)) or (len(os.listdir(pdf_folder_path)) == 0):
-                    while len(pdf_name_list) == 0:
-                        num_results_tmp += 5
-                        downloader = PDFDownloader(substance, pdf_folder_name=pdf_folder_path,
-                                                   num_results=num_results_tmp, n_thread=3)
-                        pdf_name_list = downloader.main()
-                        if num_results_tmp >= 15:
-                            break
-                    print(f'successfully downloaded {len(pdf_name_list)} pdfs for {substance}')
-                else:
-                    # Traverse all files in the folder
-                    for file_name in os.listdir(pdf_folder_path):
-                        # Check if the file extension is .pdf
-                        if file_name.endswith(".pdf"):
-                            pdf_name_list.append(file_name)
-
-                for pdf_name in pdf_name_list:
-                    pdf_name_wo_suffix = pdf_name.replace('.pdf', '')
-                    with open(add_results_filepath, 'r') as f:
-                        origin_add_results = json.load(f)
-                    if pdf_name_wo_suffix not in origin_add_results:
-                        pdf_path = pdf_folder_path + '/' + pdf_name
-                        pdf_processor = PDFProcessor()
-                        # pdf_path = 'substances_name/literature_title.pdf'
-                        long_string = pdf_processor.pdf_to_long_string(pdf_path)
-                        prompt = prompts.prompt_add_reactions_from_lits_template.format(material=substance)
-                        llm = GPTAPI()
-                        response = llm.answer_wo_vision(prompt, content=long_string)
-                        add_results[pdf_name_wo_suffix] = (response,'')
-                        # update add results json file
-                        update_json_file(add_results_filepath, add_results)
-                        # {"source": (reactions_txt, properties_txt) }
-                        print('successfully updated added results file.')
-                    else:
-                        print(f'{pdf_name_wo_suffix} has been processsed.')
+            new_results = expand_substances(unexp_sub_list, processed, llm=llm, download_workers=download_workers,
+                                            extract_workers=extract_workers, max_concurrency=max_concurrency)
+            if new_results:
+                add_results.update(new_results)
+                processed.update(new_results)
+                # update add results json file, once per iteration
+                update_json_file(add_results_filepath, new_results)
+                print(f'successfully updated added results file with {len(new_results)} pdfs.')
 
             iteration += 1
             if iteration == max_iter:
@@ -181,7 +274,7 @@ if __name__ == '__main__':
             json.dump(unexp_sub_list, file, indent=4)
 
     loader = TreeLoader()
-    loader.save_tree(tree, material+'.pkl')
+    loader.save_tree(tree, material + '.rstree')
 
 
 
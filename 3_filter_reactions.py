@@ -1,6 +1,7 @@
 from RetroSynAgent import prompts
 from RetroSynAgent.treebuilder import Tree, TreeLoader
 from RetroSynAgent.GPTAPI import GPTAPI
+from RetroSynAgent.reactionstore import ReactionStore, PathwayStore
 import json
 import random
 import re
@@ -11,51 +12,31 @@ def filter_reactions(response_filter_reactions, reactions_txt):
     result = re.findall(r'Reaction idx: (\d+)', remaining_reactions_txt)
     # remaining_reaction_indices
     id_list = list(map(str, result))
-    # Split the string by "Reaction idx:" and keep only the parts included in reaction_ids
-    filtered_entries = []
-    for entry in reactions_txt.strip().split("\n\n"):
-        if any(f"Reaction idx: {rid}" in entry for rid in id_list):
-            filtered_entries.append(entry)
-    # Join the filtered results into a single string
-    filtered_reactions = "\n\n".join(filtered_entries)
+    # reactions_txt: reaction text or ReactionStore, the reactions are kept on their exact idx
+    reactions = reactions_txt if isinstance(reactions_txt, ReactionStore) else ReactionStore.from_text(reactions_txt)
+    filtered_reactions = reactions.select(id_list).text()
     return filtered_reactions
 
 def concat_pathway_and_reactions(reactions_txt, all_path_list):
-    # Split the reaction string by line
-    reactions = reactions_txt.strip().split('\n\n')
-
-    # Store reaction strings in a dictionary indexed by Reaction idx
-    reaction_dict = {}
-    for reaction in reactions:
-        idx_line = reaction.split('\n')[0]
-        idx = idx_line.split(': ')[-1]
-        reaction_dict[idx] = reaction
-
-    # Find the corresponding entries for each pathway and output them
-    output = []
-    for path in all_path_list:
-        output.append(f"Pathway: {', '.join(path)}\n")
-        for idx in path:
-            if idx in reaction_dict:
-                output.append(reaction_dict[idx] + "\n")
-        output.append('\n')
-
-    # Output the result
-    result = ''.join(output)
-    return result
-
+    # reactions_txt: reaction text or ReactionStore, each pathway followed by the text of its reactions
+    reactions = reactions_txt if isinstance(reactions_txt, ReactionStore) else ReactionStore.from_text(reactions_txt)
+    return PathwayStore(all_path_list, reactions).text()
 
 
 if __name__ == '__main__':
 
     material = 'Polyimide'
     tree_dir = 'tree_files'
+    render_image = False  # also draw the tree with Graphviz, in the background
     loader = TreeLoader()
     # Note: 0. Load the original reaction_tree for further filtering
-    tree = loader.load_tree(tree_dir + "/" + material + '.pkl')
+    tree = loader.load_tree(tree_dir + "/" + material + '.rstree')
     # reactions_tree: all reactions (idx, reactants, products, conditions, source) in the tree
     img_suffix = '_40_modified_add'
-    reactions_tree = tree.show_tree(view=False, simple=False, img_suffix=img_suffix)
+    tree_reactions = ReactionStore.from_records(tree.get_tree_reactions(as_text=False))
+    reactions_tree = tree_reactions.text()
+    if render_image:
+        tree.render_tree_image(view=False, simple=False, img_suffix=img_suffix, background=True)
 
     # Note: 1. Use LLM to filter reactions based on conditions
     prompt1 = prompts.filter_reactions_prompt_template.format(reactions=reactions_tree)
@@ -68,7 +49,7 @@ if __name__ == '__main__':
     with open('filter_reactions_llm_response.txt', 'r') as f:
         response1 = f.read()
 
-    reactions_tree_filtered = filter_reactions(response_filter_reactions=response1, reactions_txt=reactions_tree)
+    reactions_tree_filtered = filter_reactions(response_filter_reactions=response1, reactions_txt=tree_reactions)
 
     print(f'reactions_tree_filtered: {len(reactions_tree_filtered)}, reactions_tree: {len(reactions_tree)}')
     with open('filtered_reactions.txt', 'w') as f:
@@ -79,6 +60,6 @@ if __name__ == '__main__':
         reactions_tree_filtered = f.read()
     tree_filtered = Tree(material.lower(), reactions_txt=reactions_tree_filtered)
     tree_filtered.construct_tree()
-    tree_filtered_name = material + '_filtered' + '.pkl'
+    tree_filtered_name = material + '_filtered' + '.rstree'
     loader.save_tree(tree_filtered, tree_filtered_name)
 
@@ -1,6 +1,7 @@
 from RetroSynAgent import prompts
 from RetroSynAgent.treebuilder import Tree, TreeLoader
 from RetroSynAgent.GPTAPI import GPTAPI
+from RetroSynAgent.reactionstore import ReactionStore, PathwayStore
 import json
 import random
 import re
@@ -11,14 +12,11 @@ def filter_pathways(response_filter_pathways, pathways_txt):
     # result = re.findall(r'Pathway: (\d+)', remaining_pathway_txt)
     id_list = [line.split("Pathway: ")[1].strip() for line in remaining_pathway_txt.split('\n') if "Pathway: " in line]
     print(f'{len(id_list)} pathways remaining - id_list')
-    # remaining_pathway_indices
-    # id_list = list(map(str, result))
-    filtered_entries = []
-    for entry in pathways_txt.strip().split("\n\n"):
-        if any(f"Pathway: {id}" in entry for id in id_list):
-            filtered_entries.append(entry)
+    # pathways_txt: pathway text or PathwayStore, the pathways are kept on their exact list of idx
+    pathways = pathways_txt if isinstance(pathways_txt, PathwayStore) else PathwayStore.from_text(pathways_txt)
+    filtered_entries = pathways.select(id_list)
     print(f'{len(filtered_entries)} pathways remaining - filtered_entries')
-    filtered_pathways = "\n\n".join(filtered_entries)
+    filtered_pathways = filtered_entries.text(separator="\n\n")
     return filtered_pathways
 
 def filter_reactions(response_filter_reactions, reactions_txt):
@@ -26,54 +24,33 @@ def filter_reactions(response_filter_reactions, reactions_txt):
     result = re.findall(r'Reaction idx: (\d+)', remaining_reactions_txt)
     # remaining_reaction_indices
     id_list = list(map(str, result))
-    # Split the string by "Reaction idx:", keeping the parts that are in reaction_ids
-    filtered_entries = []
-    for entry in reactions_txt.strip().split("\n\n"):
-        if any(f"Reaction idx: {rid}" in entry for rid in id_list):
-            filtered_entries.append(entry)
-    # Join the filtered results into a single string
-    filtered_reactions = "\n\n".join(filtered_entries)
+    # reactions_txt: reaction text or ReactionStore, the reactions are kept on their exact idx
+    reactions = reactions_txt if isinstance(reactions_txt, ReactionStore) else ReactionStore.from_text(reactions_txt)
+    filtered_reactions = reactions.select(id_list).text()
     return filtered_reactions
 
 def concat_pathway_and_reactions(reactions_txt, all_path_list):
-    # Split the reaction string by lines
-    reactions = reactions_txt.strip().split('\n\n')
-
-    # Store the reactions by Reaction idx in a dictionary
-    reaction_dict = {}
-    for reaction in reactions:
-        idx_line = reaction.split('\n')[0]
-        idx = idx_line.split(': ')[-1]
-        reaction_dict[idx] = reaction
-
-    # Find the entries corresponding to the pathways and output them
-    output = []
-    for path in all_path_list:
-        output.append(f"Pathway: {', '.join(path)}\n")
-        for idx in path:
-            if idx in reaction_dict:
-                output.append(reaction_dict[idx] + "\n")
-        output.append('\n')
-
-    # Output the result
-    result = ''.join(output)
-    return result
-
+    # reactions_txt: reaction text or ReactionStore, each pathway followed by the text of its reactions
+    reactions = reactions_txt if isinstance(reactions_txt, ReactionStore) else ReactionStore.from_text(reactions_txt)
+    return PathwayStore(all_path_list, reactions).text()
 
 
 if __name__ == '__main__':
     material = 'Polyimide'
+    render_image = False  # also draw the tree with Graphviz, in the background
 
     # Note: 1. Rebuild the tree according to reactions_tree_filtered
 
     loader = TreeLoader()
-    tree_filtered_name = material + '_filtered' + '.pkl'
+    tree_filtered_name = material + '_filtered' + '.rstree'
     tree_dir = 'tree_files'
     # tree_dir + '/' +
     # Note:
     tree_filtered = loader.load_tree(tree_dir + '/' +tree_filtered_name)
     img_suffix = '_filtered'
-    reactions_tree_filtered = tree_filtered.show_tree(view=False, img_suffix=img_suffix)
+    reactions_tree_filtered = ReactionStore.from_records(tree_filtered.get_tree_reactions(as_text=False))
+    if render_image:
+        tree_filtered.render_tree_image(view=False, img_suffix=img_suffix, background=True)
     all_path_filtered = tree_filtered.find_all_paths()
     # random.shuffle(all_path_filtered)
     print(f'{len(all_path_filtered)} paths in this tree after filtering') # 28
@@ -83,9 +60,9 @@ if __name__ == '__main__':
 
     # Note: 2. Integrating pathways and reactions
 
-    all_pathways = concat_pathway_and_reactions(reactions_tree_filtered, all_path_filtered)
+    pathways = PathwayStore(all_path_filtered, reactions_tree_filtered)
     with open('results_recommendation/all_pathways.txt', 'w') as f:
-        f.write(all_pathways)
+        pathways.write(f)  # pathway texts written one by one
 
     # Note: 3. Screening out unreasonable pathways
     with open('results_recommendation/all_pathways.txt', 'r') as f:
@@ -97,7 +74,7 @@ if __name__ == '__main__':
 
     with open('results_recommendation/filter_pathways_llm_response.txt', 'r') as f:
         response_filtered_pathway = f.read()
-    filtered_pathways = filter_pathways(response_filtered_pathway, pathways_txt=all_pathways)
+    filtered_pathways = filter_pathways(response_filtered_pathway, pathways_txt=pathways)
     with open('results_recommendation/filtered_pathways.txt', 'w') as f:
         f.write(filtered_pathways)
 
@@ -10,65 +10,308 @@ response = self.client.chat.completions.create(
     messages=messages,
     temperature=self.temperature,
 )
+
+GPTAPI instances are cheap: clients are shared through a registry keyed by (base_url, api_key, model),
+so every GPTAPI() reuses the same keep-alive connection pool. AsyncGPTAPI is the asyncio variant.
+Every call is recorded in llm_metrics (latency, tokens, retries).
+Temperature-0 answers are cached on disk (responsecache.py), cache_mode / the LLM_CACHE_MODE environment variable:
+    use     - answer from the cache when possible (default)
+    refresh - always call the API and overwrite the cached answer
+    bypass  - neither read nor write the cache
 '''
-from openai import OpenAI
-from dotenv import load_dotenv
+import asyncio
 import os
+import random
+import threading
+import time
+import weakref
+import openai
+from openai import OpenAI, AsyncOpenAI
+from dotenv import load_dotenv
+from .responsecache import ResponseCache, request_key, request_size
+
+env_lock = threading.Lock()
+env_loaded = False
+
+
+def load_env():
+    # load_dotenv once per process instead of once per GPTAPI()
+    global env_loaded
+    with env_lock:
+        if not env_loaded:
+            load_dotenv()
+            env_loaded = True
+    return os.getenv('API_KEY'), os.getenv('BASE_URL')
+
+
+cache_modes = ('use', 'refresh', 'bypass')
+
+
+class ClientRegistry:
+    '''
+    Thread-safe registry of OpenAI clients keyed by (base_url, api_key, model)
+    '''
+    def __init__(self):
+        self.clients = {}
+        # Async clients are bound to the event loop that uses them
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def get(self, base_url, api_key, model):
+        key = (base_url, api_key, model)
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                # Retries are done by GPTAPI so that they can be counted
+                client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+                self.clients[key] = client
+            return client
+
+    def get_async(self, base_url, api_key, model):
+        key = (base_url, api_key, model)
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            clients = self.async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+                clients[key] = client
+            return client
+
+
+client_registry = ClientRegistry()
+
+
+class LLMMetrics:
+    '''
+    Thread-safe per-call metrics: latency, prompt / completion tokens, retries
+    '''
+    def __init__(self, max_calls=10000):
+        self.max_calls = max_calls
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = []
+            self.num_calls = 0
+            self.num_errors = 0
+            self.total_latency = 0.0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.retries = 0
+
+    def record(self, model, latency, usage, retries, error=None):
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        call = {'model': model, 'latency': latency, 'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens, 'retries': retries,
+                'error': None if error is None else repr(error)}
+        with self.lock:
+            self.calls.append(call)
+            if len(self.calls) > self.max_calls:
+                del self.calls[:len(self.calls) - self.max_calls]
+            self.num_calls += 1
+            self.num_errors += error is not None
+            self.total_latency += latency
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.retries += retries
+        return call
+
+    def summary(self):
+        with self.lock:
+            return {
+                'calls': self.num_calls,
+                'errors': self.num_errors,
+                'retries': self.retries,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'total_latency': round(self.total_latency, 3),
+                'mean_latency': round(self.total_latency / self.num_calls, 3) if self.num_calls else 0.0,
+            }
+
+
+llm_metrics = LLMMetrics()
+
+# Same errors and backoff as the retries of the OpenAI client
+retryable_errors = (openai.APIConnectionError, openai.APITimeoutError, openai.ConflictError,
+                    openai.RateLimitError, openai.InternalServerError)
+
+
+def retry_delay(attempt, initial_delay=0.5, max_delay=8.0):
+    return min(initial_delay * 2 ** attempt, max_delay) * (1 - 0.25 * random.random())
+
+
+def build_messages(prompt, content=None):
+    messages = [{"role": "system", "content": prompt}]
+    if content is not None:
+        messages.append({"role": "user", "content": "content:\n" + content})
+    return messages
+
+
+def build_messages_txt_list(prompt, content_list):
+    messages = [{"role": "system", "content": prompt}]
+    for content in content_list:
+        messages.append({"role": "user", "content": content})
+    return messages
+
+
+def build_messages_img_list_txt(prompt, base64_img_list, content, image_format='png'):
+    content_list = []
+    content_list.append({"type": "text", "text": "content:\n" + content})
+    for base64_img in base64_img_list:
+        content_list.append({"type": "image_url", "image_url": {"url": f"data:image/{image_format};base64,{base64_img}"}})
+    return [
+        # {"role": "system", "content": "Answer the question based on the provided content and images."},
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": content_list}
+    ]
+
+
 class GPTAPI:
-    def __init__(self, model = "gpt-4o", temperature = 0.0):
-        # Load environment variables
-        load_dotenv()
-        self.api_key = os.getenv('API_KEY')
-        self.base_url = os.getenv('BASE_URL')
-        # Initialize OpenAI client
-        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+    def __init__(self, model = "gpt-4o", temperature = 0.0, max_retries=2, metrics=None, cache=None, cache_mode=None):
+        '''
+        max_retries: retries on connection / rate limit / server errors
+        metrics: LLMMetrics the calls are recorded in, llm_metrics by default
+        cache: ResponseCache, the shared llm_cache.sqlite by default
+        cache_mode: 'use', 'refresh' or 'bypass', None for $LLM_CACHE_MODE (default 'use')
+        '''
+        self.api_key, self.base_url = load_env()
+        self.client = client_registry.get(self.base_url, self.api_key, model)
+        self.init_options(model, temperature, max_retries, metrics, cache, cache_mode)
+
+    def init_options(self, model, temperature, max_retries, metrics, cache, cache_mode):
         self.model = model
         self.temperature = temperature
+        self.max_retries = max_retries
+        self.metrics = metrics if metrics is not None else llm_metrics
+        self.cache_mode = cache_mode or os.getenv('LLM_CACHE_MODE') or 'use'
+        if self.cache_mode not in cache_modes:
+            raise ValueError(f'cache_mode must be one of {cache_modes}, got {self.cache_mode!r}')
+        self.cache = cache
+        self.last_call = None
 
-    def answer_wo_vision(self, prompt, content=None):
-        # Construct message
-        messages = [{"role": "system", "content": prompt}]
-        if content is not None:
-            messages.append({"role": "user", "content": "content:\n" + content})
-        # Send request and get response
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=self.temperature,
-        )
-        # Extract and return the answer
-        answer = response.choices[0].message.content
+    def get_cache(self):
+        # Sampled answers (temperature > 0) are not reproducible and never cached
+        if self.cache_mode == 'bypass' or self.temperature != 0:
+            return None
+        if self.cache is None:
+            self.cache = ResponseCache.open()
+        return self.cache
+
+    def cache_lookup(self, messages):
+        '''
+        return: cache key (None when the cache is not used), cached answer or None
+        '''
+        cache = self.get_cache()
+        if cache is None:
+            return None, None
+        key = request_key(self.model, self.temperature, messages, base_url=self.base_url)
+        if self.cache_mode == 'refresh':
+            return key, None
+        answer = cache.get(key)
+        if answer is not None:
+            self.last_call = {'model': self.model, 'latency': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                              'retries': 0, 'error': None, 'cached': True}
+        return key, answer
+
+    def cache_store(self, key, messages, answer):
+        if key is not None and answer is not None:
+            self.cache.put(key, answer, model=self.model, request_bytes=request_size(messages))
+
+    def create(self, messages):
+        key, answer = self.cache_lookup(messages)
+        if answer is not None:
+            return answer
+        answer = self.request(messages)
+        self.cache_store(key, messages, answer)
         return answer
 
+    def request(self, messages):
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                )
+                break
+            except retryable_errors as e:
+                if attempt >= self.max_retries:
+                    self.last_call = self.metrics.record(self.model, time.perf_counter() - start, None, attempt, e)
+                    raise
+                time.sleep(retry_delay(attempt))
+                attempt += 1
+            except Exception as e:
+                self.last_call = self.metrics.record(self.model, time.perf_counter() - start, None, attempt, e)
+                raise
+        self.last_call = self.metrics.record(self.model, time.perf_counter() - start, response.usage, attempt)
+        # Extract and return the answer
+        return response.choices[0].message.content
+
+    def answer_wo_vision(self, prompt, content=None):
+        return self.create(build_messages(prompt, content))
 
     def answer_wo_vision_txt_list(self, prompt, content_list):
-        messages = [{"role": "system", "content": prompt}]
-        for content in content_list:
-            messages.append({"role": "user", "content": content})
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=self.temperature,
-        )
-        answer = response.choices[0].message.content
-        return answer
+        return self.create(build_messages_txt_list(prompt, content_list))
 
     # parse reactions & properties based on pdf to (imgs & txt)
-    def answer_w_vision_img_list_txt(self, prompt, base64_img_list, content):
-        content_list = []
-        content_list.append({"type":"text", "text": "content:\n" + content})
-        for base64_img in base64_img_list:
-            content_list.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_img}"}})
-
-        messages = [
-            # {"role": "system", "content": "Answer the question based on the provided content and images."},
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": content_list}
-        ]
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=self.temperature,
-        )
-        answer = response.choices[0].message.content
+    def answer_w_vision_img_list_txt(self, prompt, base64_img_list, content, image_format='png'):
+        return self.create(build_messages_img_list_txt(prompt, base64_img_list, content, image_format))
+
+
+class AsyncGPTAPI(GPTAPI):
+    '''
+    asyncio variant of GPTAPI, the answer_* methods are coroutines
+    '''
+    def __init__(self, model = "gpt-4o", temperature = 0.0, max_retries=2, metrics=None, cache=None, cache_mode=None):
+        self.api_key, self.base_url = load_env()
+        self.init_options(model, temperature, max_retries, metrics, cache, cache_mode)
+
+    @property
+    def client(self):
+        return client_registry.get_async(self.base_url, self.api_key, self.model)
+
+    async def create(self, messages):
+        # sqlite calls of the response cache run in a worker thread, not on the event loop
+        key, answer = await asyncio.to_thread(self.cache_lookup, messages)
+        if answer is not None:
+            return answer
+        answer = await self.request(messages)
+        await asyncio.to_thread(self.cache_store, key, messages, answer)
         return answer
+
+    async def request(self, messages):
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                )
+                break
+            except retryable_errors as e:
+                if attempt >= self.max_retries:
+                    self.last_call = self.metrics.record(self.model, time.perf_counter() - start, None, attempt, e)
+                    raise
+                await asyncio.sleep(retry_delay(attempt))
+                attempt += 1
+            except Exception as e:
+                self.last_call = self.metrics.record(self.model, time.perf_counter() - start, None, attempt, e)
+                raise
+        self.last_call = self.metrics.record(self.model, time.perf_counter() - start, response.usage, attempt)
+        return response.choices[0].message.content
+
+    async def answer_wo_vision(self, prompt, content=None):
+        return await self.create(build_messages(prompt, content))
+
+    async def answer_wo_vision_txt_list(self, prompt, content_list):
+        return await self.create(build_messages_txt_list(prompt, content_list))
+
+    async def answer_w_vision_img_list_txt(self, prompt, base64_img_list, content, image_format='png'):
+        return await self.create(build_messages_img_list_txt(prompt, base64_img_list, content, image_format))
@@ -0,0 +1,140 @@
+'''
+Token-aware chunking of long papers and merging of the per-chunk reaction blocks (map-reduce extraction).
+
+The cleaned text of pdf_to_long_string has no line breaks, chunks are cut before section headings
+(Introduction, Experimental, ...) where possible, otherwise at sentence ends. Every chunk after the first
+repeats the last `overlap_tokens` of the previous one, so a reaction described across a cut is seen whole once.
+'''
+import re
+
+try:
+    import tiktoken
+except ImportError:  # optional: ~4 characters per token
+    tiktoken = None
+
+encodings = {}
+
+section_pattern = re.compile(
+    r'(?:\b\d{1,2}(?:\.\d{1,2})*\.? )?'
+    r'\b(?:Abstract|Introduction|Experimental Section|Experimental|Materials and Methods|Materials|Methods|'
+    r'Synthesis|Preparation|Characterization|Results and Discussion|Results|Discussion|Conclusions|Conclusion|'
+    r'Supporting Information|Acknowledgments|Acknowledgements)\b(?= [A-Z0-9])')
+sentence_pattern = re.compile(r'(?<=\.) (?=[A-Z0-9])')
+
+
+def get_encoding(model):
+    if model not in encodings:
+        try:
+            encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encodings[model] = tiktoken.get_encoding('o200k_base')
+    return encodings[model]
+
+
+def count_tokens(text, model='gpt-4o'):
+    if tiktoken is None:
+        return len(text) // 4
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def split_at(text, pattern):
+    starts = sorted({0} | {match.start() for match in pattern.finditer(text)})
+    return [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)]) if text[start:end].strip()]
+
+
+def split_text(text, max_tokens, model='gpt-4o'):
+    '''
+    Split text into pieces of at most max_tokens: at section headings, then sentence ends, then blindly
+    '''
+    pieces = []
+    for section in split_at(text, section_pattern):
+        if count_tokens(section, model) <= max_tokens:
+            pieces.append(section)
+            continue
+        for sentence in split_at(section, sentence_pattern):
+            if count_tokens(sentence, model) <= max_tokens:
+                pieces.append(sentence)
+                continue
+            # A "sentence" longer than a chunk (tables, formula lists): cut by characters
+            step = max(1, len(sentence) * max_tokens // count_tokens(sentence, model))
+            pieces.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+    return pieces
+
+
+def tail(pieces, max_tokens, model='gpt-4o'):
+    # The trailing sentences of a chunk that fit in max_tokens
+    sentences = [sentence for piece in pieces for sentence in split_at(piece, sentence_pattern)]
+    kept, tokens = [], 0
+    for sentence in reversed(sentences):
+        tokens += count_tokens(sentence, model)
+        if tokens > max_tokens:
+            break
+        kept.append(sentence)
+    return ''.join(reversed(kept))
+
+
+def chunk_text(text, max_tokens=16000, overlap_tokens=500, model='gpt-4o'):
+    '''
+    Split text into chunks of about max_tokens (overlap included), cut at section headings or sentence ends
+    return: [chunk text, ...], a single chunk when the text fits
+    '''
+    if count_tokens(text, model) <= max_tokens:
+        return [text]
+    overlap_tokens = min(overlap_tokens, max_tokens // 4)
+    pieces = split_text(text, max_tokens - overlap_tokens, model)
+    chunks = []
+    current, current_tokens = [], 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece, model)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append(''.join(current).strip())
+            overlap = tail(current, overlap_tokens, model) if overlap_tokens > 0 else ''
+            current, current_tokens = [overlap] if overlap else [], count_tokens(overlap, model)
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append(''.join(current).strip())
+    return chunks
+
+
+def parse_reaction_blocks(answer):
+    '''
+    Reaction blocks of an extraction answer (see prompts.reaction_prompt)
+    return: [(reactants line, products line, conditions line), ...]
+    '''
+    blocks = []
+    reactants = products = None
+    for line in answer.splitlines():
+        line = line.strip()
+        if line.startswith("Reactants:"):
+            reactants = line.split("Reactants:")[1].strip()
+        elif line.startswith("Products:"):
+            products = line.split("Products:")[1].strip()
+        elif line.startswith("Conditions:") and reactants is not None and products is not None:
+            blocks.append((reactants, products, line.split("Conditions:")[1].strip()))
+            reactants = products = None
+    return blocks
+
+
+def reaction_signature(reactants, products):
+    # Same reactants and products in any order and case
+    return (frozenset(name.strip().lower() for name in reactants.split(', ')),
+            frozenset(name.strip().lower() for name in products.split(', ')))
+
+
+def merge_reaction_blocks(answers):
+    '''
+    Merge the answers of the chunks of one paper: duplicated reactions (same reactants and products) are kept once,
+    with the most detailed conditions, and the reactions are renumbered
+    return: answer text in the format of prompts.reaction_prompt
+    '''
+    merged = {}
+    for answer in answers:
+        for reactants, products, conditions in parse_reaction_blocks(answer):
+            signature = reaction_signature(reactants, products)
+            if signature not in merged:
+                merged[signature] = [reactants, products, conditions]
+            elif len(conditions) > len(merged[signature][2]):
+                merged[signature][2] = conditions
+    return '\n\n'.join(f"Reaction {idx:03d}:\nReactants: {reactants}\nProducts: {products}\nConditions: {conditions}"
+                       for idx, (reactants, products, conditions) in enumerate(merged.values(), 1))
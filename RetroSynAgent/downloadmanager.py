@@ -0,0 +1,202 @@
+'''
+HTTP download engine for PDFDownloader:
+    - one pooled requests.Session (keep-alive connections) shared by all download threads
+    - responses streamed in chunks to `<file>.part`, renamed to the final name once complete
+    - an interrupted download resumes from the size of its .part file with an HTTP Range request, conditional on the
+      ETag / Last-Modified of the first response (If-Range): a file changed on the server is downloaded again
+    - at most `per_host` concurrent requests per host, retries with exponential backoff (Retry-After honoured)
+    - the state of every download persisted in a JSON manifest
+'''
+import contextlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from loguru import logger
+
+retry_status_codes = {408, 425, 429, 500, 502, 503, 504}
+
+
+class DownloadManager:
+    def __init__(self, headers=None, cookies=None, manifest_filename='download_manifest.json', per_host=2,
+                 max_retries=3, backoff=1.0, max_backoff=60.0, chunk_size=64 * 1024, timeout=60, pool_size=10):
+        '''
+        manifest_filename: JSON file of the download states, None to keep them in memory only
+        per_host: maximum number of concurrent requests per host
+        max_retries: retries on connection errors and 408 / 429 / 5xx responses
+        backoff: first retry delay in seconds, doubled on every retry up to max_backoff
+        timeout: connect / read timeout in seconds
+        '''
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+        if cookies:
+            self.session.cookies.update(cookies)
+        self.per_host = per_host
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+        self.manifest_filename = manifest_filename
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        if self.manifest_filename and os.path.exists(self.manifest_filename):
+            with open(self.manifest_filename, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        return {}
+
+    def save_manifest(self):
+        # called with self.lock held
+        if not self.manifest_filename:
+            return
+        tmp_filename = self.manifest_filename + '.tmp'
+        with open(tmp_filename, 'w') as json_file:
+            json.dump(self.manifest, json_file, indent=4)
+        os.replace(tmp_filename, self.manifest_filename)
+
+    def update_state(self, key, **state):
+        with self.lock:
+            entry = self.manifest.setdefault(key, {})
+            entry.update(state, updated_at=time.time())
+            self.save_manifest()
+
+    def get_state(self, key):
+        with self.lock:
+            return dict(self.manifest.get(key, {}))
+
+    def host_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_semaphores[host]
+
+    def request(self, method, url, limit=True, **kwargs):
+        '''
+        Session request under the per-host limit, retried with backoff
+        limit: acquire a per-host slot (False when the caller already holds one)
+        return: response (streamed responses must be closed by the caller)
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            retry_after = None
+            with self.host_semaphore(url) if limit else contextlib.nullcontext():
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                    if response.status_code not in retry_status_codes or attempt >= self.max_retries:
+                        return response
+                    retry_after = response.headers.get('Retry-After')
+                    response.close()
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt >= self.max_retries:
+                        raise
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+            if retry_after is not None and retry_after.isdigit():
+                delay = min(float(retry_after), self.max_backoff)
+            attempt += 1
+            time.sleep(delay)
+
+    def download(self, url, file_path, key=None, content_type='application/pdf'):
+        '''
+        Stream url to file_path, resuming a previous .part file
+        key: manifest key (the url by default)
+        content_type: required Content-Type of the response, None to accept any
+        return: 'done', 'invalid' (wrong content type), 'http_<status>' or 'failed'
+        '''
+        key = key or url
+        part_path = file_path + '.part'
+        attempts = self.get_state(key).get('attempts', 0)
+        resumes = 0
+        while True:
+            attempts += 1
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            self.update_state(key, url=url, path=file_path, status='downloading', bytes=offset, attempts=attempts)
+            # the slot is held for the whole transfer, not only for the response headers
+            with self.host_semaphore(url):
+                status, written, error = self.transfer(url, part_path, offset, content_type, key=key)
+            if status == 'done':
+                os.replace(part_path, file_path)
+            elif status == 'partial' and resumes < self.max_retries:
+                # keep the .part file and resume from it
+                self.update_state(key, status=status, bytes=written, error=error)
+                resumes += 1
+                time.sleep(min(self.backoff * 2 ** (resumes - 1), self.max_backoff))
+                continue
+            elif status == 'partial':
+                status = 'failed'
+            if status == 'failed':
+                logger.error(f"Failed to download {url}: {error}")
+            self.update_state(key, status=status, bytes=written, error=error)
+            return status
+
+    @staticmethod
+    def get_validator(response):
+        # If-Range value of a response: a strong ETag, else Last-Modified (None without either)
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('Last-Modified')
+
+    def transfer(self, url, part_path, offset, content_type, key=None):
+        '''
+        One GET of url appended to part_path from offset (Range request)
+        key: manifest key holding the validator (ETag / Last-Modified) of the file in part_path, the url by default;
+             a .part file without validator is downloaded again from the start
+        return: status ('done', 'partial', 'invalid', 'http_<status>' or 'failed'), bytes in part_path, error
+        '''
+        key = key or url
+        validator = self.get_state(key).get('validator') if offset else None
+        if offset and validator is None:
+            offset = 0
+        headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if offset else {}
+        try:
+            response = self.request('GET', url, limit=False, headers=headers, stream=True)
+        except Exception as e:
+            return 'failed', offset, repr(e)
+        with response:
+            if response.status_code == 416 and offset:
+                # done if the .part file holds the whole file (Content-Range: bytes */<size>), else start over
+                content_range = response.headers.get('Content-Range', '')
+                size = content_range.rpartition('/')[2]
+                if content_range.startswith('bytes */') and size.isdigit() and int(size) == offset:
+                    return 'done', offset, None
+                os.remove(part_path)
+                return 'partial', 0, f'range not satisfiable, Content-Range: {content_range!r}'
+            if response.status_code not in (200, 206):
+                return f'http_{response.status_code}', offset, None
+            received_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+            if content_type is not None and received_type != content_type:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                return 'invalid', 0, f'Content-Type: {received_type}'
+            if response.status_code == 200:
+                # new content (first request, or the file changed since the .part was written)
+                self.update_state(key, validator=self.get_validator(response))
+            # 200: the server ignored the Range header, start over
+            written = offset if response.status_code == 206 else 0
+            expected = response.headers.get('Content-Length')
+            expected = written + int(expected) if expected is not None and expected.isdigit() else None
+            try:
+                with open(part_path, 'ab' if response.status_code == 206 else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+                        written += len(chunk)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                return 'partial', written, repr(e)
+            if expected is not None and written < expected:
+                return 'partial', written, 'connection closed early'
+            return 'done', written, None
+
+    def close(self):
+        self.session.close()
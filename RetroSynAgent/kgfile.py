@@ -0,0 +1,231 @@
+'''
+Streaming export of a KnowledgeGraph (KnowledgeGraph.export_to_json) and the matching loader, which rebuilds
+the graph without parsing the literature results again.
+
+formats:
+    'json'     the former export_to_json file: {"nodes": [{"id", "name"}], "links": [{"source", "target"}]}, indent=4
+    'compact'  one-line JSON {"header": {...}, "nodes": [...], "reactions": [...], "properties": [...], "links": [...]}
+    'ndjson'   one JSON record per line, "type": "header", then "node", "reaction", "property" and "link" records,
+               read back one record at a time (iter_kg_records)
+records (compact / ndjson), written in this order:
+    header     format name, version, number of nodes / reactions / links
+    node       id (1-based, as in the former export), name, kind ('substance' / 'property'), degree, in graph order
+    reaction   idx, reactants / products (node ids), conditions, source
+    property   substance, property, value (names), one record per entry of KnowledgeGraph.properties
+    link       source, target (node ids), reaction (idx) or property (name) of the edge label
+The reactions and properties are the input of KnowledgeGraph: the loader rebuilds the graph from them,
+the links are for readers of the file.
+Files are written through gzip when the name ends with '.gz' (compress=None), gzip input is detected on loading.
+'''
+import gzip
+import json
+from itertools import islice
+
+kg_format = 'retrosynagent-kg'
+kg_version = 1
+reaction_label = 'reaction idx: '
+chunk_size = 10000  # ndjson lines written / parsed at once
+sections = {'node': 'nodes', 'reaction': 'reactions', 'property': 'properties', 'link': 'links'}
+
+
+def open_text(file_path, mode, compress=None):
+    '''
+    mode: 'r' or 'w'
+    compress: gzip the output (None: if file_path ends with '.gz'), input is detected by its magic number
+    '''
+    if mode == 'r':
+        with open(file_path, 'rb') as f:
+            compress = f.read(2) == b'\x1f\x8b'
+    elif compress is None:
+        compress = file_path.endswith('.gz')
+    if compress:
+        return gzip.open(file_path, mode + 't', encoding='utf-8')
+    return open(file_path, mode, encoding='utf-8')
+
+
+def iter_records(kg):
+    '''
+    Records of the compact / ndjson formats, generated from the graph one by one
+    '''
+    G = kg.G
+    node_mapping = {node: i + 1 for i, node in enumerate(G.nodes)}
+    table = kg.table
+    names = table.substances.names
+    # rows of the table with reactants and products: exactly the reactions with edges in G
+    reaction_ids = [reaction_id for reaction_id in range(len(table.reactants))
+                    if table.reactants[reaction_id] and table.products[reaction_id]]
+    yield {'type': 'header', 'format': kg_format, 'version': kg_version, 'nodes': G.number_of_nodes(),
+           'reactions': len(reaction_ids), 'links': G.number_of_edges()}
+    for node, degree in G.degree:
+        yield {'type': 'node', 'id': node_mapping[node], 'name': node,
+               'kind': 'substance' if node in kg.chemical_substances else 'property', 'degree': degree}
+    for reaction_id in reaction_ids:
+        idx = table.reaction_ids.name(reaction_id)
+        reaction = kg.reactions.get(idx, {}) if kg.reactions else {}
+        yield {'type': 'reaction', 'idx': idx,
+               'reactants': [node_mapping[names[substance_id]] for substance_id in table.reactants[reaction_id]],
+               'products': [node_mapping[names[substance_id]] for substance_id in table.products[reaction_id]],
+               'conditions': reaction.get('conditions'), 'source': reaction.get('source')}
+    for substance, prop_dict in kg.properties.items():
+        for prop_name, prop_value in prop_dict.items():
+            yield {'type': 'property', 'substance': substance, 'property': prop_name, 'value': prop_value}
+    for source, target, label in G.edges(data='label'):
+        if label.startswith(reaction_label):
+            yield {'type': 'link', 'source': node_mapping[source], 'target': node_mapping[target],
+                   'reaction': label[len(reaction_label):]}
+        else:
+            yield {'type': 'link', 'source': node_mapping[source], 'target': node_mapping[target], 'property': label}
+
+
+def write_legacy_json(kg, f):
+    # same bytes as json.dump({"nodes": [...], "links": [...]}, f, indent=4), written item by item:
+    # the items have a fixed layout, only the names go through the encoder
+    node_mapping = {node: i + 1 for i, node in enumerate(kg.G.nodes)}
+
+    def write_list(key, items, last):
+        f.write(f'    "{key}": [')
+        first = True
+        for item in items:
+            f.write('\n' if first else ',\n')
+            f.write(item)
+            first = False
+        f.write(']' if first else '\n    ]')
+        f.write('\n' if last else ',\n')
+
+    f.write('{\n')
+    write_list('nodes', (f'        {{\n            "id": {node_mapping[node]},\n            "name": {json.dumps(node)}'
+                         f'\n        }}' for node in kg.G.nodes), False)
+    write_list('links', (f'        {{\n            "source": {node_mapping[source]},\n            "target": '
+                         f'{node_mapping[target]}\n        }}' for source, target in kg.G.edges), True)
+    f.write('}')
+
+
+# one encoder for all the records: json.dumps builds a new one per call when given options
+dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def write_kg_file(kg, file_path, format='json', compress=None):
+    with open_text(file_path, 'w', compress=compress) as f:
+        if format == 'json':
+            write_legacy_json(kg, f)
+        elif format == 'ndjson':
+            lines = []
+            for record in iter_records(kg):
+                lines.append(dumps(record))
+                if len(lines) == chunk_size:
+                    f.write('\n'.join(lines) + '\n')
+                    lines = []
+            if lines:
+                f.write('\n'.join(lines) + '\n')
+        elif format == 'compact':
+            # {"header": {...}, "nodes": [...], ...}, records without their "type"
+            records = iter_records(kg)
+            header = next(records)
+            del header['type']
+            f.write('{"header":' + dumps(header))
+            section = None
+            for record in records:
+                kind = record.pop('type')
+                if kind != section:
+                    f.write(('' if section is None else ']') + f',"{sections[kind]}":[')
+                    section = kind
+                else:
+                    f.write(',')
+                f.write(dumps(record))
+            f.write('}' if section is None else ']}')
+        else:
+            raise ValueError(f"Unknown knowledge graph format: {format}")
+
+
+def iter_kg_records(file_path, links=True):
+    '''
+    Records of a knowledge graph file (all formats, see the module docstring), ndjson files are read line by line
+    The former json format has only node and link records, without attributes.
+    links: False to skip the link records (ndjson lines skipped without being parsed)
+    '''
+    with open_text(file_path, 'r') as f:
+        first_line = f.readline()
+        try:
+            data = json.loads(first_line)  # the header record, or a whole compact file
+        except ValueError:
+            data = json.loads(first_line + f.read())
+        if data.get('type') == 'header':
+            yield data
+            # chunk_size lines parsed at once as one JSON array, much faster than one json.loads per line
+            while True:
+                chunk = list(islice(f, chunk_size))
+                if not chunk:
+                    return
+                lines = [line for line in chunk if line.strip() and (links or not line.startswith('{"type":"link"'))]
+                if lines:
+                    yield from json.loads('[' + ','.join(lines) + ']')
+    if 'header' in data:
+        yield dict(data['header'], type='header')
+    for kind, section in sections.items():
+        if links or kind != 'link':
+            for record in data.get(section, ()):
+                yield dict(record, type=kind)
+
+
+def is_legacy_json(file_path):
+    # the former json format starts with '{' alone on its first line
+    with open_text(file_path, 'r') as f:
+        return f.readline().strip() == '{'
+
+
+def load_kg_file(file_path):
+    '''
+    return: KnowledgeGraph of the exported graph: same nodes in the same order, same edges and labels,
+            reactions (with products) and properties rebuilt from the reaction / link records
+    The edges are not read from the file but built from the reaction and property records as KnowledgeGraph does,
+    files of the former json format (no reaction records, no labels) give the graph of their links.
+    '''
+    import networkx as nx
+    from .knowledgegraph import KnowledgeGraph
+    from .symboltable import SymbolTable, ReactionTable
+
+    kg = KnowledgeGraph.__new__(KnowledgeGraph)
+    kg.table = ReactionTable()
+    substances = kg.table.substances
+    kg.G = G = nx.DiGraph()
+    kg.chemical_substances = set()
+    kg.properties = {}
+    kg.reactions = {}
+    node_names = {}  # file id -> name
+    rows = []  # (idx, reactant ids, product ids) of table.add_ids
+    links = []  # links of the former json format
+    header = None
+    for record in iter_kg_records(file_path, links=is_legacy_json(file_path)):
+        kind = record['type']
+        if kind == 'node':
+            # nodes added in the order of the file: same node order as the exported graph
+            node = node_names[record['id']] = record['name']
+            G.add_node(node)
+        elif kind == 'reaction':
+            reactants = tuple(node_names[node] for node in record['reactants'])
+            products = tuple(node_names[node] for node in record['products'])
+            rows.append((record['idx'], tuple(map(substances.intern, reactants)),
+                         tuple(map(substances.intern, products))))
+            kg.reactions[record['idx']] = {
+                'reactants': reactants,
+                'products': products,
+                'conditions': record['conditions'],
+                'source': record['source'],
+            }
+        elif kind == 'property':
+            kg.properties.setdefault(record['substance'], {})[record['property']] = record['value']
+        elif kind == 'link':
+            links.append((node_names[record['source']], node_names[record['target']]))
+        elif kind == 'header':
+            header = record
+
+    if header is None:
+        G.add_edges_from(links)
+        kg.symbols = SymbolTable(G.nodes)
+        kg.chemical_substances.update(G.nodes)
+    else:
+        # same input, same insertion order as KnowledgeGraph._build_kg
+        kg.table.add_ids(rows)
+        kg.symbols = SymbolTable(substances)
+        kg._build_kg()
+    return kg
@@ -1,62 +1,197 @@
 import json
+import math
 import networkx as nx
+from itertools import chain
 from pyvis.network import Network
 import warnings
+from .symboltable import ReactionTable, SymbolTable
+from .kgfile import write_kg_file, load_kg_file
 warnings.filterwarnings('ignore')
 
+
+def radial_layout(graph, centers=()):
+    '''
+    Layout in linear time for large graphs: every weakly connected component is drawn around a center node
+    (the first of centers in it, else its node of highest degree), a node on the ring of its distance to the center,
+    next to the other neighbors of its parent. Rings hold their nodes one unit apart, components are placed in rows.
+    return: {node: (x, y)}
+    '''
+    undirected = graph.to_undirected(as_view=True)
+    centers = [center for center in centers if center in graph]
+    components = []
+    for component in sorted(nx.connected_components(undirected), key=len, reverse=True):
+        center = next((center for center in centers if center in component), None)
+        if center is None:
+            center = max(component, key=graph.degree)
+        # breadth-first: a ring lists the nodes in the order of their parents on the previous ring
+        rings = [[center]]
+        seen = {center}
+        while True:
+            ring = []
+            for node in rings[-1]:
+                for neighbor in undirected[node]:
+                    if neighbor not in seen:
+                        seen.add(neighbor)
+                        ring.append(neighbor)
+            if not ring:
+                break
+            rings.append(ring)
+        radii = [0.0]
+        for ring in rings[1:]:
+            radii.append(max(radii[-1] + 1, len(ring) / (2 * math.pi)))
+        components.append((rings, radii))
+
+    positions = {}
+    row_width = math.sqrt(sum((2 * radii[-1] + 1) ** 2 for rings, radii in components))
+    x = y = row_height = 0.0
+    for rings, radii in components:
+        size = 2 * radii[-1] + 1
+        if x > 0 and x + size > row_width:
+            x, y, row_height = 0.0, y + row_height, 0.0
+        for ring, radius in zip(rings, radii):
+            for i, node in enumerate(ring):
+                angle = 2 * math.pi * i / len(ring)
+                positions[node] = (x + size / 2 + radius * math.cos(angle), y + size / 2 + radius * math.sin(angle))
+        x += size
+        row_height = max(row_height, size)
+    return positions
+
+
 class KnowledgeGraph:
-    def __init__(self, reactions, properties=None):
+    def __init__(self, reactions, properties=None, table=None):
+        '''
+        table: ReactionTable of the reactions, e.g. tree.reaction_table to reuse the interned reactions of a tree
+               (read only), built from reactions if not given
+        G: nodes are the names of the substances and property values
+        symbols: ids of the nodes in the matrix exports, the substance ids of the table then the property values;
+                 a table of the graph's own, the property values are not interned in a shared table
+        '''
         self.properties = properties if properties is not None else {}
         self.reactions = reactions
+        self.table = table if table is not None else ReactionTable(reactions)
+        self.symbols = SymbolTable(self.table.substances)
         self.G = nx.DiGraph()  # Initialize directed graph
         self.chemical_substances = set()  # Set of chemical substances
         self._build_kg()  # Automatically build the knowledge graph
 
     def _build_kg(self):
+        # All edges are added with one add_edges_from call, in the order of the former add_node / add_edge calls:
+        # same node and edge order, the last reaction of a (reactant, product) pair labels it
+        self.G.add_edges_from(self._iter_edges())
+
+    def _iter_edges(self):
+        # streamed rather than collected in a list: a large list of edge tuples makes the garbage collector
+        # rescan it during insertion
+        intern = self.symbols.intern
         # Process the properties part
         for substance, prop_dict in self.properties.items():
+            intern(substance)
             self.chemical_substances.add(substance)
             for prop_name, prop_value in prop_dict.items():
-                self.G.add_node(substance)  # Add substance node
-                self.G.add_node(prop_value)  # Add value node
-                self.G.add_edge(substance, prop_value, label=prop_name)  # Add property edge
-
-        # Process the reactions part
-        for idx, reaction in self.reactions.items():
-            reactants = reaction["reactants"]
-            products = reaction["products"]
+                intern(prop_value)
+                yield substance, prop_value, {'label': prop_name}  # Add property edge
+
+        # Process the reactions part, on the interned ids of the reaction table
+        table = self.table
+        names = table.substances.names
+        for reaction_id in range(len(table.reactants)):
+            reactants = [names[substance_id] for substance_id in table.reactants[reaction_id]]
+            products = [names[substance_id] for substance_id in table.products[reaction_id]]
             # conditions = reaction["conditions"]
 
             self.chemical_substances.update(reactants)
             self.chemical_substances.update(products)
 
+            # Add reaction edges, label: conditions -> idx
+            attr = {'label': f"reaction idx: {table.reaction_ids.name(reaction_id)}"}
             for reactant in reactants:
                 for product in products:
-                    self.G.add_node(reactant)  # Add reactant node
-                    self.G.add_node(product)  # Add product node
-                    self.G.add_edge(reactant, product, label=f"reaction idx: {idx}")  # Add reaction edge
-                    # label: conditions -> idx
-
-    def export_to_json(self, file_path):
-        # Create nodes with unique ids
-        node_mapping = {node: idx + 1 for idx, node in enumerate(self.G.nodes)}
-        nodes = [{"id": node_mapping[node], "name": node} for node in self.G.nodes]
-
-        # Create links
-        links = [
-            {"source": node_mapping[edge[0]], "target": node_mapping[edge[1]]}
-            for edge in self.G.edges
-        ]
-
-        # Combine into final JSON structure
-        graph_data = {
-            "nodes": nodes,
-            "links": links
-        }
+                    yield reactant, product, attr
+
+    def adjacency_matrix(self):
+        '''
+        Sparse adjacency matrix of G (scipy.sparse.csr_matrix, int8), row / column i is the node of id i (self.name(i)),
+        ids of the symbol table without node in G have empty rows and columns
+        '''
+        # optional dependencies, only needed for the matrix exports
+        import numpy as np
+        from scipy import sparse
+        num_edges = self.G.number_of_edges()
+        ids = self.symbols.ids
+        ends = np.fromiter(map(ids.__getitem__, chain.from_iterable(self.G.edges)), dtype=np.int64,
+                           count=2 * num_edges).reshape(-1, 2)
+        size = len(self.symbols)
+        return sparse.csr_matrix((np.ones(num_edges, dtype=np.int8), (ends[:, 0], ends[:, 1])), shape=(size, size))
+
+    def incidence_matrices(self):
+        '''
+        Reaction hypergraph as two substance x reaction matrices (scipy.sparse.csr_matrix, int8),
+        row i is the substance of id i (self.name(i)), column r the reaction of id r (self.table.reaction_ids):
+        reactants[i, r] = 1 if substance i is a reactant of reaction r, products[i, r] = 1 if it is a product of r
+        The reaction edges of G are the nonzeros of reactants @ products.T, without enumerating reactant x product pairs
+        '''
+        import numpy as np
+        from scipy import sparse
+        shape = (len(self.symbols), len(self.table.reaction_ids))
+
+        def incidence(substance_ids):
+            lengths = np.fromiter(map(len, substance_ids), dtype=np.int64, count=len(substance_ids))
+            rows = np.fromiter(chain.from_iterable(substance_ids), dtype=np.int64, count=int(lengths.sum()))
+            columns = np.repeat(np.arange(len(substance_ids), dtype=np.int64), lengths)
+            matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, columns)), shape=shape)
+            matrix.data[:] = 1  # a substance listed twice in one reaction
+            return matrix
+
+        return incidence(self.table.reactants), incidence(self.table.products)
+
+    def hypergraph(self):
+        '''
+        Reaction hypergraph as a bipartite nx.DiGraph: reactant -> reaction -> product, one edge per listed substance
+        instead of one per (reactant, product) pair.
+        Substance nodes are the names of G ('bipartite': 0), reaction nodes the edge labels of G,
+        "reaction idx: {idx}" ('bipartite': 1)
+        '''
+        table = self.table
+        names = table.substances.names
+        reaction_ids = [reaction_id for reaction_id in range(len(table.reactants))
+                        if table.reactants[reaction_id] or table.products[reaction_id]]
+        substance_ids = set(chain.from_iterable(table.reactants)) | set(chain.from_iterable(table.products))
+        labels = {reaction_id: f"reaction idx: {table.reaction_ids.name(reaction_id)}" for reaction_id in reaction_ids}
+        hypergraph = nx.DiGraph()
+        hypergraph.add_nodes_from((names[substance_id], {'bipartite': 0}) for substance_id in sorted(substance_ids))
+        hypergraph.add_nodes_from((labels[reaction_id], {'bipartite': 1}) for reaction_id in reaction_ids)
+        hypergraph.add_edges_from((names[reactant], labels[reaction_id])
+                                  for reaction_id in reaction_ids for reactant in table.reactants[reaction_id])
+        hypergraph.add_edges_from((labels[reaction_id], names[product])
+                                  for reaction_id in reaction_ids for product in table.products[reaction_id])
+        return hypergraph
 
-        # Save to file
-        with open(file_path, "w") as f:
-            json.dump(graph_data, f, indent=4)
+    def name(self, node_id):
+        # node of a row / column of the matrix exports
+        return self.symbols.name(node_id)
+
+    def node_id(self, node):
+        '''
+        return: row / column of the node in the matrix exports, None if it is not in the graph
+        '''
+        return self.symbols.get(node) if node in self.G else None
+
+    def export_to_json(self, file_path, format='json', compress=None):
+        '''
+        Stream the graph to file_path (see kgfile), without building the lists of nodes and links
+        format: 'json' the former output ({"nodes": [{"id", "name"}], "links": [{"source", "target"}]}, indent=4),
+                'compact' one-line JSON or 'ndjson' one record per line, both with node kind and degree,
+                reaction records and edge labels with their reaction idx / property name, read by KnowledgeGraph.load
+        compress: gzip the output, by default if file_path ends with '.gz'
+        '''
+        write_kg_file(self, file_path, format=format, compress=compress)
+
+    @staticmethod
+    def load(file_path):
+        '''
+        KnowledgeGraph of a file of export_to_json, rebuilt without the literature results
+        '''
+        return load_kg_file(file_path)
 
     def count_nodes(self):
         return self.G.number_of_nodes()
@@ -107,3 +242,105 @@ class KnowledgeGraph:
         }
         """)
         net.show(html_name)
+
+    def neighborhood(self, focus, radius=2, max_nodes=None):
+        '''
+        Nodes within radius edges (None: no limit) of the substance focus (both directions), nearest first
+        max_nodes: keep only the max_nodes nearest nodes
+        '''
+        if focus not in self.G:
+            raise ValueError(f"{focus} is not in the knowledge graph")
+        nodes = [focus]
+        distances = {focus: 0}
+        for node in nodes:
+            if distances[node] == radius or (max_nodes is not None and len(nodes) >= max_nodes):
+                continue
+            for neighbor in chain(self.G.successors(node), self.G.predecessors(node)):
+                if neighbor not in distances:
+                    distances[neighbor] = distances[node] + 1
+                    nodes.append(neighbor)
+        return nodes if max_nodes is None else nodes[:max_nodes]
+
+    def layout_positions(self, nodes, layout='auto', positions=None, centers=(), seed=0):
+        '''
+        Node positions {node: (x, y)} of the subgraph of nodes
+        layout: 'auto' (spring layout up to 1000 nodes, its cost grows with the square of the number of nodes,
+                radial_layout above), 'radial', a networkx layout name ('spring', 'circular', 'kamada_kawai', ...)
+                or function(graph) -> positions
+        positions: precomputed positions {name: (x, y)} (e.g. from an offline layout), the other nodes are placed
+                   by layout (by the spring layout around the given ones)
+        centers: nodes at the center of the radial layout
+        '''
+        subgraph = self.G.subgraph(nodes)
+        fixed = {}
+        for node, position in (positions or {}).items():
+            if node in subgraph:
+                fixed[node] = tuple(position)
+        if len(fixed) == subgraph.number_of_nodes():
+            return fixed
+        if layout == 'auto':
+            layout = 'spring' if subgraph.number_of_nodes() <= 1000 else 'radial'
+        if layout == 'spring' and fixed:
+            return nx.spring_layout(subgraph, pos=fixed, fixed=list(fixed), seed=seed)
+        if layout == 'spring':
+            computed = nx.spring_layout(subgraph, seed=seed)
+        elif layout == 'radial':
+            computed = radial_layout(subgraph, centers=centers)
+        elif callable(layout):
+            computed = layout(subgraph)
+        else:
+            computed = getattr(nx, f"{layout}_layout")(subgraph)
+        return {**computed, **fixed}
+
+    def visualize_kg_static(self, html_name="KG.html", focus=None, radius=2, max_nodes=None, layout='auto',
+                            positions=None, scale=None, edge_labels=False):
+        '''
+        visualize_kg for large graphs (10k+ nodes): positions computed once here instead of by the physics
+        simulation of the browser (physics off), node styles shared through two groups ('substance', 'property')
+        focus: substance name, only its neighborhood (radius, max_nodes: see neighborhood) is drawn
+        max_nodes: without focus, draw only the max_nodes nodes of highest degree
+        layout / positions: see layout_positions
+        scale: pixels per layout unit, by default the layout spans 100 pixels times the square root of the number of nodes
+        edge_labels: draw the edge labels (reaction idx / property name), otherwise shown on hover only
+        '''
+        if focus is not None:
+            nodes = self.neighborhood(focus, radius=radius, max_nodes=max_nodes)
+        elif max_nodes is not None and self.G.number_of_nodes() > max_nodes:
+            nodes = sorted(self.G.nodes, key=self.G.degree, reverse=True)[:max_nodes]
+        else:
+            nodes = list(self.G.nodes)
+        centers = [focus] if focus is not None else ()
+        coordinates = self.layout_positions(nodes, layout=layout, positions=positions, centers=centers)
+        # layouts in [-1, 1] (networkx) or in node spacings (radial): rescaled to about 100 pixels between nodes
+        extent = max((max(abs(x), abs(y)) for x, y in coordinates.values()), default=1.0) or 1.0
+        scale = scale if scale is not None else 100 * math.sqrt(len(nodes)) / extent
+
+        net = Network(notebook=True, height="750px", width="100%", directed=True)
+        # the node / edge lists of pyvis are filled directly: add_node / add_edge check the node ids
+        # against a list, quadratic in the number of nodes
+        for node in nodes:
+            x, y = coordinates[node]
+            options = {'id': node, 'label': node, 'title': node, 'x': float(x) * scale, 'y': float(y) * scale,
+                       'group': 'substance' if node in self.chemical_substances else 'property'}
+            net.nodes.append(options)
+            net.node_ids.append(node)
+            net.node_map[node] = options
+        for source, target, label in self.G.subgraph(nodes).edges(data='label'):
+            edge = {'from': source, 'to': target, 'title': label}
+            if edge_labels:
+                edge['label'] = label
+            net.edges.append(edge)
+
+        def group(background):
+            return {'shape': 'circle', 'borderWidth': 1, 'font': {'size': 10},
+                    'color': {'background': background, 'border': 'gray',
+                              'highlight': {'border': 'gray', 'background': background}}}
+
+        net.options = {
+            'physics': {'enabled': False},
+            'groups': {'substance': group('pink'), 'property': group('lightblue')},
+            'edges': {'arrows': {'to': {'enabled': True}}, 'color': {'color': 'gray'}, 'smooth': False},
+            'interaction': {'hideEdgesOnDrag': True, 'tooltipDelay': 200},
+        }
+        net.show(html_name)
+        return net
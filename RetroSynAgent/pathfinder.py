@@ -0,0 +1,179 @@
+'''
+Reaction pathway enumeration on the retrosynthetic tree.
+
+A pathway is the set of reactions that obtains the target from common chemicals:
+    leaf node         -> one empty pathway
+    substance node    -> union over the reactions producing it (OR)
+    reaction (group)  -> the reaction + one pathway of every reactant (AND)
+Only minimal pathways are kept (no other pathway is a subset).
+
+The pathways are searched best-first, smallest first: a search state is a partial pathway (bitset of the reactions
+chosen so far, over the interned reaction ids of the tree, see pathwayset.py) with the substances still to be
+obtained. The state with the fewest reactions is expanded by choosing a reaction for its first open substance,
+substances that the chosen reactions already obtain are closed without a new reaction. Complete states therefore
+come out by increasing number of reactions, a complete pathway is minimal unless it contains a pathway found before,
+and states containing a pathway found before are dropped. Nothing is computed ahead of the first pathway, so limit
+and max_depth bound the search itself.
+'''
+import heapq
+import itertools
+from .pathwayset import SubsetIndex
+from .symboltable import SymbolTable
+
+
+class PathwayEnumerator:
+    def __init__(self, root, expander=None, max_depth=None):
+        '''
+        root: root Node of the tree
+        expander: TreeExpander that built the tree, the search then runs on its shared AND/OR graph
+        max_depth: maximum number of consecutive reactions from the target, None for unlimited
+        '''
+        self.root = root
+        self.expander = expander
+        self.max_depth = max_depth
+        self.reaction_ids = root.context.reaction_ids  # reaction id -> idx (str)
+        self.bits = SymbolTable()  # reaction id -> bit, dense over the reactions of the tree only
+        self.groups = {}  # item -> get_groups(item)
+
+    def get_groups(self, item):
+        '''
+        return: is_leaf, [(bit, reaction id, [child item, ...]), ...] with children grouped by reaction id
+        '''
+        result = self.groups.get(item)
+        if result is not None:
+            return result
+        groups = {}
+        if self.expander is not None:
+            entry = self.expander.graph[item]
+            is_leaf = entry.is_leaf
+            for reaction_id, child_keys in entry.options:
+                groups.setdefault(reaction_id, []).extend(child_keys)
+        else:
+            is_leaf = item.is_leaf
+            for child in item.children:
+                groups.setdefault(child.reaction_id, []).append(child)
+        result = is_leaf, [(1 << self.bits.intern(reaction_id), reaction_id, children)
+                           for reaction_id, children in groups.items()]
+        self.groups[item] = result
+        return result
+
+    def child_depth(self, depth):
+        # Depths are only tracked under max_depth, otherwise every occurrence of an item is the same search item
+        return depth + 1 if self.max_depth is not None else 0
+
+    def is_obtained(self, item, depth, mask, memo):
+        '''
+        item (at depth) can be obtained from common chemicals with the reactions of mask only
+        memo: {(item, depth): bool} for this mask
+        '''
+        key = (item, depth)
+        result = memo.get(key)
+        if result is not None:
+            return result
+        is_leaf, groups = self.get_groups(item)
+        if is_leaf:
+            result = True
+        elif self.max_depth is not None and depth >= self.max_depth:
+            result = False
+        else:
+            result = any(bit & mask and all(self.is_obtained(child, self.child_depth(depth), mask, memo)
+                                            for child in children)
+                         for bit, reaction_id, children in groups)
+        memo[key] = result
+        return result
+
+    def get_root_item(self):
+        if self.expander is not None:
+            return self.expander.root_entry.key
+        return self.root
+
+    def search(self):
+        '''
+        Yield (bitset, (reaction id, ...)) of the minimal pathways, the pathways with the fewest reactions first
+        A state is (reactions + 1 if open substances remain, number of open substances, tie, pathways found when
+        queued, bitset, reactions, open (item, depth) in the order they are expanded); the first count never
+        overestimates the reactions of a completion.
+        '''
+        found = SubsetIndex()
+        seen = set()  # (bitset, open items) already queued
+        tie = itertools.count()
+        start = ((self.get_root_item(), 0),)
+        start = tuple(item for item in start if not self.is_obtained(*item, 0, {}))
+        heap = [(1 if start else 0, len(start), next(tie), 0, 0, (), start)]
+        while heap:
+            _, _, _, num_found, mask, path, open_items = heapq.heappop(heap)
+            # Equal to or containing a pathway found since the state was queued
+            if len(found) > num_found and found.has_subset(mask):
+                continue
+            if not open_items:
+                found.add(mask)
+                yield mask, path
+                continue
+            (item, depth), rest = open_items[0], open_items[1:]
+            if self.max_depth is not None and depth >= self.max_depth:
+                continue
+            children_depth = self.child_depth(depth)
+            for bit, reaction_id, children in self.get_groups(item)[1]:
+                if bit & mask:
+                    # The reaction is in the pathway already, some of its reactants are still open
+                    new_mask, new_path = mask, path
+                else:
+                    new_mask, new_path = mask | bit, path + (reaction_id,)
+                memo = {}
+                new_open = tuple(open_item for open_item in
+                                 dict.fromkeys([(child, children_depth) for child in children] + list(rest))
+                                 if not self.is_obtained(*open_item, new_mask, memo))
+                state = (new_mask, frozenset(new_open))
+                if state in seen:
+                    continue
+                seen.add(state)
+                heapq.heappush(heap, (new_mask.bit_count() + (1 if new_open else 0), len(new_open), next(tie),
+                                      len(found), new_mask, new_path, new_open))
+
+    def __iter__(self):
+        """
+        Yield the minimal pathways of the tree, the smallest pathways first
+        """
+        names = self.reaction_ids.names
+        for mask, path in self.search():
+            yield [names[reaction_id] for reaction_id in path]
+
+    def count(self, limit=None):
+        '''
+        Number of minimal pathways (at most limit): the search runs without building the pathway lists, only the
+        bitsets of the pathways found are kept (later pathways are checked against them)
+        '''
+        total = 0
+        for _ in self.search():
+            total += 1
+            if limit is not None and total >= limit:
+                break
+        return total
+
+    def count_raw(self):
+        '''
+        Number of pathways before superset removal (what search_reaction_pathways would build), without enumerating them
+        '''
+        counts = {}
+
+        def count(item, depth):
+            memo_key = item if self.expander is not None else id(item)
+            memo_key = (memo_key, depth if self.max_depth is not None else None)
+            if memo_key in counts:
+                return counts[memo_key]
+            is_leaf, groups = self.get_groups(item)
+            if is_leaf:
+                total = 1
+            elif self.max_depth is not None and depth >= self.max_depth:
+                total = 0
+            else:
+                total = 0
+                for bit, reaction_id, children in groups:
+                    product = 1
+                    for child in children:
+                        product *= count(child, depth + 1)
+                    total += product
+            counts[memo_key] = total
+            return total
+
+        return count(self.get_root_item(), 0)
@@ -0,0 +1,120 @@
+'''
+Reaction pathways as integer bitsets: bit i is set when the reaction with interned id i is used.
+    subset test       a ⊆ b  <=>  a & b == a
+    union of pathways a | b
+'''
+from .symboltable import SymbolTable
+
+
+class SubsetIndex:
+    '''
+    Set of bitsets as a trie over their bits in increasing order (set-trie): a subset of a query bitset is found by
+    only following the branches of the query's own bits
+    '''
+    END = -1  # key of the trie nodes where a stored bitset ends
+
+    def __init__(self):
+        self.trie = {}
+        self.count = 0
+
+    @staticmethod
+    def bits(mask):
+        bits = []
+        while mask:
+            low_bit = mask & -mask
+            bits.append(low_bit.bit_length() - 1)
+            mask ^= low_bit
+        return bits
+
+    def add(self, mask):
+        node = self.trie
+        for bit in self.bits(mask):
+            node = node.setdefault(bit, {})
+        if self.END not in node:
+            node[self.END] = True
+            self.count += 1
+
+    def has_subset(self, mask):
+        '''
+        return: a stored bitset is a subset of mask (or equal to it)
+        '''
+        if self.END in self.trie:
+            return True
+        bits = self.bits(mask)
+        stack = [(self.trie, 0)]
+        while stack:
+            node, start = stack.pop()
+            for i in range(start, len(bits)):
+                child = node.get(bits[i])
+                if child is not None:
+                    if self.END in child:
+                        return True
+                    stack.append((child, i + 1))
+        return False
+
+    def __len__(self):
+        return self.count
+
+
+def minimal_indices(masks):
+    """
+    Indices of the minimal bitsets: no other bitset is a proper subset, identical bitsets are kept once (first one)
+    Bitsets are checked by increasing cardinality against the kept ones (SubsetIndex).
+    :return: sorted list of indices into masks
+    """
+    first = {}
+    for i, mask in enumerate(masks):
+        first.setdefault(mask, i)
+    index = SubsetIndex()
+    kept = []
+    for mask in sorted(first, key=int.bit_count):
+        if not index.has_subset(mask):
+            index.add(mask)
+            kept.append(first[mask])
+    kept.sort()
+    return kept
+
+
+class PathwaySet:
+    '''
+    Set of reaction pathways [idx (str), ...] kept alongside their bitsets over interned reaction idx
+    '''
+    def __init__(self, paths=(), symbols=None):
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        self.paths = []
+        self.masks = []
+        for path in paths:
+            self.add(path)
+
+    def encode(self, path):
+        mask = 0
+        for idx in path:
+            mask |= 1 << self.symbols.intern(idx)
+        return mask
+
+    def decode(self, mask):
+        path = []
+        while mask:
+            low_bit = mask & -mask
+            path.append(self.symbols.name(low_bit.bit_length() - 1))
+            mask ^= low_bit
+        return path
+
+    def add(self, path, mask=None):
+        self.paths.append(path)
+        self.masks.append(self.encode(path) if mask is None else mask)
+
+    def minimize(self):
+        '''
+        Keep only the minimal pathways (in place), in their original order
+        '''
+        kept = minimal_indices(self.masks)
+        self.paths = [self.paths[i] for i in kept]
+        self.masks = [self.masks[i] for i in kept]
+        return self
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
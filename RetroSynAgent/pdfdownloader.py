@@ -1,18 +1,33 @@
 import os
 import re
-import requests
 from loguru import logger
 import json
 import random
 import glob
 import difflib
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from scholarly import scholarly
 from dotenv import load_dotenv
 import os
+from .titleindex import TitleIndex
+from .downloadmanager import DownloadManager
+
+
+def load_browser_headers():
+    # HEADERS / COOKIES of the browser session (.env)
+    load_dotenv()
+    headers_dict = os.getenv("HEADERS")
+    cookies_dict = os.getenv("COOKIES")
+    return json.loads(headers_dict), json.loads(cookies_dict)
+
 
 class PDFDownloader:
-    def __init__(self, material, pdf_folder_name ,num_results = 5, n_thread=3):
+    def __init__(self, material, pdf_folder_name ,num_results = 5, n_thread=3, per_host=2, download_manager=None):
+        '''
+        download_manager: DownloadManager shared by several downloaders (one per-host limit for all of them),
+                          by default a DownloadManager with its manifest in the pdf folder
+        '''
         self.pdf_folder_name = pdf_folder_name
         self.no_download_link_json_name = 'no_download_link_titles.json'
         self.query = material + ' AND synthesis'
@@ -22,11 +37,13 @@ class PDFDownloader:
         self.no_download_link_titles = self.read_data_from_json(self.no_download_link_json_name) if os.path.exists(
             self.no_download_link_json_name) else []
 
-        load_dotenv()
-        headers_dict = os.getenv("HEADERS")
-        self.headers = json.loads(headers_dict)
-        cookies_dict = os.getenv("COOKIES")
-        self.cookies = json.loads(cookies_dict)
+        self.headers, self.cookies = load_browser_headers()
+        # pooled session, per-host limits and a download manifest in the pdf folder (see downloadmanager.py)
+        if download_manager is None:
+            download_manager = DownloadManager(self.headers, self.cookies, per_host=per_host,
+                                               manifest_filename=os.path.join(pdf_folder_name, 'download_manifest.json'))
+        self.download_manager = download_manager
+        self.lock = threading.Lock()
 
     # version2
     def get_scholar_titles(self, query, num_results, citations=0):
@@ -68,6 +85,12 @@ class PDFDownloader:
 
     def check_pdf_existence(self, target_pdf_name, pdf_name_list):
         similarity_threshold = 0.9
+        if isinstance(pdf_name_list, TitleIndex):
+            # the index compares with its own threshold
+            if pdf_name_list.threshold != similarity_threshold:
+                raise ValueError(f"TitleIndex threshold {pdf_name_list.threshold} "
+                                 f"differs from similarity_threshold {similarity_threshold}")
+            return target_pdf_name in pdf_name_list
         for pdf_name in pdf_name_list:
             similarity = difflib.SequenceMatcher(None, target_pdf_name, pdf_name).ratio()
             if similarity > similarity_threshold:
@@ -77,7 +100,7 @@ class PDFDownloader:
     def title_href(self, title):
         data = {"request": str(title)}
         try:
-            res = requests.post(self.url, headers=self.headers, data=data, cookies=self.cookies)
+            res = self.download_manager.request('POST', self.url, data=data)
             _href = re.findall("""<button onclick = "location.href='(.*?)'">&darr;""", res.text)
             if _href:
                 _href = _href[0]
@@ -90,8 +113,7 @@ class PDFDownloader:
 
             elif '<p id = "smile">:(</p>' in res.text:
                 # logger.error(f"No download link for {title} in sci-hub")
-                self.no_download_link_titles.append(title)
-                self.save_data_as_json(self.no_download_link_json_name, self.no_download_link_titles)
+                self.add_no_download_link_title(title)
                 return None
             else:
                 # logger.error(f"Failed to get download link for title: {title}, status_code: {res.status_code}")
@@ -100,23 +122,25 @@ class PDFDownloader:
             # logger.error(e)
             return None
 
+    def add_no_download_link_title(self, title):
+        with self.lock:
+            self.no_download_link_titles.append(title)
+            self.save_data_as_json(self.no_download_link_json_name, self.no_download_link_titles)
+
     def get_download_pdf(self, href, title):
         try:
-            res = requests.get(href, headers=self.headers, cookies=self.cookies)
-            if res.status_code == 200:
-                file_name = f"{str(title).replace(':', '').replace('/', '').replace('*', '').replace('|', '').replace('?', '')}.pdf"
-                file_path = os.path.join(os.getcwd(), self.pdf_folder_name, file_name)
-                if res.headers.get('Content-Type') == 'application/pdf':
-                    with open(file_path, 'wb') as f:
-                        f.write(res.content)
-                        logger.info(f"{file_name} successfully saved!")
-                else:
-                    logger.error(f"{file_name} is invalid pdf file")
-            else:
-                logger.error(f"Failed to download pdf for {title}, status code: {res.status_code}")
-                if res.status_code == 404:
-                    self.no_download_link_titles.append(title)
-                    self.save_data_as_json(self.no_download_link_json_name, self.no_download_link_titles)
+            file_name = f"{str(title).replace(':', '').replace('/', '').replace('*', '').replace('|', '').replace('?', '')}.pdf"
+            file_path = os.path.join(os.getcwd(), self.pdf_folder_name, file_name)
+            # streamed to <file_path>.part and renamed when complete, resumed if interrupted
+            status = self.download_manager.download(href, file_path, key=title)
+            if status == 'done':
+                logger.info(f"{file_name} successfully saved!")
+            elif status == 'invalid':
+                logger.error(f"{file_name} is invalid pdf file")
+            elif status.startswith('http_'):
+                logger.error(f"Failed to download pdf for {title}, status code: {status[5:]}")
+                if status == 'http_404':
+                    self.add_no_download_link_title(title)
         except Exception as e:
             logger.error(e)
 
@@ -134,10 +158,12 @@ class PDFDownloader:
     def filter_titles(self, titles):
         pdf_file_list = self.get_pdf_files()
         pdf_name_list = [pdf.split('.pdf')[0] for pdf in pdf_file_list]
+        pdf_name_index = TitleIndex(pdf_name_list, threshold=0.9)
+        no_download_link_index = TitleIndex(self.no_download_link_titles, threshold=0.9)
 
-        titles_filtered1 = [title for title in titles if not self.check_pdf_existence(title, pdf_name_list)]
+        titles_filtered1 = [title for title in titles if not self.check_pdf_existence(title, pdf_name_index)]
         titles_filtered2 = [title for title in titles_filtered1 if
-                            not self.check_pdf_existence(title, self.no_download_link_titles)]
+                            not self.check_pdf_existence(title, no_download_link_index)]
         return titles_filtered2
 
     def main(self):
@@ -1,15 +1,72 @@
 import os
+import copy
+import contextlib
 import json
+import threading
+import time
 import fitz  # PyMuPDF
 import re
 from tqdm import tqdm
 import difflib
 import glob
 from . import prompts
-from .GPTAPI import GPTAPI
-import base64
-from io import BytesIO
-from PIL import Image
+from .GPTAPI import GPTAPI, llm_metrics
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .ratelimiter import RateLimiter
+from .rasterizer import Rasterizer
+from .titleindex import TitleIndex
+from .chunker import count_tokens, chunk_text, merge_reaction_blocks
+
+
+def extract_pdf_content(pdf_path, with_images=False, image_options=None):
+    '''
+    Text (and page images) of one PDF, run in the extraction worker processes of PDFProcessor.process_pdfs_pipeline
+    image_options: keyword arguments of pdf_to_base64_img_list
+    return: cleaned_text, base64_img_list (empty without images)
+    '''
+    processor = PDFProcessor()
+    base64_img_list = processor.pdf_to_base64_img_list(pdf_path, **(image_options or {})) if with_images else []
+    cleaned_text = processor.pdf_to_long_string(pdf_path, remove_references=True)
+    return cleaned_text, base64_img_list
+
+
+kept_char_pattern = re.compile(r'[\w\s,.]')
+removed_chars_pattern = re.compile(r'[^\w\s,.]+')
+
+
+def upper_length(text, end, chunk=65536):
+    # len(text[:end].upper()) chunk by chunk: upper() maps character by character, some characters expand (ß -> SS)
+    length = 0
+    for i in range(0, end, chunk):
+        piece = text[i:min(i + chunk, end)]
+        length += len(piece) if piece.isascii() else len(piece.upper())
+    return length
+
+
+def rfind_ignore_case(text, keyword, window=65536):
+    '''
+    Same result as text.upper().rfind(keyword) without upper-casing the whole text: windows from the end of the text
+    are upper-cased and searched, growing until the keyword is found. upper() maps each character on its own, so
+    text.upper() is the concatenation of the upper-cased windows and the position is offset by the upper-cased
+    length of the text before the window (non-ASCII text included)
+    '''
+    end = len(text)
+    window = max(window, 2 * len(keyword))
+    while True:
+        start = max(0, end - window)
+        pos = text[start:end].upper().rfind(keyword)
+        if pos != -1:
+            return upper_length(text, start) + pos
+        if start == 0:
+            return -1
+        # an occurrence across `start` spans at most len(keyword) characters, it is found in the next window
+        end = start + len(keyword) - 1
+        window *= 2
+
+
+def estimate_tokens(text, num_images=0, tokens_per_image=765, model='gpt-4o'):
+    # A high-detail 1024x1024 image is billed 765 tokens
+    return count_tokens(text, model) + num_images * tokens_per_image
 
 
 class PDFProcessor:
@@ -19,6 +76,7 @@ class PDFProcessor:
         self.result_json_name = result_json_name
         self.result_dict = {}
         self.processed_pdf_list = []
+        self.chunk_metrics = {}  # pdf name -> per-chunk metrics of extract_reactions
 
     def load_existing_results(self):
         if os.path.exists(self.result_folder_name + '/'  + self.result_json_name + '.json'):
@@ -33,8 +91,33 @@ class PDFProcessor:
         pdf_files = glob.glob(os.path.join(directory, '*.pdf'))
         return [os.path.basename(file) for file in pdf_files]
 
+    def get_pdf_files_to_process(self):
+        '''
+        PDF files in pdf_folder_name whose title is not in processed_pdf_list (see load_existing_results)
+        '''
+        pdf_file_list = self.get_pdf_files(self.pdf_folder_name)
+        pdf_name_list = [pdf.split('.pdf')[0] for pdf in pdf_file_list]
+        processed_index = TitleIndex(self.processed_pdf_list, threshold=0.9)
+
+        pdf_name_to_process = [
+            title for title in pdf_name_list
+            if not self.check_pdf_existence(title, processed_index)
+        ]
+        print(f'Total number of titles: {len(pdf_name_list)}, '
+              f'{len(self.processed_pdf_list)} have been processed by MLLM, '
+              f'{len(pdf_name_to_process)} are planned to be processed by MLLM')
+        return [pdf_name + '.pdf' for pdf_name in pdf_name_to_process]
+
     @staticmethod
     def check_pdf_existence(target_pdf_name, pdf_name_list, similarity_threshold=0.9):
+        '''
+        pdf_name_list: list of titles, or a TitleIndex built with threshold=similarity_threshold
+        '''
+        if isinstance(pdf_name_list, TitleIndex):
+            if pdf_name_list.threshold != similarity_threshold:
+                raise ValueError(f"TitleIndex threshold {pdf_name_list.threshold} "
+                                 f"differs from similarity_threshold {similarity_threshold}")
+            return target_pdf_name in pdf_name_list
         for pdf_name in pdf_name_list:
             similarity = difflib.SequenceMatcher(None, target_pdf_name, pdf_name).ratio()
             if similarity > similarity_threshold:
@@ -48,40 +131,29 @@ class PDFProcessor:
 
     @staticmethod
     def save_data_as_json(filename, data):
-        with open(filename, 'w') as json_file:
+        # Write to a temporary file and rename, an interrupted save never leaves a truncated result JSON
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as json_file:
             json.dump(data, json_file, indent=4)
+        os.replace(tmp_filename, filename)
 
-    def pdf_to_base64_img_list(self, pdf_path, zoom_x=3.0, zoom_y=3.0):
+    def pdf_to_base64_img_list(self, pdf_path, zoom_x=3.0, zoom_y=3.0, **options):
         """
         Convert each page of the PDF file to a single image and output it as a Base64 encoded string.
+        options: image_format, quality, text_only_pages, text_only_zoom, workers (see Rasterizer)
         """
-        doc = fitz.open(pdf_path)
-        base64_images = []
-
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            matrix = fitz.Matrix(zoom_x, zoom_y)
-            pix = page.get_pixmap(matrix=matrix)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-            # Convert the image to a Base64 string
-            buffered = BytesIO()
-            img.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-
-            base64_images.append(img_base64)
+        return [img_base64 for page_num, img_base64 in self.iter_base64_images(pdf_path, zoom_x, zoom_y, **options)]
 
-        doc.close()
-
-        return base64_images
+    def iter_base64_images(self, pdf_path, zoom_x=3.0, zoom_y=3.0, **options):
+        """
+        Streaming version of pdf_to_base64_img_list: yield (page number, Base64 image) in page order
+        """
+        return Rasterizer(zoom_x=zoom_x, zoom_y=zoom_y, **options).iter_pages(pdf_path)
 
     def remove_references_section(self, text, keyword="REFERENCES"):
-        # Find the position of the keyword
-        # Convert both the keyword and cleaned_text to uppercase, then find the position of the keyword (this ensures case-insensitive matching)
-        keyword_pos = text.upper().rfind(keyword)
-        # rfind starts searching from the right, meaning if the keyword appears multiple times, the last occurrence is used
-        # keyword_lower = keyword.lower()
-        # keyword_pos = self.cleaned_text.lower().find(keyword_lower)
+        # Find the position of the last occurrence of the keyword, case-insensitive
+        # (rfind starts searching from the right, if the keyword appears multiple times, the last occurrence is used)
+        keyword_pos = rfind_ignore_case(text, keyword)
         # If the keyword is found, truncate the string
         if keyword_pos != -1:
             text_filtered_reference = text[:keyword_pos].strip()
@@ -89,36 +161,84 @@ class PDFProcessor:
             text_filtered_reference = text
         return text_filtered_reference
 
+    @staticmethod
+    def clean_text(raw_text, max_replace=32):
+        '''
+        Collapse whitespace (line breaks included), then drop everything but word characters, spaces, commas and periods.
+        str.split() splits on the same characters as \\s, the characters to drop are found among the distinct characters
+        of the text and removed with str.replace (memchr-fast), or one regex pass when there are more than max_replace
+        '''
+        text = ' '.join(raw_text.split())
+        removed_chars = [char for char in set(text) if not kept_char_pattern.match(char)]
+        if len(removed_chars) > max_replace:
+            text = removed_chars_pattern.sub('', text)
+        else:
+            for char in removed_chars:
+                text = text.replace(char, '')
+        return text.strip()
+
     def pdf_to_long_string(self, pdf_path, remove_references=True):
-        document = fitz.open(pdf_path)
-        raw_text = ''
-        for page_num in range(len(document)):
-            page = document.load_page(page_num)
-            raw_text += page.get_text()
-        document.close()
-        text = raw_text.replace("\n", " ").replace("\r", " ")
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'[^\w\s,.]', '', text)
-        cleaned_text = text.strip()
+        with fitz.open(pdf_path) as document:
+            raw_text = ''.join(page.get_text() for page in document)
+        cleaned_text = self.clean_text(raw_text)
         if remove_references:
             cleaned_text = self.remove_references_section(cleaned_text)
         return cleaned_text
 
+    def extract_reactions(self, llm, cleaned_text, base64_img_list=None, image_format='png', pdf_name=None,
+                          max_tokens=50000, chunk_tokens=16000, overlap_tokens=500, max_concurrency=4,
+                          token_limiter=None, request_slots=None):
+        '''
+        Extract the reactions of one paper. A text of at most max_tokens is sent in one request (with the page
+        images if any), a longer one is split into chunks of chunk_tokens at section boundaries, the chunks are
+        extracted concurrently (text only) and their reaction blocks are merged and deduplicated.
+        pdf_name: key of the per-chunk metrics in self.chunk_metrics
+        token_limiter: RateLimiter of the input token budget
+        request_slots: semaphore held by every request while it is in flight, shared by the papers extracted
+                       concurrently so their requests (chunks included) stay within one limit
+        return: answer in the format of prompts.reaction_prompt
+        '''
+        prompt = prompts.reaction_prompt
+        base64_img_list = base64_img_list or []
 
-    def process_pdfs_img_txt(self, save_batch_size=3, material=None):
+        def ask(chunk_idx, text, images):
+            chunk_llm = copy.copy(llm)  # shared client, cache and metrics, own last_call
+            tokens = estimate_tokens(text, len(images), model=llm.model)
+            with request_slots if request_slots is not None else contextlib.nullcontext():
+                if token_limiter is not None:
+                    token_limiter.acquire(tokens)
+                start = time.perf_counter()
+                if images:
+                    answer = chunk_llm.answer_w_vision_img_list_txt(prompt, images, text, image_format)
+                else:
+                    answer = chunk_llm.answer_wo_vision(prompt, text)
+            call = chunk_llm.last_call or {}
+            metrics = {'chunk': chunk_idx, 'tokens': tokens, 'latency': round(time.perf_counter() - start, 3),
+                       'prompt_tokens': call.get('prompt_tokens', 0), 'completion_tokens': call.get('completion_tokens', 0),
+                       'retries': call.get('retries', 0), 'cached': call.get('cached', False)}
+            return answer, metrics
 
-        pdf_file_list = self.get_pdf_files(self.pdf_folder_name)
-        pdf_name_list = [pdf.split('.pdf')[0] for pdf in pdf_file_list]
+        if count_tokens(cleaned_text, llm.model) <= max_tokens:
+            answer, metrics = ask(0, cleaned_text, base64_img_list)
+            self.chunk_metrics[pdf_name] = [metrics]
+            return answer
 
-        pdf_name_to_process = [
-            title for title in pdf_name_list
-            if not self.check_pdf_existence(title, self.processed_pdf_list)
-        ]
-        pdf_file_to_process = [pdf_name + '.pdf' for pdf_name in pdf_name_to_process]
+        chunks = chunk_text(cleaned_text, max_tokens=chunk_tokens, overlap_tokens=overlap_tokens, model=llm.model)
+        print(f'{pdf_name}: {count_tokens(cleaned_text, llm.model)} tokens, extracting {len(chunks)} chunks'
+              + (' (text only)' if base64_img_list else ''))
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            results = list(executor.map(ask, range(len(chunks)), chunks, [[]] * len(chunks)))
+        answers = [answer for answer, metrics in results]
+        self.chunk_metrics[pdf_name] = [metrics for answer, metrics in results]
+        return merge_reaction_blocks(answers)
 
-        print(f'Total number of titles: {len(pdf_name_list)}, '
-              f'{len(self.processed_pdf_list)} have been processed by MLLM, '
-              f'{len(pdf_name_to_process)} are planned to be processed by MLLM')
+    def process_pdfs_img_txt(self, save_batch_size=3, material=None, max_tokens=50000, chunk_tokens=16000,
+                             overlap_tokens=500, max_concurrency=4):
+        '''
+        Papers longer than max_tokens are extracted in chunks of chunk_tokens (text only, see extract_reactions)
+        '''
+
+        pdf_file_to_process = self.get_pdf_files_to_process()
 
         os.makedirs(self.result_folder_name, exist_ok=True)
         counter = 0
@@ -126,17 +246,13 @@ class PDFProcessor:
             pdf_name = pdf_path.replace('.pdf', '')
             base64_img_list = self.pdf_to_base64_img_list(os.path.join(self.pdf_folder_name, pdf_path))
             cleaned_text = self.pdf_to_long_string(os.path.join(self.pdf_folder_name, pdf_path), remove_references=True)
-            total_length = len(base64_img_list)+len(cleaned_text)
             print(f'Processing: {pdf_name}, TXT Length: {len(cleaned_text)}, IMG Num: {len(base64_img_list)}')
-            # todo: max length
-            if total_length > 200000:
-                print(f'{pdf_name} Exceed maximum length, skip ...')
-                continue
             # Extract the reaction first, then extract the property based on the reaction
             # extract reaction
             llm = GPTAPI()
-            prompt = prompts.reaction_prompt
-            answer_reaction = llm.answer_w_vision_img_list_txt(prompt, base64_img_list, cleaned_text)
+            answer_reaction = self.extract_reactions(llm, cleaned_text, base64_img_list, pdf_name=pdf_name,
+                                                     max_tokens=max_tokens, chunk_tokens=chunk_tokens,
+                                                     overlap_tokens=overlap_tokens, max_concurrency=max_concurrency)
             # answer_reaction = llm.answer_wo_vision(prompt, cleaned_text)
             # extract property
             # prompt2 = prompts.property_prompt.format(reactions=answer_reaction)
@@ -160,20 +276,13 @@ class PDFProcessor:
         return reactions_txt
 
 
-    def process_pdfs_txt(self, save_batch_size=3, material=None):
+    def process_pdfs_txt(self, save_batch_size=3, material=None, max_tokens=50000, chunk_tokens=16000,
+                         overlap_tokens=500, max_concurrency=4):
+        '''
+        Papers longer than max_tokens are extracted in chunks of chunk_tokens (see extract_reactions)
+        '''
 
-        pdf_file_list = self.get_pdf_files(self.pdf_folder_name)
-        pdf_name_list = [pdf.split('.pdf')[0] for pdf in pdf_file_list]
-
-        pdf_name_to_process = [
-            title for title in pdf_name_list
-            if not self.check_pdf_existence(title, self.processed_pdf_list)
-        ]
-        pdf_file_to_process = [pdf_name + '.pdf' for pdf_name in pdf_name_to_process]
-
-        print(f'Total number of titles: {len(pdf_name_list)}, '
-              f'{len(self.processed_pdf_list)} have been processed by MLLM, '
-              f'{len(pdf_name_to_process)} are planned to be processed by MLLM')
+        pdf_file_to_process = self.get_pdf_files_to_process()
 
         os.makedirs(self.result_folder_name, exist_ok=True)
         counter = 0
@@ -183,12 +292,10 @@ class PDFProcessor:
             cleaned_text = self.pdf_to_long_string(os.path.join(self.pdf_folder_name, pdf_path))
             total_length = len(cleaned_text)
             print(f'Processing: {pdf_name}, TXT Length: {total_length}')
-            if total_length > 200000: # 93710
-                print(f'{pdf_name} Exceed maximum length, skip ...')
-                continue
             llm = GPTAPI()
-            prompt = prompts.reaction_prompt
-            answer_reaction = llm.answer_wo_vision(prompt, cleaned_text)
+            answer_reaction = self.extract_reactions(llm, cleaned_text, pdf_name=pdf_name, max_tokens=max_tokens,
+                                                     chunk_tokens=chunk_tokens, overlap_tokens=overlap_tokens,
+                                                     max_concurrency=max_concurrency)
             # prompt2 = prompts.property_prompt.format(reactions=answer_reaction)
             # answer_property = llm.answer_wo_vision(prompt2, cleaned_text)
             answer_property = ''
@@ -210,3 +317,89 @@ class PDFProcessor:
             reactions_txt += (reactions + '\n\n')
         return reactions_txt
 
+    def process_pdfs_pipeline(self, with_images=False, save_batch_size=1, extract_workers=None,
+                              max_concurrency=4, tokens_per_minute=None, llm=None, image_options=None,
+                              max_tokens=50000, chunk_tokens=16000, overlap_tokens=500, chunk_concurrency=2):
+        '''
+        Concurrent version of process_pdfs_txt / process_pdfs_img_txt:
+        PDFs are extracted in worker processes, LLM calls run in threads and every answer is committed to the
+        result JSON as soon as it arrives. PDFs already in the result JSON are skipped, so an interrupted run
+        resumes after load_existing_results.
+        with_images: send the page images with the text (process_pdfs_img_txt)
+        save_batch_size: save the result JSON every save_batch_size answers
+        extract_workers: number of extraction processes, None for the number of CPUs
+        max_concurrency: maximum number of LLM requests in flight, chunk requests of long papers included
+        tokens_per_minute: LLM input token budget (estimated from the text length and number of images), None for unlimited
+        max_tokens / chunk_tokens / overlap_tokens: chunked extraction of long papers (see extract_reactions)
+        chunk_concurrency: maximum number of chunk requests of one paper in flight (within max_concurrency)
+        llm: GPTAPI instance shared by the request threads, a new GPTAPI() by default
+        image_options: page rasterization options of pdf_to_base64_img_list, e.g. {'image_format': 'jpeg', 'text_only_pages': 'skip'}
+        '''
+        image_options = image_options or {}
+        image_format = image_options.get('image_format', 'png')
+        pdf_file_to_process = self.get_pdf_files_to_process()
+        os.makedirs(self.result_folder_name, exist_ok=True)
+        result_json_path = f"{self.result_folder_name}/{self.result_json_name}.json"
+        llm = llm if llm is not None else GPTAPI()
+        token_limiter = RateLimiter(tokens_per_minute, per=60, burst=tokens_per_minute) if tokens_per_minute else None
+        # A paper thread waiting for its chunks holds no slot, the slots are only held by requests
+        request_slots = threading.BoundedSemaphore(max_concurrency)
+
+        def ask_llm(pdf_name, cleaned_text, base64_img_list):
+            return self.extract_reactions(llm, cleaned_text, base64_img_list, image_format, pdf_name=pdf_name,
+                                          max_tokens=max_tokens, chunk_tokens=chunk_tokens,
+                                          overlap_tokens=overlap_tokens, max_concurrency=chunk_concurrency,
+                                          token_limiter=token_limiter, request_slots=request_slots)
+
+        # Extracted PDFs waiting for an LLM slot are held in memory, so extraction is only allowed to run
+        # a few PDFs ahead of the requests
+        max_ahead = 2 * max_concurrency
+        waiting = list(reversed(pdf_file_to_process))
+        extracting, asking = {}, {}
+        counter = 0
+        progress = tqdm(total=len(pdf_file_to_process))
+        with ProcessPoolExecutor(max_workers=extract_workers) as extract_pool, \
+                ThreadPoolExecutor(max_workers=max_concurrency) as llm_pool:
+            while waiting or extracting or asking:
+                while waiting and len(extracting) + len(asking) < max_ahead:
+                    pdf_path = waiting.pop()
+                    future = extract_pool.submit(extract_pdf_content, os.path.join(self.pdf_folder_name, pdf_path),
+                                                 with_images, image_options)
+                    extracting[future] = pdf_path.replace('.pdf', '')
+                done, _ = wait(list(extracting) + list(asking), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in extracting:
+                        pdf_name = extracting.pop(future)
+                        try:
+                            cleaned_text, base64_img_list = future.result()
+                        except Exception as e:
+                            print(f'{pdf_name} Extraction failed: {e}')
+                            progress.update(1)
+                            continue
+                        print(f'Processing: {pdf_name}, TXT Length: {len(cleaned_text)}, IMG Num: {len(base64_img_list)}')
+                        asking[llm_pool.submit(ask_llm, pdf_name, cleaned_text, base64_img_list)] = pdf_name
+                    else:
+                        pdf_name = asking.pop(future)
+                        progress.update(1)
+                        try:
+                            answer_reaction = future.result()
+                        except Exception as e:
+                            # Not recorded, the PDF is retried on the next run
+                            print(f'{pdf_name} LLM request failed: {e}')
+                            continue
+                        self.result_dict[pdf_name] = (answer_reaction, '')
+                        self.processed_pdf_list.append(pdf_name)
+                        counter += 1
+                        if counter % save_batch_size == 0:
+                            self.save_data_as_json(result_json_path, self.result_dict)
+                            print(f"Saved result after processing {counter} files.")
+        progress.close()
+        print(f'LLM calls: {llm_metrics.summary()}')
+
+        self.save_data_as_json(result_json_path, self.result_dict)
+        print(f"Saved result after processing all files.")
+        reactions_txt = ''
+        for key, value in self.result_dict.items():
+            reactions = value[0]
+            reactions_txt += (reactions + '\n\n')
+        return reactions_txt
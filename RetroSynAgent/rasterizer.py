@@ -0,0 +1,104 @@
+'''
+Rasterization of PDF pages to base64 encoded images for the vision prompts.
+
+Pages are rendered by PyMuPDF and encoded directly from the pixmap (PNG / JPEG) or through PIL (WebP),
+optionally in a process pool, and streamed out in page order, so only the pages in flight are held in memory.
+Text-only pages (no embedded images, no vector drawings) carry nothing the extracted text does not,
+they can be kept, rendered at a lower zoom or skipped.
+'''
+import base64
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import fitz  # PyMuPDF
+from PIL import Image
+
+image_formats = ('png', 'jpeg', 'webp')
+text_only_modes = ('keep', 'downscale', 'skip')
+
+
+def is_text_only(page):
+    return not page.get_images(full=False) and not page.get_drawings()
+
+
+class Rasterizer:
+    def __init__(self, zoom_x=3.0, zoom_y=3.0, image_format='png', quality=85, text_only_pages='keep',
+                 text_only_zoom=1.0, workers=1, pages_per_task=4):
+        '''
+        zoom_x / zoom_y: render zoom (1.0 = 72 dpi)
+        image_format: 'png', 'jpeg' or 'webp'
+        quality: JPEG / WebP quality (1-100)
+        text_only_pages: 'keep', 'downscale' (render at text_only_zoom) or 'skip'
+        workers: number of rendering processes, 1 renders in the calling process
+        pages_per_task: pages rendered per pool task
+        '''
+        if image_format not in image_formats:
+            raise ValueError(f'image_format must be one of {image_formats}, got {image_format!r}')
+        if text_only_pages not in text_only_modes:
+            raise ValueError(f'text_only_pages must be one of {text_only_modes}, got {text_only_pages!r}')
+        self.zoom_x = zoom_x
+        self.zoom_y = zoom_y
+        self.image_format = image_format
+        self.quality = quality
+        self.text_only_pages = text_only_pages
+        self.text_only_zoom = text_only_zoom
+        self.workers = workers
+        self.pages_per_task = pages_per_task
+
+    @property
+    def mime_type(self):
+        return 'image/' + self.image_format
+
+    def encode(self, pix):
+        if self.image_format == 'png':
+            return pix.tobytes('png')
+        if self.image_format == 'jpeg':
+            return pix.tobytes('jpeg', jpg_quality=self.quality)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        buffered = BytesIO()
+        img.save(buffered, format="WEBP", quality=self.quality)
+        return buffered.getvalue()
+
+    def render_page(self, page):
+        '''
+        return: base64 encoded image of the page, None for a skipped text-only page
+        '''
+        zoom_x, zoom_y = self.zoom_x, self.zoom_y
+        if self.text_only_pages != 'keep' and is_text_only(page):
+            if self.text_only_pages == 'skip':
+                return None
+            zoom_x, zoom_y = min(zoom_x, self.text_only_zoom), min(zoom_y, self.text_only_zoom)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom_x, zoom_y), colorspace=fitz.csRGB, alpha=False)
+        return base64.b64encode(self.encode(pix)).decode('utf-8')
+
+    def render_pages(self, pdf_path, page_numbers):
+        '''
+        return: [(page number, base64 image or None), ...]
+        '''
+        with fitz.open(pdf_path) as doc:
+            return [(page_num, self.render_page(doc.load_page(page_num))) for page_num in page_numbers]
+
+    def iter_pages(self, pdf_path):
+        '''
+        Yield (page number, base64 image) in page order, skipped pages are left out
+        '''
+        with fitz.open(pdf_path) as doc:
+            num_pages = len(doc)
+            if self.workers <= 1 or num_pages <= self.pages_per_task:
+                for page_num in range(num_pages):
+                    img_base64 = self.render_page(doc.load_page(page_num))
+                    if img_base64 is not None:
+                        yield page_num, img_base64
+                return
+        tasks = [range(start, min(start + self.pages_per_task, num_pages))
+                 for start in range(0, num_pages, self.pages_per_task)]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            # At most 2 tasks per worker in flight, finished pages are yielded in order as they arrive
+            futures = []
+            next_task = 0
+            while next_task < len(tasks) or futures:
+                while next_task < len(tasks) and len(futures) < 2 * self.workers:
+                    futures.append(executor.submit(self.render_pages, pdf_path, tasks[next_task]))
+                    next_task += 1
+                for page_num, img_base64 in futures.pop(0).result():
+                    if img_base64 is not None:
+                        yield page_num, img_base64
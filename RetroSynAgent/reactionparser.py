@@ -7,6 +7,7 @@ product_dict = {'s1':[idx1,idx2,...],'s2':[...]} # s1 is obtained by raction-idx
 import json
 import networkx as nx
 from pyvis.network import Network
+from .reactionstream import iter_reactions, reaction_to_dict, report_malformed
 
 import warnings
 warnings.filterwarnings('ignore')
@@ -47,33 +48,20 @@ class ReactionParser:
         return product_dict
 
     def parse_reactions(self, reactions_txt):
-        idx = 1
-        reactants = []
-        products = []
-        reactions_dict = {}
-        lines = reactions_txt.splitlines()
-        for line in lines:
-            line = line.strip()
-            if line.startswith("Reactants:"):
-                reactants = line.split("Reactants:")[1].strip().split(', ')
-                reactants = [reactant.lower() for reactant in reactants]
-            elif line.startswith("Products:"):
-                products = line.split("Products:")[1].strip().split(', ')
-                products = [product.lower() for product in products]
-            elif line.startswith("Conditions:"):
-                conditions = line.split("Conditions:")[1].strip()
-                reactions_dict[str(idx)] = {
-                    'reactants': tuple(reactants),
-                    'products': tuple(products),
-                    'conditions': conditions,
-                }
-                idx += 1
+        '''
+        reactions_txt: reaction text or an iterable of lines (see reactionstream.iter_reactions)
+        '''
+        errors = []
+        reactions_dict = {reaction.idx: reaction_to_dict(reaction, with_source=False)
+                          for reaction in iter_reactions(reactions_txt, errors=errors)}
+        report_malformed(errors)
         return reactions_dict
 
     def parse_properties(self, properties_txt):
         properties_dict = {}
         material_name = None
-        lines = properties_txt.splitlines()  # Split text into lines
+        # Split text into lines (or an iterable of lines)
+        lines = properties_txt.splitlines() if isinstance(properties_txt, str) else properties_txt
 
         for line in lines:
             line = line.strip()  # Remove spaces from each line
@@ -115,28 +103,14 @@ class ReactionParser:
         #     self.parse_reactions(reactions_text, pdf_name)
         # product_dict = self.get_product_dict()
 
-        reactions_text = ''
-        properties_text = ''
-        for reaction, property in data.values():
-            reactions_text += reaction + '\n\n'
-            properties_text += property + '\n\n'
-
-        # todo: just for test
-        # print(f"===== reactions_text: \n\n{reactions_text}")
-
-        lines = properties_text.splitlines()
-        lines = [line for line in lines if all(phrase not in line for phrase in ["Not specified", "Not specifically mentioned", "unspecified", "Unspecified"])]
-        properties_text = "\n".join(lines)
-        # print(f"===== properties_text: \n\n{properties_text}")
-
-        # with open('results15/origin_reactions.txt', 'w') as file:
-        #     file.write(reactions_text)
-        # with open('results15/origin_properties.txt', 'w') as file:
-        #     file.write(properties_text)
+        # lines streamed over the literatures, instead of joining all the texts into two strings
+        reactions_lines = (line for reaction, property in data.values() for line in reaction.splitlines())
+        properties_lines = (line for reaction, property in data.values() for line in property.splitlines()
+                            if all(phrase not in line for phrase in ["Not specified", "Not specifically mentioned", "unspecified", "Unspecified"]))
 
-        reactions_dict = self.parse_reactions(reactions_text)
+        reactions_dict = self.parse_reactions(reactions_lines)
         # self.get_product_dict()
-        properties_dict = self.parse_properties(properties_text)
+        properties_dict = self.parse_properties(properties_lines)
         # product_dict = self.get_product_dict(reactions_dict)
         # save files (optional)
         if output_reactions_filename:
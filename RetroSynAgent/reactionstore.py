@@ -0,0 +1,142 @@
+'''
+Reactions and pathways of a tree indexed by id, for the filtering steps of 3_filter_reactions.py and
+4_recommend_pathways.py: filtering and joining are set / dict lookups on exact ids, instead of substring
+searches through the whole text ("Reaction idx: 1" is also found in "Reaction idx: 10").
+
+ReactionStore   {idx (str): reaction text}, the text of one reaction as written by Tree.get_reactions_in_tree
+PathwayStore    pathways [idx, ...] and the ReactionStore of their reactions, the text of a pathway is built
+                when it is written:
+                    Pathway: idx, idx, ...
+                    reaction text
+                    ...
+'''
+
+
+def reaction_entry(idx, reaction):
+    # text of one reaction (Tree.get_reactions_in_tree), without the blank line that follows it
+    return (f"Reaction idx: {idx}\nReactants: {', '.join(reaction['reactants'])}\n"
+            f"Products: {', '.join(reaction['products'])}\nConditions: {reaction['conditions']}\n"
+            f"Source: {reaction['source']}")
+
+
+def pathway_key(pathway):
+    '''
+    pathway: [idx, ...], or the text after "Pathway: " ('1, 5, 7'), spaces around the idx are ignored
+    return: (idx, ...)
+    '''
+    if isinstance(pathway, str):
+        pathway = pathway.split(',')
+    return tuple(idx.strip() for idx in pathway)
+
+
+class ReactionStore:
+    def __init__(self, entries=None):
+        '''
+        entries: {idx (str): reaction text}, in output order
+        '''
+        self.entries = dict(entries) if entries else {}
+
+    @classmethod
+    def from_text(cls, reactions_txt):
+        '''
+        reactions_txt: reactions separated by blank lines, each starting with its "Reaction idx: " line
+        (Tree.get_reactions_in_tree, filtered_reactions.txt)
+        '''
+        entries = {}
+        for entry in reactions_txt.strip().split('\n\n'):
+            idx = entry.split('\n', 1)[0].split(': ')[-1].strip()
+            entries[idx] = entry
+        return cls(entries)
+
+    @classmethod
+    def from_records(cls, reactions):
+        '''
+        reactions: {idx: {'reactants', 'products', 'conditions', 'source'}} (Tree.get_tree_reactions(as_text=False))
+        '''
+        return cls({idx: reaction_entry(idx, reaction) for idx, reaction in reactions.items()})
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, idx):
+        return idx in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, idx):
+        return self.entries[idx]
+
+    def select(self, idx_set):
+        '''
+        return: ReactionStore of the reactions whose idx is in idx_set, in the order of this store
+        '''
+        idx_set = set(idx_set)
+        return ReactionStore({idx: entry for idx, entry in self.entries.items() if idx in idx_set})
+
+    def text(self):
+        return '\n\n'.join(self.entries.values())
+
+
+class PathwayStore:
+    def __init__(self, pathways, reactions):
+        '''
+        pathways: [[idx, ...], ...] (Tree.find_all_paths)
+        reactions: ReactionStore of the reactions of the pathways, idx missing from it are listed without text
+        '''
+        self.pathways = list(pathways)
+        self.reactions = reactions
+
+    @classmethod
+    def from_text(cls, pathways_txt):
+        '''
+        pathways_txt: text written by PathwayStore (all_pathways.txt), pathways separated by blank lines
+        '''
+        pathways = []
+        entries = {}
+        for block in pathways_txt.strip().split('\n\n'):
+            first_line, _, reactions_txt = block.partition('\n')
+            pathways.append(list(pathway_key(first_line.split('Pathway: ', 1)[-1])))
+            for entry in reactions_txt.split('\nReaction idx: '):
+                if entry:
+                    entry = entry if entry.startswith('Reaction idx: ') else 'Reaction idx: ' + entry
+                    entries[entry.split('\n', 1)[0].split(': ')[-1].strip()] = entry
+        return cls(pathways, ReactionStore(entries))
+
+    def __len__(self):
+        return len(self.pathways)
+
+    def __iter__(self):
+        return iter(self.pathways)
+
+    def select(self, pathways):
+        '''
+        pathways: pathways to keep, [idx, ...] or 'idx, idx, ...' each
+        return: PathwayStore of the kept pathways, in the order of this store
+        '''
+        keys = {pathway_key(pathway) for pathway in pathways}
+        return PathwayStore([path for path in self.pathways if pathway_key(path) in keys], self.reactions)
+
+    def iter_text(self):
+        # one block per pathway, built on demand
+        entries = self.reactions.entries
+        for path in self.pathways:
+            block = [f"Pathway: {', '.join(path)}\n"]
+            for idx in path:
+                entry = entries.get(idx)
+                if entry is not None:
+                    block.append(entry + "\n")
+            block.append('\n')
+            yield ''.join(block)
+
+    def text(self, separator=''):
+        '''
+        separator: '' for the text of concat_pathway_and_reactions, '\n\n' with the blocks stripped for filter_pathways
+        '''
+        if separator:
+            return separator.join(block.strip() for block in self.iter_text())
+        return ''.join(self.iter_text())
+
+    def write(self, f):
+        for block in self.iter_text():
+            f.write(block)
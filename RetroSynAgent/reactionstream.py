@@ -0,0 +1,121 @@
+'''
+Streaming parser of reaction text, shared by ReactionParser and Tree.
+
+Two record formats:
+    LLM answers (prompts.reaction_prompt), a record ends with its Conditions line and is numbered by the reader:
+        Reaction 001:
+        Reactants: a, b
+        Products: c
+        Conditions: ...
+    tree reactions (Tree.get_reactions_in_tree), a record carries its idx and ends with its Source line:
+        Reaction idx: 17
+        Reactants: a, b
+        Products: c
+        Conditions: ...
+        Source: ...
+Records are yielded one by one from a string, a file or a result dict, without joining the texts.
+Records without a Reactants or Products line (or, for tree reactions, without an idx or Conditions line)
+are skipped and reported. A skipped LLM answer record still takes its number, the other records keep the idx
+the former parsers gave them.
+'''
+from collections import namedtuple
+from itertools import count
+
+Reaction = namedtuple('Reaction', ['idx', 'reactants', 'products', 'conditions', 'source'])
+MalformedReaction = namedtuple('MalformedReaction', ['source', 'line_number', 'reason', 'line'])
+
+
+def reaction_to_dict(reaction, with_source=True):
+    '''
+    Reaction -> the reaction dict of Tree.reactions / ReactionParser.parse_reactions
+    '''
+    entry = {
+        'reactants': reaction.reactants,
+        'products': reaction.products,
+        'conditions': reaction.conditions,
+    }
+    if with_source:
+        entry['source'] = reaction.source
+    return entry
+
+
+def split_names(value):
+    # lowercased before splitting, the separator is not affected
+    return tuple(value.strip().lower().split(', '))
+
+
+def iter_reactions(text, source=None, numbered=False, counter=None, errors=None):
+    '''
+    text: reaction text (str) or an iterable of lines (e.g. an open file)
+    source: source of the reactions (pdf name), tree reactions carry their own
+    numbered: tree reaction format, otherwise LLM answer format
+    counter: iterator of the idx given to LLM answer records, count(1) by default (shared to number several texts)
+    errors: list receiving a MalformedReaction for every skipped record, None to ignore them
+    yield: Reaction (idx as str, reactants / products as lowercase tuples)
+    '''
+    lines = text.splitlines() if isinstance(text, str) else text
+    counter = counter if counter is not None else count(1)
+    idx = reactants = products = conditions = None
+    record_source = source
+    start = None  # line number of the first line of the current record
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if numbered and line.startswith("Reaction idx:"):
+            idx = line[13:].strip()
+            start = line_number
+        elif line.startswith("Reactants:"):
+            reactants = split_names(line[10:])
+            start = start or line_number
+        elif line.startswith("Products:"):
+            products = split_names(line[9:])
+            start = start or line_number
+        elif line.startswith("Conditions:"):
+            conditions = line[11:].strip()
+            if numbered:
+                continue
+            reaction_idx = str(next(counter))
+            if reactants is None or products is None:
+                if errors is not None:
+                    errors.append(MalformedReaction(source, line_number, 'missing Reactants or Products', line))
+            else:
+                yield Reaction(reaction_idx, reactants, products, conditions, source)
+            reactants = products = conditions = start = None
+        elif numbered and line.startswith("Source:"):
+            record_source = line[7:].strip()
+            if idx is None or reactants is None or products is None or conditions is None:
+                if errors is not None:
+                    errors.append(MalformedReaction(source, line_number,
+                                                    'missing Reaction idx, Reactants, Products or Conditions', line))
+            else:
+                yield Reaction(idx, reactants, products, conditions, record_source)
+            idx = reactants = products = conditions = start = None
+    if start is not None and errors is not None:
+        errors.append(MalformedReaction(source, start, 'incomplete reaction at the end of the text', ''))
+
+
+def iter_reaction_file(filename, numbered=True, errors=None):
+    '''
+    Reactions of a text file, read line by line (tree reaction format by default, e.g. filtered_reactions.txt)
+    '''
+    with open(filename, 'r', encoding='utf-8') as f:
+        yield from iter_reactions(f, source=None if numbered else filename, numbered=numbered, errors=errors)
+
+
+def iter_results(result_dict, start_idx=1, errors=None, counter=None):
+    '''
+    Reactions of a result dict {pdf_name: (reactions_txt, properties_txt)}, numbered from start_idx in dict order,
+    the source of a reaction is its pdf name
+    counter: iterator of the idx, count(start_idx) by default (next(counter) is the idx of the next reaction afterwards)
+    '''
+    counter = counter if counter is not None else count(start_idx)
+    for pdf_name, values in result_dict.items():
+        yield from iter_reactions(values[0], source=pdf_name, counter=counter, errors=errors)
+
+
+def report_malformed(errors, limit=5):
+    if errors:
+        print(f'skipped {len(errors)} malformed reactions')
+        for error in errors[:limit]:
+            print(f'  {error.source}, line {error.line_number}: {error.reason}: {error.line}')
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def message_digest(content):
+    # Images (base64 data URLs) are replaced by their hash before the request is hashed
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if part.get('type') == 'image_url':
+                parts.append({'type': 'image_url', 'image_sha256': hash_text(part['image_url']['url'])})
+            else:
+                parts.append(part)
+        return parts
+    return content
+
+
+def request_key(model, temperature, messages, base_url=None):
+    '''
+    Content address of a chat completion request: hash of endpoint (base_url), model, temperature, prompts and
+    content (with image hashes), the same model name served by another endpoint is another request
+    '''
+    canonical = {
+        'base_url': base_url,
+        'model': model,
+        'temperature': temperature,
+        'messages': [{'role': message['role'], 'content': message_digest(message['content'])} for message in messages],
+    }
+    return hash_text(json.dumps(canonical, sort_keys=True, ensure_ascii=False))
+
+
+def request_size(messages):
+    size = 0
+    for message in messages:
+        content = message['content']
+        if isinstance(content, list):
+            for part in content:
+                size += len(part['image_url']['url'] if part.get('type') == 'image_url' else part.get('text', ''))
+        else:
+            size += len(content)
+    return size
+
+
+class ResponseCache:
+    '''
+    On-disk LLM response cache in SQLite, keyed by request_key, with least-recently-used eviction
+    once the stored responses exceed max_bytes.
+    The stored size is kept as a running total, counted again from the table when eviction is due and every
+    sync_every puts (other processes write to the same file).
+    Statistics (hits, misses, bytes_saved: request + response bytes that were not sent / received) are per process.
+    '''
+    instances = {}  # one shared cache per file in a process
+    instances_lock = threading.Lock()
+
+    def __init__(self, filename="llm_cache.sqlite", max_bytes=512 * 1024 * 1024, sync_every=1000):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.sync_every = sync_every
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                         "key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, request_bytes INTEGER NOT NULL, "
+                         "size INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+        self.stored_bytes = self.total_bytes()  # running total of size
+        self.puts_since_sync = 0
+
+    @classmethod
+    def open(cls, filename="llm_cache.sqlite", **kwargs):
+        key = os.path.abspath(filename)
+        with cls.instances_lock:
+            if key not in cls.instances:
+                cls.instances[key] = cls(filename, **kwargs)
+            return cls.instances[key]
+
+    def connect(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        '''
+        return: the cached response, None on a miss
+        '''
+        with self.connect() as conn:
+            row = conn.execute("SELECT response, request_bytes FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += row[1] + len(row[0].encode('utf-8'))
+        return row[0]
+
+    def put(self, key, response, model=None, request_bytes=0):
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self.connect() as conn:
+            replaced = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO responses (key, model, response, request_bytes, size, created_at, last_used) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", (key, model, response, request_bytes, size, now, now))
+        with self.lock:
+            self.stored_bytes += size - (replaced[0] if replaced is not None else 0)
+            self.puts_since_sync += 1
+            due = self.puts_since_sync >= self.sync_every or \
+                (self.max_bytes is not None and self.stored_bytes > self.max_bytes)
+        if due:
+            self.evict()
+
+    def total_bytes(self):
+        return self.connect().execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def evict(self):
+        '''
+        Count the stored size again and delete the least recently used responses until the cache fits in max_bytes
+        '''
+        total = self.total_bytes()
+        with self.lock:
+            self.stored_bytes = total
+            self.puts_since_sync = 0
+        if self.max_bytes is None:
+            return 0
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return 0
+        conn = self.connect()
+        evicted = []
+        evicted_bytes = 0
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            evicted.append((key,))
+            evicted_bytes += size
+            if evicted_bytes >= excess:
+                break
+        with conn:
+            conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        with self.lock:
+            self.stored_bytes -= evicted_bytes
+        return len(evicted)
+
+    def clear(self):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM responses")
+        with self.lock:
+            self.stored_bytes = 0
+
+    def __len__(self):
+        return self.connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'entries': len(self),
+                'bytes': self.total_bytes(),
+            }
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'max_bytes': self.max_bytes, 'sync_every': self.sync_every}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
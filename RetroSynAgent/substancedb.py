@@ -0,0 +1,400 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pubchempy
+from .ratelimiter import RateLimiter
+
+
+class PubChemBackend:
+    '''
+    Substance lookups against PubChem, every HTTP request goes through the shared rate limiter
+    (PubChem allows at most 5 requests per second)
+    '''
+    def __init__(self, rate_limiter=None, max_retries=1, delay=1):
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.delay = delay
+
+    def get_compounds(self, identifier, namespace):
+        retries = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                return pubchempy.get_compounds(identifier, namespace)
+            except pubchempy.BadRequestError:
+                # e.g. a name that is not a valid SMILES
+                return []
+            except pubchempy.PubChemHTTPError:
+                retries += 1
+                if retries >= self.max_retries:
+                    raise
+                time.sleep(self.delay)
+
+    def get_smiles(self, compound_name):
+        '''
+        return: canonical SMILES of the first compound matching the name, None if PubChem does not know the name
+        '''
+        compounds = self.get_compounds(compound_name, 'name')
+        if compounds:
+            return compounds[0].canonical_smiles
+        return None
+
+    def smiles_exists(self, smiles):
+        return len(self.get_compounds(smiles, 'smiles')) > 0
+
+
+class LocalBackend:
+    '''
+    Offline backend (tests, benchmarks): {name: smiles} of known substances, optional set of known SMILES
+    '''
+    def __init__(self, smiles_dict, known_smiles=None):
+        self.smiles_dict = smiles_dict
+        self.known_smiles = set(known_smiles) if known_smiles is not None else set(smiles_dict.values())
+
+    def get_smiles(self, compound_name):
+        return self.smiles_dict.get(compound_name)
+
+    def smiles_exists(self, smiles):
+        return smiles in self.known_smiles
+
+
+class SubstanceCache:
+    '''
+    Persistent name -> SMILES -> availability cache in SQLite.
+    ttl / negative_ttl: seconds after which available / unavailable records are queried again (None: never expire)
+    '''
+    def __init__(self, filename="substance_cache.sqlite", ttl=30 * 24 * 3600, negative_ttl=7 * 24 * 3600):
+        self.filename = filename
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.local = threading.local()
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS substances ("
+                         "name TEXT PRIMARY KEY, smiles TEXT, available INTEGER NOT NULL, checked_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_substances_smiles ON substances (smiles)")
+
+    def connect(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def is_fresh(self, available, checked_at, now):
+        ttl = self.ttl if available else self.negative_ttl
+        return ttl is None or now - checked_at < ttl
+
+    def get_records(self, names):
+        '''
+        return: {name: (smiles, available, checked_at)} for the names with a fresh record
+        '''
+        conn = self.connect()
+        now = time.time()
+        records = {}
+        names = list(names)
+        for i in range(0, len(names), 500):
+            batch = names[i:i + 500]
+            rows = conn.execute(f"SELECT name, smiles, available, checked_at FROM substances "
+                                f"WHERE name IN ({','.join('?' * len(batch))})", batch)
+            for name, smiles, available, checked_at in rows:
+                if self.is_fresh(available, checked_at, now):
+                    records[name] = (smiles, bool(available), checked_at)
+        return records
+
+    def get_many(self, names):
+        '''
+        return: {name: (smiles, available)} for the names with a fresh record
+        '''
+        return {name: (smiles, available) for name, (smiles, available, checked_at) in self.get_records(names).items()}
+
+    def get(self, name):
+        return self.get_many([name]).get(name)
+
+    def put_records(self, records, replace=True):
+        '''
+        records: {name: (smiles, available, checked_at)}
+        replace: overwrite the existing records of the names, otherwise keep them
+        '''
+        with self.connect() as conn:
+            conn.executemany(f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO substances "
+                             f"(name, smiles, available, checked_at) VALUES (?, ?, ?, ?)",
+                             [(name, smiles, int(available), checked_at)
+                              for name, (smiles, available, checked_at) in records.items()])
+
+    def put_many(self, records):
+        '''
+        records: {name: (smiles, available)}
+        '''
+        now = time.time()
+        self.put_records({name: (smiles, available, now) for name, (smiles, available) in records.items()})
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'ttl': self.ttl, 'negative_ttl': self.negative_ttl}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class SubstanceQueryLog:
+    '''
+    Write-behind layer of a SubstanceCache, the only persistent store of the query results.
+    Records {name: (smiles, available, checked_at)} read from or written to the cache are kept in memory; new
+    results are buffered and written to the cache in one transaction at batch boundaries, every `flush_every`
+    results and at interpreter exit. Records in memory are checked with the cache TTL rules on every read.
+    Concurrent tree builds share the SQLite cache, its transactions serialize the writes of several processes.
+    The former query logs (substance_query_result.jsonl / .json, no timestamps) are imported into the cache once,
+    dated by their modification time, and renamed to <filename>.imported.
+    '''
+    instances = {}  # one shared log per cache file in a process
+    instances_lock = threading.Lock()
+    live_logs = weakref.WeakSet()  # every log is flushed at exit
+    legacy_filenames = ("substance_query_result.jsonl", "substance_query_result.json")
+
+    def __init__(self, cache, flush_every=100):
+        self.cache = cache
+        self.flush_every = flush_every
+        self.records = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.import_legacy_logs()
+        SubstanceQueryLog.live_logs.add(self)
+
+    @classmethod
+    def open(cls, cache, **kwargs):
+        key = os.path.abspath(cache.filename)
+        with cls.instances_lock:
+            if key not in cls.instances:
+                cls.instances[key] = cls(cache, **kwargs)
+            return cls.instances[key]
+
+    @staticmethod
+    def parse_lines(lines):
+        # Fast path: a single json.loads over the whole log; falls back to line by line to skip a torn last write
+        try:
+            return json.loads('[' + ','.join(lines) + ']')
+        except json.JSONDecodeError:
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+            return records
+
+    def import_legacy_logs(self):
+        for filename in self.legacy_filenames:
+            if not os.path.exists(filename):
+                continue
+            with open(filename, 'r', encoding='utf-8') as f:
+                if filename.endswith('.jsonl'):
+                    data = dict(self.parse_lines([line for line in f.read().splitlines() if line]))
+                else:
+                    data = json.load(f)
+            checked_at = os.path.getmtime(filename)
+            # Records already in the cache are newer
+            self.cache.put_records({name: (None, bool(available), checked_at) for name, available in data.items()},
+                                   replace=False)
+            try:
+                os.replace(filename, filename + '.imported')
+            except FileNotFoundError:
+                pass  # imported by another process at the same time
+
+    def get_many(self, names):
+        '''
+        return: {name: (smiles, available)} for the names with a fresh record
+        '''
+        now = time.time()
+        results = {}
+        missing = []
+        with self.lock:
+            for name in names:
+                record = self.records.get(name)
+                if record is not None and self.cache.is_fresh(record[1], record[2], now):
+                    results[name] = record[:2]
+                else:
+                    missing.append(name)
+        if missing:
+            records = self.cache.get_records(missing)
+            with self.lock:
+                self.records.update(records)
+            results.update({name: record[:2] for name, record in records.items()})
+        return results
+
+    def get(self, name):
+        return self.get_many([name]).get(name)
+
+    def put_many(self, records):
+        '''
+        records: {name: (smiles, available)}, written to the cache by the next flush
+        '''
+        now = time.time()
+        with self.lock:
+            for name, (smiles, available) in records.items():
+                self.records[name] = self.pending[name] = (smiles, available, now)
+            should_flush = len(self.pending) >= self.flush_every
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if pending:
+            self.cache.put_records(pending)
+
+    def __getstate__(self):
+        return {'cache': self.cache, 'flush_every': self.flush_every}
+
+    def __setstate__(self, state):
+        if 'cache' not in state:
+            # the JSON-lines log kept by trees pickled by earlier versions, replaced by the SubstanceCache
+            state = {'cache': None, 'flush_every': state.get('flush_every', 100)}
+        self.cache = state['cache']
+        self.flush_every = state['flush_every']
+        self.records = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+
+def flush_query_logs():
+    for query_log in list(SubstanceQueryLog.live_logs):
+        query_log.flush()
+
+
+atexit.register(flush_query_logs)
+
+
+class CommonSubstanceDB:
+    added_database_cache = None  # emol.json is large, load it once per process
+
+    def __init__(self, backend=None, cache=None, max_workers=4, requests_per_second=5):
+        '''
+        backend: PubChemBackend (default) or any object with get_smiles(name) / smiles_exists(smiles), e.g. LocalBackend
+        cache: SubstanceCache, default substance_cache.sqlite in the working directory
+        '''
+        self.backend = backend if backend is not None else PubChemBackend(RateLimiter(requests_per_second))
+        self.cache = cache if cache is not None else SubstanceCache()
+        self.query_log = SubstanceQueryLog.open(self.cache)  # reads and buffered writes of the cache
+        self.max_workers = max_workers
+
+    @staticmethod
+    def read_data_from_json(filename):
+        with open(filename, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return data
+
+    @property
+    def added_database(self):
+        if CommonSubstanceDB.added_database_cache is None:
+            CommonSubstanceDB.added_database_cache = self.get_added_database()
+        return CommonSubstanceDB.added_database_cache
+
+    def get_added_database(self):
+        polymers = [
+            "Polyethylene",
+            "Polypropylene",
+            "Polystyrene",
+            "Polyvinyl chloride",
+            "Polyethylene terephthalate",
+            "Polytetrafluoroethylene",
+            "Polycarbonate",
+            "Poly(methyl methacrylate)",
+            "Polyurethane",
+            "Polyamide",
+            "Polyvinyl acetate",
+            "Polybutadiene",
+            "Polychloroprene",
+            "Poly(acrylonitrile-butadiene-styrene)",
+            "Polyoxymethylene",
+            "Polylactic acid",
+            "Polyethylene glycol",
+            "Poly(vinyl alcohol)",
+            "Polyacrylamide",
+            "Polyethylene oxide",
+            "Poly(ethylene-co-vinyl acetate)"
+        ]
+
+        polymers = [polymer.lower() for polymer in polymers]
+        emol_list = self.read_data_from_json(os.path.join(os.path.dirname(__file__), 'emol.json'))
+        added_database = set(emol_list) | {"CCl2"} | set(polymers)
+        return added_database
+
+    def resolve(self, compound_name):
+        '''
+        Query the backend, a name found in PubChem is common; otherwise the name itself is checked
+        against the added database and as a SMILES.
+        :return: (smiles or None, available)
+        '''
+        smiles = self.backend.get_smiles(compound_name)
+        if smiles is not None:
+            return smiles, True
+        if compound_name in self.added_database:
+            return None, True
+        return None, self.backend.smiles_exists(compound_name)
+
+    def prefetch(self, compound_names):
+        """
+        Resolve all compounds up front: cached records are read in one query, the misses are resolved
+        concurrently (bounded by max_workers and the backend rate limit) and written back in one transaction.
+        :return: {compound_name: available}, compounds whose query failed (transient errors) are left out
+        """
+        compound_names = list(dict.fromkeys(compound_names))
+        records = self.query_log.get_many(compound_names)
+        results = {name: available for name, (smiles, available) in records.items()}
+        missing = [name for name in compound_names if name not in records]
+        if missing:
+            resolved = {}
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self.resolve, name): name for name in missing}
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        resolved[name] = future.result()
+                    except Exception as e:
+                        # Transient errors are not cached, the compound is queried again on its next use
+                        print(f"{name} query failed: {e}")
+            self.query_log.put_many(resolved)
+            self.query_log.flush()
+            results.update({name: available for name, (smiles, available) in resolved.items()})
+        print(f"{len(compound_names)} substances prefetched, {len(records)} from cache, {len(missing)} queried, "
+              f"{len(compound_names) - len(results)} failed")
+        return results
+
+    def is_common_chemical(self, compound_name, default=False):
+        """
+        Determine if a compound is common, using the persistent cache first.
+        :param compound_name: The compound's English name, SMILES, or other identifier (string)
+        :param default: Returned when the query fails (transient error, not cached)
+        :return: Returns True if a relevant record is found, otherwise returns False
+        """
+        record = self.query_log.get(compound_name)
+        if record is not None:
+            return record[1]
+        try:
+            record = self.resolve(compound_name)
+        except Exception as e:
+            print(f"{compound_name} query failed: {e}")
+            return default
+        self.query_log.put_many({compound_name: record})
+        print(f"{compound_name} query {'succeed' if record[1] else 'failed'}")
+        return record[1]
+
+    def flush(self):
+        # Write the buffered query results to the cache
+        self.query_log.flush()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['query_log']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.query_log = SubstanceQueryLog.open(self.cache)
@@ -0,0 +1,107 @@
+class SymbolTable:
+    '''
+    Interns names (substances, reaction idx, ...) to dense integer ids: name (str) <-> id (int)
+    '''
+    def __init__(self, names=()):
+        self.ids = {}
+        self.names = []
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        symbol_id = self.ids.get(name)
+        if symbol_id is None:
+            symbol_id = len(self.names)
+            self.ids[name] = symbol_id
+            self.names.append(name)
+        return symbol_id
+
+    def get(self, name, default=None):
+        return self.ids.get(name, default)
+
+    def name(self, symbol_id):
+        return self.names[symbol_id]
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+
+class ReactionTable:
+    '''
+    Integer view of a reaction dict {idx: {'reactants': (name, ...), 'products': (name, ...), ...}}, built once
+    at parse time and shared by the tree, its nodes, the expansion engine, the pathway search and the knowledge graph:
+    substances / reaction_ids: SymbolTable of the substance names and reaction idx
+    reactants[r] / products[r]: substance ids of reaction id r: (int, ...)
+    producers[s]: reaction ids producing substance id s: (int, ...), product_dict on ids
+    Names are only needed again for output.
+    '''
+    def __init__(self, reactions=None, substances=None, reaction_ids=None):
+        self.substances = substances if substances is not None else SymbolTable()
+        self.reaction_ids = reaction_ids if reaction_ids is not None else SymbolTable()
+        self.reactants = []
+        self.products = []
+        self.producers = {}
+        if reactions:
+            self.add(reactions)
+
+    def add(self, reactions):
+        '''
+        Add reactions (idx not in the table yet)
+        return: substance ids of the products of the new reactions
+        '''
+        intern = self.substances.intern
+        new_producers = {}
+        for idx, reaction in reactions.items():
+            reaction_id = self.reaction_ids.intern(idx)
+            reactants = tuple(intern(name) for name in reaction['reactants'])
+            # products are stripped as in Tree.get_product_dict
+            products = tuple(intern(name.strip()) for name in reaction['products'])
+            while len(self.reactants) <= reaction_id:
+                self.reactants.append(())
+                self.products.append(())
+            self.reactants[reaction_id] = reactants
+            self.products[reaction_id] = products
+            for product_id in products:
+                new_producers.setdefault(product_id, []).append(reaction_id)
+        for product_id, reaction_ids in new_producers.items():
+            self.producers[product_id] = self.producers.get(product_id, ()) + tuple(reaction_ids)
+        return set(new_producers)
+
+    def add_ids(self, rows):
+        '''
+        add on substance ids: rows of (idx, reactant ids, product ids), ids interned in self.substances
+        '''
+        new_producers = {}
+        for idx, reactants, products in rows:
+            reaction_id = self.reaction_ids.intern(idx)
+            while len(self.reactants) <= reaction_id:
+                self.reactants.append(())
+                self.products.append(())
+            self.reactants[reaction_id] = tuple(reactants)
+            self.products[reaction_id] = tuple(products)
+            for product_id in products:
+                new_producers.setdefault(product_id, []).append(reaction_id)
+        for product_id, reaction_ids in new_producers.items():
+            self.producers[product_id] = self.producers.get(product_id, ()) + tuple(reaction_ids)
+        return set(new_producers)
+
+    def clear(self):
+        # Forget the reactions, the interned ids are kept
+        self.reactants = []
+        self.products = []
+        self.producers = {}
+
+    def get_producers(self, substance_id):
+        return self.producers.get(substance_id, ())
+
+    def substance_names(self, substance_ids):
+        return [self.substances.name(substance_id) for substance_id in substance_ids]
+
+    def reaction_names(self, reaction_ids):
+        return [self.reaction_ids.name(reaction_id) for reaction_id in reaction_ids]
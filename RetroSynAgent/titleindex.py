@@ -0,0 +1,96 @@
+'''
+Fuzzy title lookup: is there a known title with difflib.SequenceMatcher(None, title, known).ratio() > threshold?
+
+Instead of running SequenceMatcher against every known title, candidates are taken from a q-gram inverted index
+and only verified with SequenceMatcher when two exact bounds allow a ratio above the threshold:
+    length:  ratio <= 2 * min(la, lb) / (la + lb)
+    q-grams: a q-gram of `title` lying inside one matching block also occurs in `known`. Every unmatched character
+             of `title` spoils at most q of its q-grams, every block boundary at most q - 1 more, and a boundary
+             not separated by unmatched characters of `title` needs unmatched characters in `known`, so with
+             M matched characters:
+             common q-grams >= (la - q + 1) - q * (la - M) - (q - 1) * (lb - M)
+Both bounds only discard titles that cannot pass, the result is the same as the full scan.
+'''
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from itertools import chain
+
+
+def qgrams(text, q):
+    '''
+    q-grams of text numbered by occurrence, ('abc', 2) is the second 'abc': the number of shared keys of two texts
+    is their multiset q-gram intersection
+    '''
+    seen = Counter()
+    keys = []
+    for i in range(len(text) - q + 1):
+        gram = text[i:i + q]
+        seen[gram] += 1
+        keys.append((gram, seen[gram]))
+    return keys
+
+
+class TitleIndex:
+    def __init__(self, titles=(), threshold=0.9, q=3):
+        self.threshold = threshold
+        self.q = q
+        self.titles = []
+        self.exact = set()
+        self.postings = defaultdict(list)  # numbered q-gram -> [title id, ...]
+        self.by_length = defaultdict(list)  # length -> [title id, ...]
+        for title in titles:
+            self.add(title)
+
+    def add(self, title):
+        title_id = len(self.titles)
+        self.titles.append(title)
+        self.exact.add(title)
+        self.by_length[len(title)].append(title_id)
+        for key in qgrams(title, self.q):
+            self.postings[key].append(title_id)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def length_range(self, la):
+        # lb with 2 * min(la, lb) / (la + lb) > threshold (widened by one for float rounding)
+        t = self.threshold
+        return int(t * la / (2 - t)) - 1, int(la * (2 - t) / t) + 1
+
+    def min_common(self, la, lb):
+        # lower bound of the common q-grams for a ratio above the threshold (see module docstring)
+        min_matches = int(self.threshold * (la + lb) / 2)  # the smallest possible M, minus one for float rounding
+        return (la - self.q + 1) - self.q * (la - min_matches) - (self.q - 1) * (lb - min_matches)
+
+    def is_similar(self, title, known):
+        matcher = SequenceMatcher(None, title, known)
+        return (matcher.real_quick_ratio() > self.threshold and matcher.quick_ratio() > self.threshold
+                and matcher.ratio() > self.threshold)
+
+    def find(self, title):
+        '''
+        return: a known title similar to `title` (ratio > threshold), None if there is none
+        '''
+        if title in self.exact and self.is_similar(title, title):
+            return title
+        la = len(title)
+        min_length, max_length = self.length_range(la)
+        postings = self.postings
+        common = Counter(chain.from_iterable(postings[key] for key in qgrams(title, self.q) if key in postings))
+        checked = set()
+        for title_id, num_common in common.items():
+            lb = len(self.titles[title_id])
+            if min_length <= lb <= max_length and num_common >= self.min_common(la, lb):
+                checked.add(title_id)
+                if self.is_similar(title, self.titles[title_id]):
+                    return self.titles[title_id]
+        # Short titles: lengths where the q-gram bound prunes nothing
+        for lb in range(max(min_length, 0), max_length + 1):
+            if lb in self.by_length and self.min_common(la, lb) <= 0:
+                for title_id in self.by_length[lb]:
+                    if title_id not in checked and self.is_similar(title, self.titles[title_id]):
+                        return self.titles[title_id]
+        return None
+
+    def __contains__(self, title):
+        return self.find(title) is not None
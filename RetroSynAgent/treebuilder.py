@@ -1,154 +1,208 @@
-import copy
-import json
 from graphviz import Digraph
-import time
-import pubchempy
 import pickle
 import base64
 from io import BytesIO
 from PIL import Image
-import os
-from collections import deque
-
-class CommonSubstanceDB:
-    def __init__(self):
-        self.added_database = self.get_added_database()
-    @staticmethod
-    def read_data_from_json(filename):
-        with open(filename, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        return data
-
-    def get_added_database(self):
-        polymers = [
-            "Polyethylene",
-            "Polypropylene",
-            "Polystyrene",
-            "Polyvinyl chloride",
-            "Polyethylene terephthalate",
-            "Polytetrafluoroethylene",
-            "Polycarbonate",
-            "Poly(methyl methacrylate)",
-            "Polyurethane",
-            "Polyamide",
-            "Polyvinyl acetate",
-            "Polybutadiene",
-            "Polychloroprene",
-            "Poly(acrylonitrile-butadiene-styrene)",
-            "Polyoxymethylene",
-            "Polylactic acid",
-            "Polyethylene glycol",
-            "Poly(vinyl alcohol)",
-            "Polyacrylamide",
-            "Polyethylene oxide",
-            "Poly(ethylene-co-vinyl acetate)"
-        ]
-
-        polymers = [polymer.lower() for polymer in polymers]
-        emol_list = self.read_data_from_json('RetroSynAgent/emol.json')
-        added_database = set(emol_list) | {"CCl2"} | set(polymers)
-        return added_database
-
-    def is_common_chemical(self, compound_name, max_retries=1, delay=1):
-        """
-        Query the PubChem database to determine if a compound is common; retry on error.
-        :param compound_identifier: The compound's SMILES, English name, or other identifier (string)
-        :param max_retries: Maximum number of retries
-        :param delay: Wait time between retries (seconds)
-        :return: Returns True if a relevant record is found, otherwise returns False
-        """
-        compound_identifier = self.get_smiles_from_name(compound_name)
-        retries = 0
-        while retries < max_retries:
-            try:
-                if compound_identifier in self.added_database:
-                    print(f"{compound_identifier} query success")
-                    return True
-                # Query the compound by SMILES
-                compound = pubchempy.get_compounds(compound_identifier, 'smiles')
-                if not compound:
-                    # If SMILES query fails, try querying by name
-                    compound = pubchempy.get_compounds(compound_identifier, 'name')
-                if compound:
-                    print(f"{compound_identifier} query succeed")
-                    return True
-                return False
-            except pubchempy.PubChemHTTPError as e:
-                # print(f"{compound_identifier} query failed: {e}. Retrying... ({retries + 1}/{max_retries})")
-                retries += 1
-                time.sleep(delay)
-            except Exception as e:
-                print(f"other error: {e}")
-                # Other error: <urlopen error [Errno 54] Connection reset by peer>
-        print(f"{compound_identifier} query failed")  # Maximum number of retries reached
-        return False
-
-    @staticmethod
-    def get_smiles_from_name(compound_name):
-        compounds = pubchempy.get_compounds(compound_name, 'name')
-        if compounds:
-            return compounds[0].canonical_smiles
-        else:
-            return compound_name
+from itertools import count
+from .treeexpander import TreeExpander
+from .pathfinder import PathwayEnumerator
+from .pathwayset import PathwaySet
+from .symboltable import ReactionTable
+from .reactionstream import iter_reactions, iter_results, reaction_to_dict, report_malformed
+from .reactionstore import reaction_entry
+from .treerender import tree_digraph, iter_level_order, render_tree
+from .treefile import is_tree_file, save_tree_file, load_tree_file
+from .substancedb import CommonSubstanceDB
+
+class NodeContext:
+    def __init__(self, reactions, product_dict, cache_func=None, unexpandable_substances=None, table=None):
+        '''
+        State shared by all nodes of a tree, nodes only keep a reference to it
+        table: ReactionTable of the reactions (built from reactions if not given), nodes expand on its ids
+        substances / reaction_ids: interned substance names and reaction idx, the symbol tables of table
+        '''
+        self.reactions = reactions
+        self.product_dict = product_dict
+        self.cache_func = cache_func  # Caching function
+        self.unexpandable_substances = unexpandable_substances
+        self.table = table if table is not None else ReactionTable(reactions)
+        self.substances = self.table.substances
+        self.reaction_ids = self.table.reaction_ids
+
+
+class AncestorSet:
+    '''
+    Read-only set view of the ancestor names of a node, backed by a frozenset of interned substance ids
+    '''
+    __slots__ = ('ids', 'substances')
+
+    def __init__(self, ids, substances):
+        self.ids = ids
+        self.substances = substances
+
+    def __contains__(self, substance):
+        substance_id = self.substances.get(substance)
+        return substance_id is not None and substance_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (self.substances.name(substance_id) for substance_id in self.ids)
+
 
 class Node:
-    def __init__(self, substance, reactions, product_dict,
-                 fathers_set=None, father=None, reaction_index=None,
-                 reaction_line=None, cache_func=None, unexpandable_substances=None):  # , visited_substances=None):
+    __slots__ = ('context', 'substance_id', 'reaction_id', 'father', 'depth', 'is_leaf',
+                 '_children', '_lineage', 'expansion')
+
+    def __init__(self, substance, context, father=None, reaction_index=None):
         '''
-        reaction_index: Index of the reaction that produces the substance: idx (str)
-        substance: The name of the current node: name (str)
+        substance: The name of the current node: name (str), stored as interned id substance_id (int)
+        reaction_index: Index of the reaction that produces the substance: idx (str), stored as interned id reaction_id (int)
+        context: NodeContext shared by the whole tree (reactions, product_dict, cache_func, unexpandable_substances)
         children: List of child nodes: [Node, ...]
-        fathers_set: Set of parent node names: set(name (str), name (str))
-        reaction_line: Reaction path: [idx (str), ...]
-        brothers: Sibling nodes: [None, ...]
+        father: parent node, fathers_set and reaction_line are derived from the parent pointers
+        depth: number of ancestors: len(fathers_set)
         '''
-        self.reaction_index = reaction_index
-        self.substance = substance
-        self.children = []
-        self.fathers_set = fathers_set if fathers_set is not None else set()
+        self.init(context, context.substances.intern(substance),
+                  -1 if reaction_index is None else context.reaction_ids.intern(reaction_index), father)
+
+    def init(self, context, substance_id, reaction_id, father):
+        self.context = context
+        self.substance_id = substance_id
+        self.reaction_id = reaction_id
         self.father = father  # father_node
-        self.reaction_line = reaction_line if reaction_line is not None else []
+        self.depth = 0 if father is None else father.depth + 1
         self.is_leaf = False
-        self.cache_func = cache_func  # Add caching function
-        self.reactions = reactions
-        self.product_dict = product_dict
-        self.unexpandable_substances = unexpandable_substances
-        # self.visited_substances = visited_substances
+        self._children = []
+        self._lineage = None  # frozenset of ids: self + ancestors, shared by all children as their fathers_set
+        self.expansion = None  # (TreeExpander or NodeTable, entry) while the children are not materialized yet
+
+    def __setstate__(self, state):
+        # (None, {slot: value}) since Node has __slots__, trees pickled by earlier versions stored a __dict__
+        # (substance, reaction_index, children, fathers_set, ...): the names are kept in substance_id / reaction_id
+        # until Tree.__setstate__ interns them in the tree's NodeContext
+        dict_state, slot_state = state if isinstance(state, tuple) else (state, None)
+        if dict_state:
+            self.context = None
+            self.substance_id = dict_state['substance']
+            self.reaction_id = dict_state.get('reaction_index')
+            self.father = dict_state.get('father')
+            self.depth = 0
+            self.is_leaf = dict_state.get('is_leaf', False)
+            self._children = dict_state.get('children', [])
+            self._lineage = None
+            self.expansion = None
+        if slot_state:
+            for name, value in slot_state.items():
+                setattr(self, name, value)
+
+    @classmethod
+    def from_ids(cls, context, substance_id, reaction_id, father):
+        '''
+        Node of already interned ids (context.substances / context.reaction_ids), as loaded from a tree file
+        '''
+        node = cls.__new__(cls)
+        node.init(context, substance_id, reaction_id, father)
+        return node
+
+    @property
+    def substance(self):
+        return self.context.substances.name(self.substance_id)
+
+    @property
+    def reaction_index(self):
+        return None if self.reaction_id < 0 else self.context.reaction_ids.name(self.reaction_id)
+
+    @property
+    def reactions(self):
+        return self.context.reactions
+
+    @property
+    def product_dict(self):
+        return self.context.product_dict
+
+    @property
+    def cache_func(self):
+        return self.context.cache_func
+
+    @property
+    def unexpandable_substances(self):
+        return self.context.unexpandable_substances
+
+    def get_lineage(self):
+        # Built on demand, once per node, and shared by all of its children instead of a copy per child
+        if self._lineage is None:
+            if self.father is None:
+                self._lineage = frozenset((self.substance_id,))
+            else:
+                self._lineage = self.father.get_lineage() | {self.substance_id}
+        return self._lineage
+
+    @property
+    def fathers_set(self):
+        '''
+        Set of parent node names: set(name (str), name (str))
+        '''
+        ids = frozenset() if self.father is None else self.father.get_lineage()
+        return AncestorSet(ids, self.context.substances)
 
-    def add_child(self, substance: str, reaction_index: int):
+    @property
+    def reaction_line(self):
+        '''
+        Reaction path from the root: [idx (str), ...]
+        '''
+        line = []
+        node = self
+        while node.father is not None:
+            line.append(node.reaction_index)
+            node = node.father
+        line.reverse()
+        return line
+
+    @property
+    def children(self):
+        # Children of nodes built by TreeExpander are materialized on first access
+        if self.expansion is not None:
+            expander, entry = self.expansion
+            self.expansion = None
+            expander.build_children(self, entry)
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children
+
+    def add_child(self, substance: str, reaction_index: str):
         '''
         Add a child node to the current node (self) in self.children
         child: The name of the current child node: substance
-        Current child's parent set: curr_child_fathers_set = Current node (current child's parent) self + current node's parent set
-        Current child's reaction path: curr_child_reaction_line = idx from current node to current child + current node's reaction path
+        The child's parent set and reaction path follow from the parent pointer (child.father = self)
         '''
-        curr_child_fathers_set = copy.deepcopy(self.fathers_set)
-        curr_child_fathers_set.add(self.substance)
-        curr_child_reaction_line = copy.deepcopy(self.reaction_line) + [reaction_index]
-        child = Node(substance, self.reactions, self.product_dict,
-                     fathers_set=curr_child_fathers_set,
-                     father=self,
-                     reaction_index=reaction_index,
-                     reaction_line=curr_child_reaction_line,
-                     cache_func=self.cache_func,
-                     unexpandable_substances=self.unexpandable_substances,
-                     # visited_substances = self.visited_substances
-                     )  # Pass caching function
+        child = Node(substance, self.context, father=self, reaction_index=reaction_index)
         self.children.append(child)
         return child
 
-    def remove_child_by_reaction(self, reaction_index: int):
+    def add_child_id(self, substance_id: int, reaction_id: int):
+        # add_child on interned ids
+        child = type(self).from_ids(self.context, substance_id, reaction_id, self)
+        self.children.append(child)
+        return child
+
+    def remove_child_by_reaction(self, reaction_index: str):
         """
         Remove children with the same reaction as ancestor nodes (forming a loop)
         This not only deletes the current child node but also deletes sibling nodes with the same reaction (same reaction index)
         """
-        self.children = [child for child in self.children if child.reaction_index != reaction_index]
+        self.remove_child_by_reaction_id(self.context.reaction_ids.get(reaction_index))
+
+    def remove_child_by_reaction_id(self, reaction_id: int):
+        self.children = [child for child in self.children if child.reaction_id != reaction_id]
 
     def expand(self) -> bool:
         """
-        reactions {'idx': {'reactants':[], 'products':[], conditions: ''}, ...}
-        product_dict {'product': [idx1, idx2, ...], ...}
+        Runs on the ids of context.table:
+        reactants[reaction id] (substance id, ...), producers[substance id] (reaction id, ...)
         """
         # Base conditions:
         # The reactant already belongs to existing reactants, no need to expand further
@@ -159,9 +213,10 @@ class Node:
             # print(f"{self.substance} is accessible")
             return True
         else:
-            reactions_idxs = self.product_dict.get(self.substance, [])
+            table = self.context.table
+            reaction_ids = table.get_producers(self.substance_id)
             # The substance cannot be obtained through existing reactions
-            if len(reactions_idxs) == 0:
+            if len(reaction_ids) == 0:
                 self.unexpandable_substances.add(self.substance)
                 # self.visited_substances[self.substance] = False
                 # print(f"{self.substance} cannot be expanded further")
@@ -169,25 +224,25 @@ class Node:
             # The substance is not among existing reactants but can be obtained through existing reactions
             else:
                 # Iterate over all reactions that can produce the substance
-                for reaction_idx in reactions_idxs:
+                for reaction_id in reaction_ids:
                     # Get the reactants for the reaction that produces the substance, iterate and add as child nodes of the current node
-                    reactants_list = self.reactions[reaction_idx]['reactants']  # ['reactions'][0]
+                    reactant_ids = table.reactants[reaction_id]
                     # Generate all reactants for the current node substance
-                    for reactant in reactants_list:
-                        # 1 === self.add_child includes: creating the current child node and adding it to self.children.append(child)
-                        child = self.add_child(reactant, reaction_idx)
+                    for reactant_id in reactant_ids:
+                        # 1 === self.add_child_id includes: creating the current child node and adding it to self.children.append(child)
+                        child = self.add_child_id(reactant_id, reaction_id)
                         # 2 === Check if the current child node is valid
                         # (1) If the current child node has the same name as ancestor nodes (forming a loop), it is invalid
                         # (self.remove_child_by_reaction not only removes the current child node but also nodes with the same reaction index)
-                        if child.substance in child.fathers_set:
-                            self.remove_child_by_reaction(reaction_idx)
+                        if child.substance_id in self.get_lineage():  # child.substance in child.fathers_set
+                            self.remove_child_by_reaction_id(reaction_id)
                             break
                         # (2) If the current child node cannot be expanded further (1 cannot be expanded to initial reactants 2 cannot be obtained through existing reactions)
                         # Recursively check if the current child can expand further
                         is_valid = child.expand()  # , init_reactants)
                         # Cannot expand
                         if not is_valid:
-                            self.remove_child_by_reaction(reaction_idx)
+                            self.remove_child_by_reaction_id(reaction_id)
                             break
                 # After checking all reactions that can produce the substance, if "1" all children are invalid (no valid child nodes), cannot synthesize this substance
                 if len(self.children) == 0:
@@ -201,32 +256,45 @@ class Node:
 
 # retrosynthetic Tree, contains all substance nodes
 class Tree:
-    def __init__(self, target_substance, result_dict=None, reactions_txt=None):
+    def __init__(self, target_substance, result_dict=None, reactions_txt=None, substance_db=None):
         """
+        substance_db: CommonSubstanceDB used for cache misses, created on first use if not given
         reactions_dict[str(idx)] = {
             'reactants': tuple(reactants),
             'products': tuple(products),
             'conditions': conditions, }
         """
+        self.result_dict = {}  # {pdf_name: (reactions_txt, properties_txt)} the reactions were parsed from
+        self._reactions_txt = reactions_txt  # reactions_txt given instead of result_dict, see the reactions_txt property
+        self.malformed_reactions = []  # reactionstream.MalformedReaction of the records skipped by the parser
         if result_dict:
-            self.reactions, self.reactions_txt = self.parse_results(result_dict)
+            self.reactions, self.next_idx = self.parse_results(result_dict)
+            self.result_dict = dict(result_dict)
         elif reactions_txt:
             self.reactions = self.parse_reactions_txt(reactions_txt)
+            self.next_idx = 1 + max((int(idx) for idx in self.reactions if idx.isdigit()), default=0)
         # self.reactions = self.parse_reactions(reactions_txt)
         self.product_dict = self.get_product_dict(self.reactions)
+        # substances and reactions interned once, expansion and pathway search run on the ids
+        self.reaction_table = ReactionTable(self.reactions)
         self.target_substance = target_substance
         # self.root = Node(target_substance)
         self.reaction_infos = set()
         self.all_path = []
-        self.chemical_cache = self.load_dict_from_json()  # Used to record whether a substance can be queried in the database
+        # Answers of substance_db in the builds of this tree, so a build sees one answer per substance;
+        # not saved with the tree, the substance cache (with its TTL) is the only persistent store
+        self.chemical_cache = {}
+        self.failed_queries = set()  # Substances whose query failed in this run: not common, not cached
         self.unexpandable_substances = set()  # Set of nodes that cannot be expanded
+        self.substance_db = substance_db
+        self.expander = None  # TreeExpander of the last construct_tree(engine='andor')
         # self.visited_substances = {}  # Records the substances visited and their expansion results
         # Create the root node and pass the cache query method, and the set of non-expandable nodes
-        self.root = Node(target_substance, self.reactions, self.product_dict,
-                         cache_func=self.is_common_chemical_cached,
-                         unexpandable_substances=self.unexpandable_substances,
-                         # visited_substances = self.visited_substances
-                         )
+        self.node_context = NodeContext(self.reactions, self.product_dict,
+                                        cache_func=self.is_common_chemical_cached,
+                                        unexpandable_substances=self.unexpandable_substances,
+                                        table=self.reaction_table)
+        self.root = Node(target_substance, self.node_context)
 
     def get_product_dict(self, reactions_dict):
         '''
@@ -251,98 +319,214 @@ class Tree:
             product_dict[key] = tuple(value)
         return product_dict
 
+    @property
+    def reactions_txt(self):
+        """
+        Reaction text of the tree: the reactions_txt given to __init__ followed by the reaction texts of result_dict,
+        joined on access instead of kept as one string
+        """
+        return (self._reactions_txt or '') + ''.join(values[0] + '\n\n' for values in self.result_dict.values())
+
+    def __getstate__(self):
+        # query results are read again from the substance cache by the next build
+        state = self.__dict__.copy()
+        state['chemical_cache'] = {}
+        state['failed_queries'] = set()
+        return state
+
+    def __setstate__(self, state):
+        # trees pickled by earlier versions keep the joined reactions_txt
+        if '_reactions_txt' not in state:
+            reactions_txt = state.pop('reactions_txt', None)
+            state['_reactions_txt'] = None if state.get('result_dict') else reactions_txt
+        state.setdefault('result_dict', {})
+        state.setdefault('malformed_reactions', [])
+        # query results of trees pickled by earlier versions carry no timestamps, they are queried again
+        state.pop('query_log', None)
+        state['chemical_cache'] = {}
+        state['failed_queries'] = set()
+        self.__dict__.update(state)
+        if 'reaction_table' not in state:
+            self.upgrade_state()
+
+    def upgrade_state(self):
+        """
+        Rebuild the attributes missing from a tree pickled by an earlier version: reaction_table,
+        node_context and expander. Nodes of the original Node class (names instead of interned ids) are
+        interned in the new node_context; the nodes are all restored before the tree (pickle order).
+        Children not materialized yet by the earlier TreeExpander (names instead of ids) are solved again by a
+        new TreeExpander on reaction_table.
+        """
+        self.product_dict = self.get_product_dict(self.reactions)
+        self.next_idx = 1 + max((int(idx) for idx in self.reactions if idx.isdigit()), default=0)
+        context = self.__dict__.get('node_context')
+        if context is not None:
+            # interned nodes: the table reuses the symbol tables of their context
+            self.reaction_table = ReactionTable(self.reactions, substances=context.substances,
+                                                reaction_ids=context.reaction_ids)
+        else:
+            self.reaction_table = ReactionTable(self.reactions)
+        self.__dict__.setdefault('substance_db', None)
+        self.__dict__.setdefault('unexpandable_substances', set())
+        legacy_expander = self.__dict__.get('expander')
+        self.expander = None
+        self.node_context = NodeContext(self.reactions, self.product_dict,
+                                        cache_func=self.is_common_chemical_cached,
+                                        unexpandable_substances=self.unexpandable_substances,
+                                        table=self.reaction_table)
+        substances = self.node_context.substances
+        reaction_ids = self.node_context.reaction_ids
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node.substance_id, str):
+                node.substance_id = substances.intern(node.substance_id)
+                node.reaction_id = -1 if node.reaction_id is None else reaction_ids.intern(str(node.reaction_id))
+                node.depth = 0 if node.father is None else node.father.depth + 1
+            node.context = self.node_context
+            if node.expansion is not None and node.expansion[0] is legacy_expander:
+                if self.expander is None:
+                    self.expander = TreeExpander(self.reaction_table, self.is_common_chemical_cached,
+                                                 self.unexpandable_substances)
+                    self.expander.root_entry = self.expander.solve(self.root.substance_id)
+                ancestors = frozenset() if node.father is None else node.father.get_lineage()
+                node.expansion = (self.expander, self.expander.solve(node.substance_id, ancestors))
+            nodes.extend(node._children)
+
+    def collect_reactions(self, reactions, errors):
+        """
+        reactions: Reaction iterator of reactionstream, appending the skipped records to errors
+        return: reactions_dict
+        """
+        reactions_dict = {reaction.idx: reaction_to_dict(reaction) for reaction in reactions}
+        report_malformed(errors)
+        self.malformed_reactions.extend(errors)
+        return reactions_dict
+
     def parse_reactions_txt(self, reactions_txt):
-        # idx = 1
         # note: v13 adds parsing of Conditions in reaction_txt & retains original Reaction idx instead of re-labeling
-        reactants = []
-        products = []
-        reactions_dict = {}
-        lines = reactions_txt.splitlines()
-        for line in lines:
-            line = line.strip()
-            if line.startswith('Reaction idx:'):
-                idx = line.split("Reaction idx:")[1].strip()
-            if line.startswith("Reactants:"):
-                reactants = line.split("Reactants:")[1].strip().split(', ')
-                reactants = [reactant.lower() for reactant in reactants]
-            elif line.startswith("Products:"):
-                products = line.split("Products:")[1].strip().split(', ')
-                products = [product.lower() for product in products]
-            elif line.startswith("Conditions:"):
-                conditions = line.split("Conditions:")[1].strip()
-            elif line.startswith("Source:"):
-                source = line.split("Source:")[1].strip()
-                reactions_dict[str(idx)] = {
-                    'reactants': tuple(reactants),
-                    'products': tuple(products),
-                    'conditions': conditions,
-                    'source': source,
-                }
-                # idx += 1
-        return reactions_dict
+        errors = []
+        return self.collect_reactions(iter_reactions(reactions_txt, numbered=True, errors=errors), errors)
 
     def parse_reactions(self, reactions_txt, idx, pdf_name):
-        # idx = 1
-        reactants = []
-        products = []
-        reactions_dict = {}
-        lines = reactions_txt.splitlines()
-        for line in lines:
-            line = line.strip()
-            if line.startswith("Reactants:"):
-                reactants = line.split("Reactants:")[1].strip().split(', ')
-                reactants = [reactant.lower() for reactant in reactants]
-            elif line.startswith("Products:"):
-                products = line.split("Products:")[1].strip().split(', ')
-                products = [product.lower() for product in products]
-            elif line.startswith("Conditions:"):
-                conditions = line.split("Conditions:")[1].strip()
-                reactions_dict[str(idx)] = {
-                    'reactants': tuple(reactants),
-                    'products': tuple(products),
-                    'conditions': conditions,
-                    'source': pdf_name,
-                }
-                idx += 1
-        return reactions_dict, idx
-
-    def parse_results(self, result_dict):
+        errors = []
+        counter = count(idx)
+        reactions_dict = self.collect_reactions(
+            iter_reactions(reactions_txt, source=pdf_name, counter=counter, errors=errors), errors)
+        return reactions_dict, next(counter)
+
+    def parse_results(self, result_dict, idx=1):
         """
         result_dict : gpt_results_40.json
+        idx: idx of the first reaction
+        return: reactions_dict, idx of the next reaction (skipped malformed records keep their idx)
         """
-        reactions_txt_all = ''
-        reactions = {}
-        idx = 1
-        for pdf_name, (reaction, property) in result_dict.items():
-            reactions_txt_all += (reaction + '\n\n')
-            additional_reactions, idx = self.parse_reactions(reaction, idx, pdf_name)
-            reactions.update(additional_reactions)
-        return reactions, reactions_txt_all
-
-
-    def save_dict_as_json(self, dict_file, filename="substance_query_result.json"):
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(dict_file, f, ensure_ascii=False, indent=4)
-
-    def load_dict_from_json(self, filename="substance_query_result.json"):
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                dict_file = json.load(f)
-                return dict_file
-        else:
-            return {}
+        errors = []
+        counter = count(idx)
+        reactions_dict = self.collect_reactions(iter_results(result_dict, errors=errors, counter=counter), errors)
+        return reactions_dict, next(counter)
+
+    def add_results(self, result_dict):
+        """
+        Add the reactions of new literature (same format as the result_dict of __init__), as result_dict.update:
+        the reactions of new pdfs get the next idx, so the tree is the same as a tree built from the merged results.
+        A pdf already in the tree with another reaction text renumbers the reactions after it, the reactions
+        and the tree are then rebuilt from scratch.
+        return: construct_tree result of the updated tree
+        """
+        new_results = {pdf_name: values for pdf_name, values in result_dict.items()
+                       if pdf_name not in self.result_dict}
+        changed = [pdf_name for pdf_name, values in result_dict.items()
+                   if pdf_name in self.result_dict and values[0] != self.result_dict[pdf_name][0]]
+        self.result_dict.update(result_dict)
+        if changed:
+            print(f'reactions of {len(changed)} literatures changed, rebuilding the tree')
+            reactions, next_idx = self.parse_results(self.result_dict)
+            # in place: the node context and the expander share the dicts
+            self.reactions.clear()
+            self.reactions.update(reactions)
+            self.product_dict.clear()
+            self.product_dict.update(self.get_product_dict(self.reactions))
+            self.reaction_table.clear()
+            self.reaction_table.add(self.reactions)
+            self.next_idx = next_idx
+            if self.expander is not None:
+                self.expander.graph.clear()
+            return self.update_tree(set(self.reaction_table.producers))
+        reactions, self.next_idx = self.parse_results(new_results, idx=self.next_idx)
+        return self.add_reactions(reactions)
+
+    def add_reactions(self, reactions):
+        """
+        reactions: new reactions {'idx': {'reactants': (), 'products': (), 'conditions': '', 'source': ''}, ...}
+        Only the part of the tree depending on the products of the new reactions is expanded again
+        return: construct_tree result of the updated tree
+        """
+        self.reactions.update(reactions)
+        for product, reactions_idxs in self.get_product_dict(reactions).items():
+            self.product_dict[product] = self.product_dict.get(product, ()) + reactions_idxs
+        return self.update_tree(self.reaction_table.add(reactions))
+
+    def update_tree(self, products):
+        # products: substance ids of the products of the added reactions
+        # The first call builds the tree, a tree built by the 'recursive' engine is built again
+        if self.expander is None:
+            self.unexpandable_substances.clear()
+            self.root = Node(self.target_substance, self.node_context)
+            return self.construct_tree()
+        self.prefetch_substances()
+        result = self.expander.update(self.root, products)
+        self.flush_substance_db()
+        return result
+
+
+    def get_substance_db(self):
+        if self.substance_db is None:
+            self.substance_db = CommonSubstanceDB()
+        return self.substance_db
+
+    def flush_substance_db(self):
+        # Batch boundary: write the query results buffered by substance_db to its cache
+        if self.substance_db is not None:
+            self.substance_db.flush()
 
     def is_common_chemical_cached(self, compound_name):
         """Use cache to avoid redundant compound queries"""
         if compound_name in self.chemical_cache:
             return self.chemical_cache[compound_name]
-        db = CommonSubstanceDB()
-        result = db.is_common_chemical(compound_name)
+        if compound_name in self.failed_queries:
+            return False
+        result = self.get_substance_db().is_common_chemical(compound_name, default=None)
+        if result is None:
+            # transient error: not common for this run, queried again by the next prefetch_substances
+            self.failed_queries.add(compound_name)
+            return False
         self.chemical_cache[compound_name] = result
-        self.save_dict_as_json(self.chemical_cache)
         return result
 
-    def construct_tree(self): # , init_reactants):
+    def prefetch_substances(self):
+        """
+        Query every substance of the reaction set that this tree has no answer for yet in one concurrent batch,
+        CommonSubstanceDB.prefetch reads the fresh records of its cache and writes the new results back once.
+        Failed queries are not cached: they are kept in failed_queries for this run and retried by the next prefetch
+        """
+        candidates = [self.target_substance]
+        for reaction in self.reactions.values():
+            candidates.extend(reaction['reactants'])
+            candidates.extend(reaction['products'])
+        missing = [name for name in dict.fromkeys(candidates) if name not in self.chemical_cache]
+        if missing:
+            results = self.get_substance_db().prefetch(missing)
+            self.failed_queries = {name for name in missing if name not in results}
+            self.chemical_cache.update(results)
+
+    def construct_tree(self, engine='andor', prefetch=True): # , init_reactants):
+        '''
+        engine: 'andor' memoized AND/OR expansion (TreeExpander), 'recursive' original per-path Node.expand
+        prefetch: resolve all substances of the reaction set up front (prefetch_substances)
+        '''
+        if prefetch:
+            self.prefetch_substances()
         # global init_reactants
         # if self.root.substance in init_reactants:
         #     raise ValueError("Target substance is already in initial reactants.")
@@ -350,7 +534,15 @@ class Tree:
         if self.is_common_chemical_cached(self.root.substance):
             raise ValueError("Target substance is easily gotten.")
             # return ("Target substance is easily gotten.")
-        result = self.root.expand() #, init_reactants)
+        if engine == 'andor':
+            self.expander = TreeExpander(self.reaction_table, self.is_common_chemical_cached,
+                                         self.unexpandable_substances)
+            result = self.expander.expand(self.root)
+        elif engine == 'recursive':
+            result = self.root.expand() #, init_reactants)
+        else:
+            raise ValueError(f"Unknown expansion engine: {engine}")
+        self.flush_substance_db()
         if result:
             return True # "Build tree successfully!"
         else:
@@ -361,7 +553,7 @@ class Tree:
         if node.reaction_index is None:
             return node.substance
         else:
-            depth = str(len(node.fathers_set))
+            depth = str(node.depth)
             return (depth+ "-" + node.substance+ "-" + '.'.join(map(str, list(node.reaction_line))))
 
     def add_nodes_edges(self, node, dot=None, simple = False):
@@ -398,76 +590,74 @@ class Tree:
         if node.reaction_index is None:
             return node.substance
         else:
-            depth = str(len(node.fathers_set))
+            depth = str(node.depth)
             # note: v13 return f"{depth}-{node.substance}" -> f"{depth}-{node.substance}-{node.father.node}"
             return f"{depth}-{node.substance}-{node.father.substance}"
 
     def add_nodes_edges_level_order2(self, node, dot=None, simple=False):
-        # If it is the root node
+        # Statements generated by treerender.iter_level_order: names built once per node, levels deduplicated with sets
+        root_node = dot is None
         if dot is None:
             if len(node.children) == 0:
                 raise Exception("Empty tree!")
-            dot = Digraph(comment='Substances Tree', graph_attr={'rankdir': 'LR'})
-            # dot.attr(overlap='false', ranksep='0.5', nodesep='1')
-            dot.attr('node', shape='ellipse', style='filled', fillcolor='#82b0d2', color='#999999', fontname="Arial", fontsize="8")
-            dot.attr('edge', color='#999999', fontname="Arial", fontsize="8")
-            root_fillcolor = '#beb8dc' # 紫色
-            dot.node(name=self.get_name_level_order(node), label='' if simple else node.substance, width='0.1', height='0.1', fillcolor=root_fillcolor)
-
-        queue = deque([node])
-        while queue:
-            level_nodes = []
-            level_edges = []
-            for _ in range(len(queue)):
-                cur_node = queue.popleft()
-                if cur_node.reaction_index is not None:
-                    edge_name = (self.get_name_level_order(cur_node.father) + self.get_name_level_order(cur_node))
-                    # 遍历每层节点，如果未添加则添加
-                    if edge_name not in level_edges:
-                        # label=f"idx : {str(cur_node.reaction_index)}"
-                        dot.edge(self.get_name_level_order(cur_node.father), self.get_name_level_order(cur_node), label=f"", arrowhead='none')
-                        level_edges.append(edge_name)
-
-                        reaction_info = str(cur_node.reaction_index)
-                        self.reaction_infos.add(reaction_info)
-
-                    # 判断当前节点是否为叶子节点
-                    node_name = cur_node.substance
-                    node_color = '#8ecfc9' if cur_node.is_leaf else '#82b0d2'  # 根据条件设定颜色
-                    if node_name not in level_nodes:
-                        dot.node(name=self.get_name_level_order(cur_node), label='' if simple else cur_node.substance, width='0.1', height='0.1', fillcolor=node_color)
-                        level_nodes.append(node_name)
-
-                for child in cur_node.children:
-                    queue.append(child)
+            dot = tree_digraph()
+        dot.body.extend(iter_level_order(node, simple=simple, reaction_infos=self.reaction_infos, root_node=root_node))
         return dot
 
     def get_reactions_in_tree(self, reaction_idx_list):
-        reactions_tree = ''
-        for idx in reaction_idx_list:
-            reactants = self.reactions[idx]['reactants']
-            products = self.reactions[idx]['products']
-            conditions = self.reactions[idx]['conditions']
-            source = self.reactions[idx]['source']
-            reaction_string = (f"Reaction idx: {idx}\nReactants: {', '.join(reactants)}\nProducts: {', '.join(products)}\n"
-                               f"Conditions: {conditions}\nSource: {source}\n\n")
-            reactions_tree += reaction_string
-        return reactions_tree
-
-
-    def show_tree(self, view=False, simple=False, dpi='500', img_suffix=''):
-
-        dot = self.add_nodes_edges_level_order2(self.root, simple=simple)
-        dot.attr(dpi=dpi)
-        dot.render(filename=str(self.target_substance) + img_suffix, format='png', view=view)
-        # tree_base64_image = self.png_to_base64(str(self.target_substance) + img_suffix + '.png')
-
-        # dot.render('substances_tree', format='svg', view=True)
+        return ''.join(reaction_entry(idx, self.reactions[idx]) + '\n\n' for idx in reaction_idx_list)
 
-        # Extract the relevant reactions from all_reactions_txt based on the idx involved in the tree
-        # reactions_tree: all reactions(idx, reactants, products, conditions) in the tree
-        reaction_idx_list = list(self.reaction_infos)
-        reactions_tree = self.get_reactions_in_tree(reaction_idx_list)
+    def get_tree_reaction_ids(self):
+        '''
+        Ids (self.reaction_table.reaction_ids) of all the reactions in the tree, found without rendering: the children
+        not materialized yet are read from the AND/OR graph (TreeExpander) or the node table of a tree file
+        '''
+        reaction_ids = set()
+        seen = set()  # AND/OR nodes already walked
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.expansion is not None:
+                source, entry = node.expansion
+                source.collect_reaction_ids(node.context, entry, reaction_ids, seen)
+                continue
+            for child in node.children:
+                reaction_ids.add(child.reaction_id)
+                stack.append(child)
+        return reaction_ids
+
+    def get_tree_reactions(self, as_text=True):
+        '''
+        Reactions of the tree in reaction table order, without Graphviz (the reactions returned by show_tree)
+        as_text: reaction text (get_reactions_in_tree), otherwise {idx: reaction}
+        '''
+        names = self.reaction_table.reaction_ids.names
+        reaction_idx_list = [names[reaction_id] for reaction_id in sorted(self.get_tree_reaction_ids())]
+        self.reaction_infos = set(reaction_idx_list)
+        if as_text:
+            return self.get_reactions_in_tree(reaction_idx_list)
+        return {idx: self.reactions[idx] for idx in reaction_idx_list}
+
+    def render_tree_image(self, view=False, simple=False, dpi='500', img_suffix='', format='png', background=False):
+        '''
+        Draw the tree to {target_substance}{img_suffix}.{format}, the DOT source is streamed to {target_substance}{img_suffix}
+        format: 'png' rendered at dpi (slow on large trees), 'svg' (dpi not applied), 'dot' to only write the source to .dot
+        background: render the image in a background thread, return a Future of the image path
+        '''
+        if len(self.root.children) == 0:
+            raise Exception("Empty tree!")
+        return render_tree(self.root, str(self.target_substance) + img_suffix, format=format, simple=simple,
+                           dpi=None if format in ('svg', 'dot') else dpi, view_image=view, background=background)
+
+    def show_tree(self, view=False, simple=False, dpi='500', img_suffix='', format='png', background=False):
+        # reactions_tree: all reactions(idx, reactants, products, conditions, source) in the tree
+        # get_tree_reactions gives them without drawing the tree
+        if len(self.root.children) == 0:
+            raise Exception("Empty tree!")
+        reactions_tree = self.get_tree_reactions()
+        self.render_tree_image(view=view, simple=simple, dpi=dpi, img_suffix=img_suffix, format=format,
+                               background=background)
+        # tree_base64_image = self.png_to_base64(str(self.target_substance) + img_suffix + '.png')
         return reactions_tree #, tree_base64_image
 
 
@@ -483,26 +673,40 @@ class Tree:
         return base64_image
 
 
-    def find_all_paths(self):
+    def get_pathway_enumerator(self, max_depth=None):
+        # Enumerate on the shared AND/OR graph when the tree was built by TreeExpander
+        expander = self.expander if self.expander is not None and self.expander.root_entry is not None else None
+        return PathwayEnumerator(self.root, expander=expander, max_depth=max_depth)
+
+    def iter_paths(self, limit=None, max_depth=None):
+        """
+        Yield the minimal reaction pathways [idx (str), ...] of the tree, the pathways with the fewest reactions first
+        Pathways are searched as they are consumed (pathfinder.PathwayEnumerator), limit and max_depth bound the search.
+        limit: stop after this many pathways
+        max_depth: skip pathways with more than max_depth consecutive reactions below the target
+        """
+        for count, path in enumerate(self.get_pathway_enumerator(max_depth=max_depth)):
+            if limit is not None and count >= limit:
+                return
+            yield path
+
+    def find_all_paths(self, limit=None, max_depth=None):
+        """
+        All minimal reaction pathways: [[idx (str), ...], ...]
+        A pathway containing all reactions of another pathway is removed, identical pathways are kept once.
+        """
+        return list(self.iter_paths(limit=limit, max_depth=max_depth))
+
+    def count_paths(self, max_depth=None, minimal=True, limit=None):
         """
-        class Node:
-        def __init__(self, substance, fathers_set=None, reaction_index=None, reaction_line=None):
-        # reaction_index: the index of the reaction obtained from the nth reaction: idx(str)
-        # substance: the name of the current node: name(str)
-        # children: list of child nodes: [Node, ...]
-        # fathers_set: set of parent node names: set(name(str), name(str))
-        # reaction_line: reaction path: [idx(str), ...]
-        # brothers: list of sibling nodes: [None, ...]
-        self.reaction_index = reaction_index
-        self.substance = substance
-        self.children = []
-        self.fathers_set = fathers_set if fathers_set is not None else set()
-        self.reaction_line = reaction_line if reaction_line is not None else []
+        minimal=True: number of pathways returned by find_all_paths (at most limit), counted during the search
+                      without building the pathways, only their reaction bitsets are kept for the superset check
+        minimal=False: number of reaction combinations before superset removal, counted without enumerating them
         """
-        path = self.search_reaction_pathways(self.root)
-        path = self.clean_path(path)
-        path = self.remove_supersets(path)
-        return path
+        enumerator = self.get_pathway_enumerator(max_depth=max_depth)
+        if minimal:
+            return enumerator.count(limit=limit)
+        return enumerator.count_raw()
 
     def search_reaction_pathways(self, node):
         # Termination condition: if it is a leaf node, return an empty path
@@ -547,39 +751,37 @@ class Tree:
 
     def remove_supersets(self, data):
         """
-            Remove larger sets that contain smaller sets, keeping the smaller sets
+            Remove larger sets that contain smaller sets, keeping the smaller sets (identical sets are kept once)
             :param data: List of lists, the original data
             :return: The result list after removing larger sets that contain other sets
         """
-        # Convert to list of sets to facilitate subset checking
-        data_sets = [set(sublist) for sublist in data]
-
-        # Result list to store the kept subsets
-        result = []
-
-        # Iterate over all the sets
-        for i, current_set in enumerate(data_sets):
-            # Check if the current set is a superset of any other set
-            is_superset = False
-            for j, other_set in enumerate(data_sets):
-                if i != j and current_set.issuperset(other_set):
-                    is_superset = True
-                    break
-            # If the current set is not a superset of any other, keep it
-            if not is_superset:
-                result.append(data[i])
-
-        return result
+        return list(PathwaySet(data).minimize())
 
 
 class TreeLoader():
-    def save_tree(self, tree, filename):
-        with open(filename, 'wb') as f:
-            pickle.dump(tree, f)
+    def save_tree(self, tree, filename, format='binary'):
+        """
+        format: 'binary' versioned tree file (see treefile), 'pickle' the former pickled Tree
+        """
+        if format == 'binary':
+            save_tree_file(tree, filename)
+        elif format == 'pickle':
+            with open(filename, 'wb') as f:
+                pickle.dump(tree, f)
+        else:
+            raise ValueError(f"Unknown tree format: {format}")
         print(f"Tree saved to {filename}")
 
-    def load_tree(self, filename):
-        with open(filename, 'rb') as f:
-            tree = pickle.load(f)
+    def load_tree(self, filename, lazy=True):
+        """
+        Tree files and pickled trees are told apart by the file header
+        lazy: tree files only, create the nodes on first access of node.children
+        Trees pickled by earlier versions are upgraded on load (Tree.upgrade_state)
+        """
+        if is_tree_file(filename):
+            tree = load_tree_file(filename, lazy=lazy)
+        else:
+            with open(filename, 'rb') as f:
+                tree = pickle.load(f)
         print(f"Tree loaded from {filename}")
         return tree
@@ -0,0 +1,267 @@
+'''
+Memoized AND/OR expansion engine for the retrosynthetic tree.
+
+OR node  : a substance that has to be obtained, identified by (substance, context)
+AND node : a reaction producing the substance, all of its reactants have to be obtained
+Substances and reactions are the interned ids of the tree's ReactionTable.
+
+context is the set of ancestor substances that can still show up below the substance.
+An ancestor can only appear again below the substance if both lie on a cycle of the
+reaction graph, i.e. they belong to the same strongly connected component, so all other
+ancestors are dropped from the key. For acyclic reaction sets every substance is expanded once.
+
+When reactions are added (TreeExpander.update) only the nodes of the new products and the nodes that visited
+them, directly or through other nodes, are solved again. The other nodes did not see the changed products,
+so their results still hold.
+'''
+
+
+class AndOrNode:
+    def __init__(self, substance, context):
+        '''
+        substance: id of the substance (int)
+        context: ancestors of the substance in the same strongly connected component: frozenset(id (int), ...)
+        is_leaf: the substance is a common chemical
+        solvable: the substance can be expanded to common chemicals
+        options: valid reactions producing the substance: [(reaction id (int), [key, ...]), ...]
+        visited: keys of all child nodes solved for the substance, valid or not: [key, ...]
+        '''
+        self.substance = substance
+        self.context = context
+        self.is_leaf = False
+        self.solvable = False
+        self.options = []
+        self.visited = []
+
+    @property
+    def key(self):
+        return (self.substance, self.context)
+
+
+class TreeExpander:
+    def __init__(self, table, cache_func, unexpandable_substances):
+        """
+        table: ReactionTable, reactants[reaction id] (substance id, ...), producers[substance id] (reaction id, ...)
+        cache_func: is the substance (name) a common chemical
+        unexpandable_substances: set of names, filled during expansion
+        """
+        self.table = table
+        self.cache_func = cache_func
+        self.unexpandable_substances = unexpandable_substances
+        self.components, self.component_sizes = self.get_components(table)
+        self.graph = {}  # (substance, context) -> AndOrNode
+        self.root_entry = None
+
+    @staticmethod
+    def get_components(table):
+        '''
+        Strongly connected components of the substance graph (edge: product -> reactant), iterative Tarjan.
+        return: {substance id: component id}, {component id: size}
+        '''
+        successors = {}
+        for product, reaction_ids in table.producers.items():
+            targets = []
+            for reaction_id in reaction_ids:
+                targets.extend(table.reactants[reaction_id])
+            successors[product] = targets
+
+        index = {}
+        lowlink = {}
+        on_stack = set()
+        stack = []
+        components = {}
+        component_sizes = {}
+        counter = 0
+        for start in successors:
+            if start in index:
+                continue
+            index[start] = lowlink[start] = counter
+            counter += 1
+            stack.append(start)
+            on_stack.add(start)
+            work = [(start, iter(successors.get(start, ())))]
+            while work:
+                substance, children = work[-1]
+                advanced = False
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(successors.get(child, ()))))
+                        advanced = True
+                        break
+                    elif child in on_stack:
+                        lowlink[substance] = min(lowlink[substance], index[child])
+                if advanced:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[substance])
+                if lowlink[substance] == index[substance]:
+                    component_id = len(component_sizes)
+                    size = 0
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        components[member] = component_id
+                        size += 1
+                        if member == substance:
+                            break
+                    component_sizes[component_id] = size
+        return components, component_sizes
+
+    @staticmethod
+    def cycle_groups(components, component_sizes):
+        # Substances sharing a cycle, the only part of the components the node keys depend on
+        groups = {}
+        for substance, component_id in components.items():
+            if component_sizes[component_id] > 1:
+                groups.setdefault(component_id, set()).add(substance)
+        return {frozenset(group) for group in groups.values()}
+
+    def get_context(self, substance, ancestors):
+        component_id = self.components.get(substance)
+        # Substances outside any cycle can never meet their ancestors again
+        if component_id is None or self.component_sizes[component_id] == 1:
+            return frozenset()
+        return frozenset(a for a in ancestors if self.components.get(a) == component_id)
+
+    def solve(self, substance, ancestors=frozenset()):
+        '''
+        Same rules as Node.expand, evaluated once per (substance, context)
+        ancestors: set of ancestor substance ids (current substance excluded)
+        '''
+        key = (substance, self.get_context(substance, ancestors))
+        entry = self.graph.get(key)
+        if entry is not None:
+            return entry
+        entry = AndOrNode(*key)
+        self.graph[key] = entry
+
+        table = self.table
+        if self.cache_func(table.substances.name(substance)):
+            entry.is_leaf = True
+            entry.solvable = True
+            return entry
+        reaction_ids = table.get_producers(substance)
+        if len(reaction_ids) == 0:
+            self.unexpandable_substances.add(table.substances.name(substance))
+            return entry
+
+        child_ancestors = ancestors | {substance}
+        for reaction_id in reaction_ids:
+            child_keys = []
+            for reactant in table.reactants[reaction_id]:
+                # Loop back to an ancestor, or a reactant that cannot be obtained: the whole reaction is invalid
+                if reactant in child_ancestors:
+                    child_keys = None
+                    break
+                child = self.solve(reactant, child_ancestors)
+                entry.visited.append(child.key)
+                if not child.solvable:
+                    child_keys = None
+                    break
+                child_keys.append(child.key)
+            if child_keys:
+                entry.options.append((reaction_id, child_keys))
+        entry.solvable = len(entry.options) > 0
+        return entry
+
+    def build_children(self, node, entry):
+        '''
+        Materialize the children of node from the AND/OR graph, grandchildren are materialized lazily (Node.children)
+        '''
+        for reaction_id, child_keys in entry.options:
+            for key in child_keys:
+                child_entry = self.graph[key]
+                child = node.add_child_id(key[0], reaction_id)
+                if child_entry.is_leaf:
+                    child.is_leaf = True
+                else:
+                    child.expansion = (self, child_entry)
+
+    def collect_reaction_ids(self, context, entry, reaction_ids, seen):
+        '''
+        Add to reaction_ids the reaction ids of the subtree build_children would materialize from entry,
+        without creating the nodes: each AND/OR node is walked once (seen: keys already walked)
+        '''
+        stack = [entry.key]
+        while stack:
+            key = stack.pop()
+            if key in seen:
+                continue
+            seen.add(key)
+            for reaction_id, child_keys in self.graph[key].options:
+                reaction_ids.add(reaction_id)
+                stack.extend(child_keys)
+
+    def expand(self, root):
+        """
+        Drop-in replacement of root.expand()
+        """
+        entry = self.solve(root.substance_id, frozenset(root.fathers_set.ids))
+        self.root_entry = entry
+        if entry.is_leaf:
+            root.is_leaf = True
+        elif entry.solvable:
+            root.expansion = (self, entry)
+        return entry.solvable
+
+    def reset(self, root):
+        root.children = []
+        root.expansion = None
+        root.is_leaf = False
+        self.root_entry = None
+
+    def update(self, root, products):
+        """
+        Re-expand root after reactions producing `products` (substance ids) were added to the table
+        Nodes of the products and all nodes depending on them are dropped from the graph and solved again,
+        the whole graph is dropped when the new reactions close new cycles (node keys change)
+        return: root can be expanded, as expand(root)
+        """
+        components, component_sizes = self.get_components(self.table)
+        if self.cycle_groups(components, component_sizes) != self.cycle_groups(self.components, self.component_sizes):
+            self.graph.clear()
+        else:
+            dependents = {}
+            for key, entry in self.graph.items():
+                for child_key in entry.visited:
+                    dependents.setdefault(child_key, []).append(key)
+            stale = [key for key in self.graph if key[0] in products]
+            invalid = set(stale)
+            while stale:
+                key = stale.pop()
+                for parent_key in dependents.get(key, ()):
+                    if parent_key not in invalid:
+                        invalid.add(parent_key)
+                        stale.append(parent_key)
+            for key in invalid:
+                del self.graph[key]
+        self.components, self.component_sizes = components, component_sizes
+        self.reset(root)
+        result = self.expand(root)
+        self.refresh_unexpandable()
+        return result
+
+    def refresh_unexpandable(self):
+        """
+        Recompute unexpandable_substances (in place) from the nodes reachable from the root,
+        the nodes dropped by update may have reached substances that are expandable now
+        """
+        self.unexpandable_substances.clear()
+        if self.root_entry is None:
+            return
+        seen = {self.root_entry.key}
+        stack = [self.root_entry]
+        while stack:
+            entry = stack.pop()
+            if not entry.is_leaf and len(self.table.get_producers(entry.substance)) == 0:
+                self.unexpandable_substances.add(self.table.substances.name(entry.substance))
+            for key in entry.visited:
+                if key not in seen:
+                    seen.add(key)
+                    stack.append(self.graph[key])
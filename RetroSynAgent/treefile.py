@@ -0,0 +1,310 @@
+'''
+Versioned binary format of a retrosynthetic tree (TreeLoader.save_tree / load_tree), replacing pickle:
+flat arrays instead of one pickled object per Node, so files are smaller, loading does not recurse and
+the node table is read from a memory map. Node objects are created lazily, on first access of node.children.
+The scripts name these files <material>.rstree; pickled trees (.pkl) are still read by load_tree.
+
+layout:
+    header     magic b'RSTREE', format version (uint16), byte order of the arrays (b'<' / b'>'), number of sections (uint32)
+    directory  per section: name (8 bytes), offset (uint64), length (uint64)
+    sections   8-byte aligned:
+        meta                  JSON: target substance, result_dict, unexpandable substances, ...
+        stroff / strdata      interned string table: int64 offsets into the utf-8 blob
+                              (the first meta['num_substances'] strings are the substances, ids as in NodeContext.substances)
+        rxnkey / rxncond / rxnsrc   per reaction: string id of idx, conditions, source (-1 for None)
+        rctoff / rct          reactants of reaction i: rct[rctoff[i]:rctoff[i + 1]] (string ids)
+        prdoff / prd          products, same layout
+        parent / nodesub / noderxn / nodeleaf / childoff
+                              node table in breadth-first order, node 0 is the root:
+                              parent index (-1), substance string id, reaction idx string id (-1), is_leaf,
+                              children of node i: childoff[i] .. childoff[i + 1] - 1
+'''
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+magic = b'RSTREE'
+version = 1
+header_format = '<6sHc3xI'
+entry_format = '<8sQQ'
+byteorder = b'<' if sys.byteorder == 'little' else b'>'
+
+
+def is_tree_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+class TreeFile:
+    '''
+    Read access to the sections of a tree file, arrays are zero-copy views of the memory map
+    '''
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, file_version, file_byteorder, num_sections = struct.unpack_from(header_format, self.buffer, 0)
+        if file_magic != magic:
+            raise ValueError(f"{filename} is not a tree file")
+        if file_version > version:
+            raise ValueError(f"{filename}: tree file version {file_version} is newer than the supported version {version}")
+        self.version = file_version
+        self.swap = file_byteorder != byteorder
+        self.sections = {}
+        position = struct.calcsize(header_format)
+        for _ in range(num_sections):
+            name, offset, length = struct.unpack_from(entry_format, self.buffer, position)
+            self.sections[name.rstrip(b'\0').decode()] = (offset, length)
+            position += struct.calcsize(entry_format)
+
+    def bytes(self, name):
+        offset, length = self.sections[name]
+        return memoryview(self.buffer)[offset:offset + length]
+
+    def array(self, name, typecode):
+        view = self.bytes(name)
+        if self.swap:
+            # written on a machine of the other byte order: copy and swap
+            values = array(typecode, view.tobytes())
+            values.byteswap()
+            return values
+        return view.cast(typecode)
+
+    def meta(self):
+        return json.loads(self.bytes('meta').tobytes().decode('utf-8'))
+
+    def strings(self):
+        offsets = self.array('stroff', 'q')
+        data = self.bytes('strdata').tobytes()
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def write_tree_file(filename, meta, sections):
+    '''
+    meta: JSON-serializable dict
+    sections: {name: array or bytes}
+    '''
+    sections = [('meta', json.dumps(meta, ensure_ascii=False).encode('utf-8'))] + list(sections.items())
+    position = struct.calcsize(header_format) + len(sections) * struct.calcsize(entry_format)
+    directory, blobs = [], []
+    for name, data in sections:
+        if len(name.encode()) > 8:
+            raise ValueError(f"Section name longer than 8 bytes: {name}")
+        data = data.tobytes() if isinstance(data, array) else bytes(data)
+        position += -position % 8
+        directory.append(struct.pack(entry_format, name.encode(), position, len(data)))
+        blobs.append((position, data))
+        position += len(data)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(struct.pack(header_format, magic, version, byteorder, len(sections)))
+        f.write(b''.join(directory))
+        for offset, data in blobs:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(data)
+    os.replace(tmp_filename, filename)
+
+
+class NodeTable:
+    '''
+    Node table of a tree file, creates the children of a node on first access (Node.expansion = (table, index))
+    '''
+    def __init__(self, names, childoff, substance, reaction, leaf):
+        self.names = names
+        self.childoff = childoff
+        self.substance = substance
+        self.reaction = reaction
+        self.leaf = leaf
+        self.reaction_ids = {}  # reaction idx string id -> context.reaction_ids id
+
+    def __len__(self):
+        return len(self.substance)
+
+    def has_children(self, index):
+        return self.childoff[index] < self.childoff[index + 1]
+
+    def get_reaction_id(self, context, string_id):
+        reaction_id = self.reaction_ids.get(string_id)
+        if reaction_id is None:
+            reaction_id = self.reaction_ids[string_id] = context.reaction_ids.intern(self.names[string_id])
+        return reaction_id
+
+    def build_children(self, node, index):
+        # the substance ids of the table are the ids of node.context.substances (see load_tree_file)
+        context = node.context
+        childoff, leaf = self.childoff, self.leaf
+        for j in range(childoff[index], childoff[index + 1]):
+            child = node.add_child_id(self.substance[j], self.get_reaction_id(context, self.reaction[j]))
+            if leaf[j]:
+                child.is_leaf = True
+            if childoff[j] < childoff[j + 1]:
+                child.expansion = (self, j)
+
+    def collect_reaction_ids(self, context, index, reaction_ids, seen):
+        '''
+        Add to reaction_ids the reaction ids of the subtree below row index, read from the table without creating
+        the nodes (seen is not needed: the rows form a tree)
+        '''
+        childoff, reaction = self.childoff, self.reaction
+        string_ids = set()
+        # every row below the root belongs to its subtree
+        stack = [index] if index > 0 else []
+        if index == 0:
+            string_ids.update(reaction[1:len(self)])
+        while stack:
+            i = stack.pop()
+            start, end = childoff[i], childoff[i + 1]
+            string_ids.update(reaction[start:end])
+            stack.extend(range(start, end))
+        reaction_ids.update(self.get_reaction_id(context, string_id) for string_id in string_ids)
+
+    def __getstate__(self):
+        # lazy nodes of a loaded tree can be pickled: the memory map views are copied
+        state = self.__dict__.copy()
+        for name, typecode in (('childoff', 'i'), ('substance', 'i'), ('reaction', 'i'), ('leaf', 'B')):
+            state[name] = array(typecode, state[name])
+        return state
+
+
+def pack_tree(tree):
+    '''
+    return: meta, sections of write_tree_file
+    '''
+    # breadth-first: the children of a node are consecutive. Walking the tree first materializes the lazy nodes,
+    # so context.substances is complete before it is copied to the string table
+    order = [tree.root]
+    parent, childoff = array('i', [-1]), array('i')
+    i = 0
+    while i < len(order):
+        childoff.append(len(order))
+        for child in order[i].children:
+            order.append(child)
+            parent.append(i)
+        i += 1
+    childoff.append(len(order))
+
+    context = tree.node_context
+    strings = {}
+    names = []
+
+    def intern(name):
+        if name is None:
+            return -1
+        string_id = strings.get(name)
+        if string_id is None:
+            string_id = strings[name] = len(names)
+            names.append(name)
+        return string_id
+
+    for name in context.substances:
+        intern(name)
+    num_substances = len(names)
+
+    substance = array('i', (node.substance_id for node in order))
+    reaction = array('i', (intern(node.reaction_index) for node in order))
+    leaf = array('B', (1 if node.is_leaf else 0 for node in order))
+
+    reaction_keys, conditions, sources = array('i'), array('i'), array('i')
+    rctoff, rct, prdoff, prd = array('i', [0]), array('i'), array('i', [0]), array('i')
+    for idx, reaction_entry in tree.reactions.items():
+        reaction_keys.append(intern(idx))
+        conditions.append(intern(reaction_entry.get('conditions')))
+        sources.append(intern(reaction_entry.get('source')))
+        rct.extend(intern(name) for name in reaction_entry['reactants'])
+        rctoff.append(len(rct))
+        prd.extend(intern(name) for name in reaction_entry['products'])
+        prdoff.append(len(prd))
+
+    stroff = array('q', [0])
+    encoded = [name.encode('utf-8') for name in names]
+    for data in encoded:
+        stroff.append(stroff[-1] + len(data))
+
+    meta = {
+        'target_substance': tree.target_substance,
+        'num_substances': num_substances,
+        'result_dict': tree.result_dict,
+        # the reactions_txt given instead of result_dict, the rest of tree.reactions_txt is derived from result_dict
+        'reactions_txt': tree._reactions_txt,
+        'next_idx': getattr(tree, 'next_idx', None),
+        'unexpandable_substances': sorted(tree.unexpandable_substances),
+        'reaction_infos': sorted(tree.reaction_infos),
+        'all_path': tree.all_path,
+    }
+    sections = {
+        'stroff': stroff, 'strdata': b''.join(encoded),
+        'rxnkey': reaction_keys, 'rxncond': conditions, 'rxnsrc': sources,
+        'rctoff': rctoff, 'rct': rct, 'prdoff': prdoff, 'prd': prd,
+        'parent': parent, 'nodesub': substance, 'noderxn': reaction, 'nodeleaf': leaf, 'childoff': childoff,
+    }
+    return meta, sections
+
+
+def save_tree_file(tree, filename):
+    meta, sections = pack_tree(tree)
+    write_tree_file(filename, meta, sections)
+
+
+def load_tree_file(filename, lazy=True):
+    '''
+    lazy: create the Node objects on first access of node.children, otherwise all at once
+    The AND/OR graph is not stored: tree.expander is None, pathways are enumerated on the Node tree
+    '''
+    from .treebuilder import Tree, Node, NodeContext
+    from .symboltable import SymbolTable, ReactionTable
+
+    tree_file = TreeFile(filename)
+    meta = tree_file.meta()
+    names = tree_file.strings()
+
+    def name(string_id):
+        return None if string_id < 0 else names[string_id]
+
+    reaction_keys = tree_file.array('rxnkey', 'i')
+    conditions, sources = tree_file.array('rxncond', 'i'), tree_file.array('rxnsrc', 'i')
+    rctoff, rct = tree_file.array('rctoff', 'i'), tree_file.array('rct', 'i')
+    prdoff, prd = tree_file.array('prdoff', 'i'), tree_file.array('prd', 'i')
+    reactions = {}
+    for i in range(len(reaction_keys)):
+        reactions[names[reaction_keys[i]]] = {
+            'reactants': tuple(names[j] for j in rct[rctoff[i]:rctoff[i + 1]]),
+            'products': tuple(names[j] for j in prd[prdoff[i]:prdoff[i + 1]]),
+            'conditions': name(conditions[i]),
+            'source': name(sources[i]),
+        }
+
+    tree = Tree.__new__(Tree)
+    tree.result_dict = {pdf_name: tuple(values) for pdf_name, values in meta['result_dict'].items()}
+    tree.reactions = reactions
+    tree._reactions_txt = meta['reactions_txt']
+    tree.malformed_reactions = []
+    tree.next_idx = meta['next_idx'] if meta['next_idx'] is not None else \
+        1 + max((int(idx) for idx in reactions if idx.isdigit()), default=0)
+    tree.product_dict = tree.get_product_dict(reactions)
+    tree.target_substance = meta['target_substance']
+    tree.reaction_infos = set(meta['reaction_infos'])
+    tree.all_path = meta['all_path']
+    # query results are read from the substance cache (files of earlier versions also stored chemical_cache)
+    tree.chemical_cache = {}
+    tree.failed_queries = set()
+    tree.unexpandable_substances = set(meta['unexpandable_substances'])
+    tree.substance_db = None
+    tree.expander = None
+    # substances interned in the saved order: same ids as the substance column of the node table
+    tree.reaction_table = ReactionTable(reactions, substances=SymbolTable(names[:meta['num_substances']]))
+    tree.node_context = NodeContext(reactions, tree.product_dict, cache_func=tree.is_common_chemical_cached,
+                                    unexpandable_substances=tree.unexpandable_substances, table=tree.reaction_table)
+
+    table = NodeTable(names, tree_file.array('childoff', 'i'), tree_file.array('nodesub', 'i'),
+                      tree_file.array('noderxn', 'i'), tree_file.array('nodeleaf', 'B'))
+    tree.root = Node(names[table.substance[0]], tree.node_context)
+    tree.root.is_leaf = bool(table.leaf[0])
+    if table.has_children(0):
+        tree.root.expansion = (table, 0)
+    if not lazy:
+        stack = [tree.root]
+        while stack:
+            stack.extend(stack.pop().children)
+    return tree
@@ -0,0 +1,138 @@
+'''
+Level-order Graphviz rendering of a reaction tree (Tree.show_tree), generated as DOT lines in one pass:
+the lines can be joined into a Digraph (Tree.add_nodes_edges_level_order2) or written to a file as they are produced,
+so the DOT source of a large tree is never held in memory.
+
+The Graphviz render (render_tree, background=True) can run in a background thread once the DOT source is written.
+
+Output of the former add_nodes_edges_level_order2 (same lines, same order):
+    node names    root: its substance, other nodes: '{depth}-{substance}-{father substance}'
+    per level     one edge per (father name, node name), one node statement per substance
+'''
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from graphviz import Digraph, render, view
+from graphviz.quoting import quote, quote_edge, a_list
+
+root_fillcolor = '#beb8dc'  # 紫色
+leaf_fillcolor = '#8ecfc9'
+node_fillcolor = '#82b0d2'
+
+
+def tree_digraph():
+    # Digraph of the tree header: graph / node / edge attributes, no statements
+    dot = Digraph(comment='Substances Tree', graph_attr={'rankdir': 'LR'})
+    # dot.attr(overlap='false', ranksep='0.5', nodesep='1')
+    dot.attr('node', shape='ellipse', style='filled', fillcolor=node_fillcolor, color='#999999', fontname="Arial", fontsize="8")
+    dot.attr('edge', color='#999999', fontname="Arial", fontsize="8")
+    return dot
+
+
+def level_order_name(node):
+    # Tree.get_name_level_order
+    if node.father is None or node.reaction_id < 0:
+        return node.substance
+    return f"{node.depth}-{node.substance}-{node.father.substance}"
+
+
+def iter_level_order(root, simple=False, reaction_infos=None, root_node=True):
+    '''
+    DOT statements of the tree below root, level by level
+    simple: nodes without labels
+    reaction_infos: set, receives the idx (str) of the reactions of the drawn edges
+    root_node: start with the statement of the root node
+    Names are built once per node, the edges and nodes of a level are deduplicated with sets.
+    '''
+    substance_names = root.context.substances.names
+    reaction_name = root.context.reaction_ids.name
+    # attributes after the label, as Digraph.node / Digraph.edge write them
+    node_attrs = {color: f" {a_list(kwargs={'fillcolor': color, 'height': '0.1', 'width': '0.1'})}]\n"
+                  for color in (root_fillcolor, leaf_fillcolor, node_fillcolor)}
+    edge_attrs = f" [{a_list('', kwargs={'arrowhead': 'none'})}]\n"
+    empty_label = quote('')
+
+    root_substance = substance_names[root.substance_id]
+    root_name = level_order_name(root)
+    if root_node:
+        yield f"\t{quote(root_name)} [label={empty_label if simple else quote(root_substance)}" \
+              f"{node_attrs[root_fillcolor]}"
+    # (node, name, substance, name of the father), names are only quoted for the written statements
+    father_name = None
+    if root.father is not None and root.reaction_id >= 0:
+        father_name = level_order_name(root.father)
+    queue = deque([(root, root_name, root_substance, father_name)])
+    while queue:
+        level_nodes = set()
+        level_edges = set()
+        for _ in range(len(queue)):
+            cur_node, name, substance, father_name = queue.popleft()
+            if father_name is not None:
+                # 遍历每层节点，如果未添加则添加
+                edge = (father_name, name)
+                if edge not in level_edges:
+                    level_edges.add(edge)
+                    yield f"\t{quote_edge(father_name)} -> {quote_edge(name)}{edge_attrs}"
+                    if reaction_infos is not None:
+                        reaction_infos.add(reaction_name(cur_node.reaction_id))
+                # 判断当前节点是否为叶子节点
+                if cur_node.substance_id not in level_nodes:
+                    level_nodes.add(cur_node.substance_id)
+                    yield f"\t{quote(name)} [label={empty_label if simple else quote(substance)}" \
+                          f"{node_attrs[leaf_fillcolor if cur_node.is_leaf else node_fillcolor]}"
+            depth = f"{cur_node.depth + 1}-"
+            suffix = f"-{substance}"
+            for child in cur_node.children:
+                child_substance = substance_names[child.substance_id]
+                queue.append((child, depth + child_substance + suffix, child_substance, name))
+
+
+def iter_tree_dot(root, simple=False, dpi=None, reaction_infos=None):
+    '''
+    DOT source of the tree, line by line: same source as Tree.add_nodes_edges_level_order2 followed by dot.attr(dpi=dpi)
+    dpi: resolution of the rendered image, None for the Graphviz default
+    '''
+    *head, tail = tree_digraph()
+    yield from head
+    yield from iter_level_order(root, simple=simple, reaction_infos=reaction_infos)
+    if dpi is not None:
+        yield f"\t{a_list(kwargs={'dpi': dpi})}\n"
+    yield tail
+
+
+def write_tree_dot(root, filename, simple=False, dpi=None, reaction_infos=None):
+    with open(filename, 'w', encoding='utf-8') as f:
+        for line in iter_tree_dot(root, simple=simple, dpi=dpi, reaction_infos=reaction_infos):
+            f.write(line)
+    return filename
+
+
+render_executor = None  # one thread: renders queued one after the other, Graphviz at high dpi is memory hungry
+
+
+def render_image(filename, format='png', view_image=False):
+    # Graphviz on the DOT source file filename, as Digraph.render does: the image is filename.format
+    output = render('dot', format, filename)
+    if view_image:
+        view(output)
+    return output
+
+
+def render_tree(root, filename, format='png', simple=False, dpi=None, view_image=False, reaction_infos=None,
+                background=False):
+    '''
+    Write the DOT source of the tree to filename, streamed, and render it to filename.format (as Digraph.render does)
+    format: Graphviz output format ('png', 'svg', ...), 'dot' to only write the source to filename.dot
+    background: return once the source is written, the image is rendered in a background thread
+                (Python waits for it at exit)
+    return: path of the written file, a Future of the path in the background
+    '''
+    global render_executor
+    if format == 'dot':
+        return write_tree_dot(root, filename + '.dot', simple=simple, dpi=dpi, reaction_infos=reaction_infos)
+    # the tree is only walked here, in the calling thread
+    write_tree_dot(root, filename, simple=simple, dpi=dpi, reaction_infos=reaction_infos)
+    if not background:
+        return render_image(filename, format=format, view_image=view_image)
+    if render_executor is None:
+        render_executor = ThreadPoolExecutor(max_workers=1)
+    return render_executor.submit(render_image, filename, format, view_image)
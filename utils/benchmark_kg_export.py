@@ -0,0 +1,93 @@
+'''
+Time, file size and peak memory of the KnowledgeGraph exports (former indent=4 JSON built in memory,
+streamed json / compact / ndjson, gzip) and of KnowledgeGraph.load against rebuilding the graph from the reaction text,
+with round-trip checks of the loaded graphs.
+
+usage (from the repository root):
+    python -m utils.benchmark_kg_export --sizes 10000 50000
+'''
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from RetroSynAgent.knowledgegraph import KnowledgeGraph
+from RetroSynAgent.treebuilder import Tree
+from utils.benchmark_tree_expansion import make_reactions_txt
+
+
+def legacy_export(kg, file_path):
+    # former KnowledgeGraph.export_to_json
+    node_mapping = {node: idx + 1 for idx, node in enumerate(kg.G.nodes)}
+    nodes = [{"id": node_mapping[node], "name": node} for node in kg.G.nodes]
+    links = [{"source": node_mapping[edge[0]], "target": node_mapping[edge[1]]} for edge in kg.G.edges]
+    with open(file_path, "w") as f:
+        json.dump({"nodes": nodes, "links": links}, f, indent=4)
+
+
+def graph_rows(kg):
+    # names in node order, edges with labels in edge order, substances
+    return (list(kg.G.nodes), list(kg.G.edges(data='label')),
+            sorted(node for node in kg.chemical_substances if node in kg.G))
+
+
+def check_round_trip(kg, loaded):
+    assert graph_rows(loaded) == graph_rows(kg)
+    assert loaded.properties == kg.properties
+    assert loaded.reactions == {idx: reaction for idx, reaction in kg.reactions.items() if reaction['products']}
+
+
+def measure(func, *args, **kwargs):
+    # timed without tracemalloc, which slows Python code down several times, then run again for the peak memory
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'reactions':>10} {'edges':>8} {'file':>16} {'MB':>7} {'export s':>9} {'peak MB':>8} {'load s':>7}")
+    with tempfile.TemporaryDirectory() as folder:
+        for num_reactions in args.sizes:
+            reactions_txt, _ = make_reactions_txt(num_reactions, seed=args.seed)
+            properties = {'substance 1': {'Tg': '105 °C', 'Td': '380 °C'}, 'substance 2': {'Tg': '105 °C'}}
+
+            def rebuild():
+                # what the scripts do without an export: parse the reactions, build the graph
+                return KnowledgeGraph(Tree('substance 0', reactions_txt=reactions_txt).reactions, properties=properties)
+
+            kg, elapsed, _ = measure(rebuild)
+            rows = [('rebuild', None, None, None, elapsed)]
+
+            legacy_path = os.path.join(folder, 'legacy.json')
+            _, elapsed, peak = measure(legacy_export, kg, legacy_path)
+            rows.append(('legacy json', legacy_path, elapsed, peak, None))
+            for name, format in (('kg.json', 'json'), ('kg.compact.json', 'compact'), ('kg.ndjson', 'ndjson'),
+                                 ('kg.ndjson.gz', 'ndjson')):
+                path = os.path.join(folder, name)
+                _, elapsed, peak = measure(kg.export_to_json, path, format=format)
+                loaded, load, _ = measure(KnowledgeGraph.load, path)
+                if format == 'json':
+                    # same file as the former export, no labels / reactions / properties to compare
+                    assert open(path, 'rb').read() == open(legacy_path, 'rb').read()
+                    assert list(loaded.G.nodes) == graph_rows(kg)[0]
+                else:
+                    check_round_trip(kg, loaded)
+                rows.append((name, path, elapsed, peak, load))
+
+            for name, path, elapsed, peak, load in rows:
+                size = f"{os.path.getsize(path) / 2 ** 20:>7.2f}" if path else f"{'':>7}"
+                elapsed = f"{elapsed:>9.3f}" if elapsed is not None else f"{'':>9}"
+                peak = f"{peak / 2 ** 20:>8.1f}" if peak is not None else f"{'':>8}"
+                load = f"{load:>7.3f}" if load is not None else f"{'':>7}"
+                print(f"{num_reactions:>10} {kg.G.number_of_edges():>8} {name:>16} {size} {elapsed} {peak} {load}")
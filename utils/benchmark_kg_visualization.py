@@ -0,0 +1,56 @@
+'''
+Time and HTML size of KnowledgeGraph.visualize_kg_static (precomputed layout, physics off, style groups)
+against visualize_kg, on the whole graph and on the neighborhood of one substance.
+
+usage (from the repository root):
+    python -m utils.benchmark_kg_visualization --sizes 6000 60000
+'''
+import argparse
+import os
+import tempfile
+import time
+from RetroSynAgent.knowledgegraph import KnowledgeGraph
+from RetroSynAgent.treebuilder import Tree
+from utils.benchmark_tree_expansion import make_reactions_txt
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[6000, 60000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-legacy', action='store_true', help='visualize_kg takes minutes above 20k nodes')
+    args = parser.parse_args()
+
+    rows = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        # pyvis writes the html and its lib folder to the working directory
+        os.chdir(folder)
+        try:
+            for num_reactions in args.sizes:
+                reactions_txt, _ = make_reactions_txt(num_reactions, seed=args.seed)
+                kg = KnowledgeGraph(Tree('substance 0', reactions_txt=reactions_txt).reactions)
+                size = (num_reactions, kg.G.number_of_nodes(), kg.G.number_of_edges())
+                if not args.skip_legacy:
+                    _, elapsed = timed(kg.visualize_kg, 'legacy.html')
+                    rows.append(size + ('visualize_kg', kg.G.number_of_nodes(), elapsed,
+                                        os.path.getsize('legacy.html')))
+                net, elapsed = timed(kg.visualize_kg_static, 'static.html')
+                assert len(net.nodes) == kg.G.number_of_nodes() and len(net.edges) == kg.G.number_of_edges()
+                assert all('x' in node and 'y' in node for node in net.nodes)
+                rows.append(size + ('static', len(net.nodes), elapsed, os.path.getsize('static.html')))
+                net, elapsed = timed(kg.visualize_kg_static, 'focus.html', focus='substance 1', radius=3)
+                rows.append(size + ('focus r=3', len(net.nodes), elapsed, os.path.getsize('focus.html')))
+        finally:
+            os.chdir(cwd)
+
+    print(f"{'reactions':>10} {'nodes':>8} {'edges':>8} {'mode':>13} {'drawn':>8} {'s':>8} {'html MB':>8}")
+    for num_reactions, num_nodes, num_edges, mode, drawn, elapsed, html_size in rows:
+        print(f"{num_reactions:>10} {num_nodes:>8} {num_edges:>8} {mode:>13} {drawn:>8} {elapsed:>8.2f} "
+              f"{html_size / 2 ** 20:>8.2f}")
@@ -0,0 +1,76 @@
+'''
+Build time of the KnowledgeGraph (bulk add_edges_from) against the former one add_edge call per edge,
+time of the sparse exports (adjacency matrix, reaction incidence matrices, bipartite hypergraph),
+and consistency checks: same graph as the former build, matrices matching the edges of G.
+
+usage (from the repository root):
+    python -m utils.benchmark_knowledge_graph --sizes 10000 50000
+'''
+import argparse
+import time
+import networkx as nx
+from RetroSynAgent.knowledgegraph import KnowledgeGraph
+from RetroSynAgent.symboltable import ReactionTable
+from RetroSynAgent.treebuilder import Tree
+from utils.benchmark_tree_expansion import make_reactions_txt
+
+
+def legacy_build(reactions, properties):
+    # former KnowledgeGraph._build_kg: one add_node / add_edge call per edge
+    G = nx.DiGraph()
+    for substance, prop_dict in properties.items():
+        for prop_name, prop_value in prop_dict.items():
+            G.add_node(substance)
+            G.add_node(prop_value)
+            G.add_edge(substance, prop_value, label=prop_name)
+    for idx, reaction in reactions.items():
+        for reactant in reaction["reactants"]:
+            for product in reaction["products"]:
+                G.add_node(reactant)
+                G.add_node(product)
+                G.add_edge(reactant, product, label=f"reaction idx: {idx}")
+    return G
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # scipy imported before timing the exports
+    from scipy import sparse
+
+    print(f"{'reactions':>10} {'nodes':>8} {'edges':>9} {'legacy s':>9} {'bulk s':>8} {'csr s':>7} "
+          f"{'incid s':>8} {'hyper s':>8} {'hyper edges':>12}")
+    for num_reactions in args.sizes:
+        reactions_txt, _ = make_reactions_txt(num_reactions, seed=args.seed)
+        reactions = Tree('substance 0', reactions_txt=reactions_txt).reactions
+        properties = {'substance 1': {'Tg': '105 °C', 'Td': '380 °C'}, 'substance 2': {'Tg': '105 °C'}}
+
+        # table built beforehand, as tree.reaction_table is, and shared without growing
+        G, legacy = timed(legacy_build, reactions, properties)
+        table = ReactionTable(reactions)
+        num_substances = len(table.substances)
+        kg, bulk = timed(KnowledgeGraph, reactions, properties=properties, table=table)
+        assert list(kg.G.nodes) == list(G.nodes)
+        assert list(kg.G.edges(data='label')) == list(G.edges(data='label'))
+        assert len(table.substances) == num_substances
+
+        adjacency, csr = timed(kg.adjacency_matrix)
+        assert adjacency.nnz == kg.G.number_of_edges()
+        assert {(kg.name(u), kg.name(v)) for u, v in zip(*adjacency.nonzero())} == set(kg.G.edges)
+        (reactants, products), incid = timed(kg.incidence_matrices)
+        reaction_edges = {(u, v) for u, v, label in kg.G.edges(data='label') if label.startswith('reaction idx: ')}
+        assert {(kg.name(u), kg.name(v)) for u, v in zip(*(reactants @ products.T).nonzero())} == reaction_edges
+        hypergraph, hyper = timed(kg.hypergraph)
+        assert hypergraph.number_of_edges() <= reactants.nnz + products.nnz
+
+        print(f"{num_reactions:>10} {kg.G.number_of_nodes():>8} {kg.G.number_of_edges():>9} {legacy:>9.3f} "
+              f"{bulk:>8.3f} {csr:>7.3f} {incid:>8.3f} {hyper:>8.3f} {hypergraph.number_of_edges():>12}")
@@ -0,0 +1,42 @@
+'''
+Time and memory of building the full Node tree (every node materialized) on synthetic reaction sets.
+
+usage (from the repository root):
+    python -m utils.benchmark_node_memory --sizes 1000 5000
+'''
+import argparse
+import sys
+import time
+import tracemalloc
+from utils.benchmark_tree_expansion import make_reactions_txt, count_nodes
+from RetroSynAgent.treebuilder import Tree
+
+
+def measure(num_reactions, engine, seed, common_rate):
+    reactions_txt, common = make_reactions_txt(num_reactions, seed=seed, common_rate=common_rate)
+    tree = Tree('substance 0', reactions_txt=reactions_txt)
+    tree.chemical_cache = dict(common)
+    tracemalloc.start()
+    start = time.perf_counter()
+    tree.construct_tree(engine=engine)
+    nodes = count_nodes(tree.root)  # also materializes the lazily built children of the andor engine
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return nodes, elapsed, current, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--common-rate', type=float, default=0.6)
+    args = parser.parse_args()
+    sys.setrecursionlimit(100000)
+
+    print(f"{'reactions':>10} {'engine':>10} {'nodes':>10} {'seconds':>10} {'tree MB':>10} {'peak MB':>10} {'B/node':>8}")
+    for num_reactions in args.sizes:
+        for engine in ('recursive', 'andor'):
+            nodes, elapsed, current, peak = measure(num_reactions, engine, args.seed, args.common_rate)
+            print(f"{num_reactions:>10} {engine:>10} {nodes:>10} {elapsed:>10.3f} "
+                  f"{current / 2 ** 20:>10.2f} {peak / 2 ** 20:>10.2f} {current / nodes:>8.0f}")
@@ -0,0 +1,85 @@
+'''
+Superset elimination on random candidate pathways: bitset PathwaySet vs. the former set-based scans.
+
+usage (from the repository root):
+    python -m utils.benchmark_pathway_set --sizes 1000 10000 100000 1000000
+'''
+import argparse
+import random
+import time
+from RetroSynAgent.pathwayset import PathwaySet
+
+
+def make_candidates(num_paths, seed=0):
+    '''
+    Random pathways over up to 1000 reactions (a large tree): 2-10 reactions each, with extended copies of earlier
+    pathways (supersets) and exact duplicates mixed in, as produced by the Cartesian product of child pathways
+    '''
+    rng = random.Random(seed)
+    reactions = [str(i) for i in range(1, min(max(num_paths // 20, 50), 1000) + 1)]
+    paths = []
+    for _ in range(num_paths):
+        roll = rng.random()
+        if paths and roll < 0.3:
+            paths.append(rng.choice(paths) + rng.sample(reactions, rng.randint(1, 3)))
+        elif paths and roll < 0.4:
+            paths.append(list(rng.choice(paths)))
+        else:
+            paths.append(rng.sample(reactions, rng.randint(2, 10)))
+    return [list(dict.fromkeys(path)) for path in paths]
+
+
+def pairwise_scan(data):
+    # Former Tree.remove_supersets (identical sets removed each other)
+    data_sets = [set(sublist) for sublist in data]
+    result = []
+    for i, current_set in enumerate(data_sets):
+        if not any(i != j and current_set.issuperset(other_set) for j, other_set in enumerate(data_sets)):
+            result.append(data[i])
+    return result
+
+
+def sorted_scan(data):
+    # Cardinality-sorted frozenset scan (first version of pathfinder.minimal_pathways)
+    sets = [frozenset(path) for path in data]
+    kept, kept_idx = [], []
+    for i in sorted(range(len(data)), key=lambda i: len(sets[i])):
+        if not any(other <= sets[i] for other in kept):
+            kept.append(sets[i])
+            kept_idx.append(i)
+    return [data[i] for i in sorted(kept_idx)]
+
+
+def bitset_scan(data):
+    return list(PathwaySet(data).minimize())
+
+
+def timed(func, data):
+    start = time.perf_counter()
+    result = func(data)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-pairwise', type=int, default=10000, help='largest input for the O(n^2) pairwise scan')
+    parser.add_argument('--max-sorted', type=int, default=10000, help='largest input for the frozenset scan')
+    args = parser.parse_args()
+
+    print(f"{'candidates':>11} {'minimal':>9} {'pairwise s':>11} {'sorted s':>10} {'bitset s':>10}")
+    for num_paths in args.sizes:
+        data = make_candidates(num_paths, seed=args.seed)
+        result, bitset_time = timed(bitset_scan, data)
+        expected = set(map(frozenset, result))
+        columns = []
+        for func, max_size in ((pairwise_scan, args.max_pairwise), (sorted_scan, args.max_sorted)):
+            if num_paths > max_size:
+                columns.append('-')
+                continue
+            other, elapsed = timed(func, data)
+            # The pairwise scan drops identical pathways entirely, compare the distinct minimal sets only
+            assert set(map(frozenset, other)) <= expected
+            columns.append(f'{elapsed:.3f}')
+        print(f"{num_paths:>11} {len(result):>9} {columns[0]:>11} {columns[1]:>10} {bitset_time:>10.3f}")
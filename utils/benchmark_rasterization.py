@@ -0,0 +1,122 @@
+'''
+Wall time and peak RSS of page rasterization (PDFProcessor.pdf_to_base64_img_list) on generated PDFs.
+Every configuration runs in a fresh interpreter, peak RSS is the maximum of the process and its render workers.
+
+usage (from the repository root):
+    python -m utils.benchmark_rasterization --pdfs 5 --pages 20 --workers 4
+'''
+import argparse
+import base64
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+import fitz  # PyMuPDF
+from PIL import Image
+
+configs = {
+    'legacy': None,  # PIL -> PNG at 3x, whole document in memory
+    'png': dict(),
+    'png-stream': dict(stream=True),
+    'jpeg-stream': dict(stream=True, image_format='jpeg', quality=80),
+    'webp-stream': dict(stream=True, image_format='webp', quality=80),
+    'jpeg-downscale': dict(stream=True, image_format='jpeg', quality=80, text_only_pages='downscale'),
+    'jpeg-skip': dict(stream=True, image_format='jpeg', quality=80, text_only_pages='skip'),
+}
+
+
+def make_pdfs(folder, num_pdfs, num_pages, figure_rate=0.3, seed=0):
+    '''
+    PDFs of text pages, a `figure_rate` share of the pages also holds an embedded image and vector drawings
+    '''
+    rng = random.Random(seed)
+    words = 'polyimide dianhydride diamine synthesis imidization yield reflux solvent catalyst monomer'.split()
+    paths = []
+    for i in range(num_pdfs):
+        doc = fitz.open()
+        for _ in range(num_pages):
+            page = doc.new_page()
+            text = ' '.join(rng.choice(words) for _ in range(400))
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=9)
+            if rng.random() < figure_rate:
+                img = Image.effect_noise((300, 200), 60).convert('RGB')
+                buffered = BytesIO()
+                img.save(buffered, format='PNG')
+                page.insert_image(fitz.Rect(100, 450, 400, 650), stream=buffered.getvalue())
+                for _ in range(20):
+                    page.draw_line((rng.uniform(100, 500), rng.uniform(660, 780)),
+                                   (rng.uniform(100, 500), rng.uniform(660, 780)))
+        path = os.path.join(folder, f'paper_{i}.pdf')
+        doc.save(path)
+        doc.close()
+        paths.append(path)
+    return paths
+
+
+def legacy_base64_img_list(pdf_path, zoom_x=3.0, zoom_y=3.0):
+    # Former PDFProcessor.pdf_to_base64_img_list
+    doc = fitz.open(pdf_path)
+    base64_images = []
+    for page_num in range(len(doc)):
+        page = doc.load_page(page_num)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom_x, zoom_y))
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        buffered = BytesIO()
+        img.save(buffered, format="PNG")
+        base64_images.append(base64.b64encode(buffered.getvalue()).decode('utf-8'))
+    doc.close()
+    return base64_images
+
+
+def run_config(name, pdf_paths, workers):
+    from RetroSynAgent.pdfprocessor import PDFProcessor
+    options = configs[name]
+    processor = PDFProcessor()
+    start = time.perf_counter()
+    num_images, num_bytes = 0, 0
+    for pdf_path in pdf_paths:
+        if options is None:
+            images = legacy_base64_img_list(pdf_path)
+        else:
+            options = dict(options)
+            stream = options.pop('stream', False)
+            if stream:
+                images = (img for page_num, img in processor.iter_base64_images(pdf_path, workers=workers, **options))
+            else:
+                images = processor.pdf_to_base64_img_list(pdf_path, workers=workers, **options)
+        for img_base64 in images:
+            num_images += 1
+            num_bytes += len(img_base64)
+    elapsed = time.perf_counter() - start
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(f'{name} {elapsed} {peak_kb} {num_images} {num_bytes}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdfs', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--configs', nargs='+', default=list(configs))
+    parser.add_argument('--run', nargs='+', help=argparse.SUPPRESS)  # internal: name, pdf paths
+    args = parser.parse_args()
+
+    if args.run:
+        run_config(args.run[0], args.run[1:], args.workers)
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as folder:
+        pdf_paths = make_pdfs(folder, args.pdfs, args.pages)
+        print(f"{args.pdfs} PDFs x {args.pages} pages, {args.workers} workers")
+        print(f"{'config':>15} {'seconds':>9} {'peak RSS MB':>12} {'images':>7} {'base64 MB':>10}")
+        for name in args.configs:
+            output = subprocess.run([sys.executable, '-m', 'utils.benchmark_rasterization', '--workers',
+                                     str(args.workers), '--run', name] + pdf_paths,
+                                    capture_output=True, text=True, check=True).stdout.splitlines()[-1].split()
+            elapsed, peak_kb, num_images, num_bytes = float(output[1]), int(output[2]), int(output[3]), int(output[4])
+            print(f"{name:>15} {elapsed:>9.2f} {peak_kb / 1024:>12.1f} {num_images:>7} {num_bytes / 2 ** 20:>10.1f}")
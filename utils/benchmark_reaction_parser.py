@@ -0,0 +1,174 @@
+'''
+Time and peak memory of the streaming reaction parser (reactionstream) against the former line loops of
+Tree.parse_results / Tree.parse_reactions_txt, with an equality check of the parsed reactions.
+
+usage (from the repository root):
+    python -m utils.benchmark_reaction_parser --num-reactions 100000 --per-pdf 10
+'''
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from RetroSynAgent.reactionstream import iter_reactions, iter_results, iter_reaction_file, reaction_to_dict
+from RetroSynAgent.treebuilder import Tree
+
+
+def make_results(num_reactions, per_pdf=10, malformed_rate=0.0, seed=0):
+    '''
+    return: result_dict {pdf_name: (reactions_txt, properties_txt)} in the LLM answer format, number of malformed records
+    '''
+    rng = random.Random(seed)
+    result_dict = {}
+    num_malformed = 0
+    for pdf in range(0, num_reactions, per_pdf):
+        entries = []
+        for i in range(pdf, min(pdf + per_pdf, num_reactions)):
+            reactants = ', '.join(f'Substance {rng.randrange(num_reactions)}' for _ in range(rng.randint(1, 3)))
+            lines = [f'Reaction {i - pdf + 1:03d}:', f'Reactants: {reactants}', f'Products: Substance {i}',
+                     f'Conditions: {rng.randint(20, 200)} °C, catalyst {rng.randrange(50)}']
+            if rng.random() < malformed_rate:
+                del lines[rng.choice((1, 2))]
+                num_malformed += 1
+            entries.append('\n'.join(lines))
+        result_dict[f'paper_{pdf // per_pdf}.pdf'] = ('\n\n'.join(entries), '')
+    return result_dict, num_malformed
+
+
+def tree_reactions_txt(reactions):
+    # format of Tree.get_reactions_in_tree
+    return ''.join(f"Reaction idx: {idx}\nReactants: {', '.join(entry['reactants'])}\n"
+                   f"Products: {', '.join(entry['products'])}\nConditions: {entry['conditions']}\n"
+                   f"Source: {entry['source']}\n\n" for idx, entry in reactions.items())
+
+
+def legacy_parse_reactions(reactions_txt, idx, pdf_name):
+    # former Tree.parse_reactions
+    reactants = []
+    products = []
+    reactions_dict = {}
+    for line in reactions_txt.splitlines():
+        line = line.strip()
+        if line.startswith("Reactants:"):
+            reactants = [reactant.lower() for reactant in line.split("Reactants:")[1].strip().split(', ')]
+        elif line.startswith("Products:"):
+            products = [product.lower() for product in line.split("Products:")[1].strip().split(', ')]
+        elif line.startswith("Conditions:"):
+            conditions = line.split("Conditions:")[1].strip()
+            reactions_dict[str(idx)] = {'reactants': tuple(reactants), 'products': tuple(products),
+                                        'conditions': conditions, 'source': pdf_name}
+            idx += 1
+    return reactions_dict, idx
+
+
+def legacy_parse_results(result_dict, idx=1):
+    # former Tree.parse_results, joining all the reaction texts
+    reactions_txt_all = ''
+    reactions = {}
+    for pdf_name, (reaction, property) in result_dict.items():
+        reactions_txt_all += (reaction + '\n\n')
+        additional_reactions, idx = legacy_parse_reactions(reaction, idx, pdf_name)
+        reactions.update(additional_reactions)
+    return reactions, reactions_txt_all
+
+
+def legacy_parse_reactions_txt(reactions_txt):
+    # former Tree.parse_reactions_txt
+    reactants = []
+    products = []
+    reactions_dict = {}
+    for line in reactions_txt.splitlines():
+        line = line.strip()
+        if line.startswith('Reaction idx:'):
+            idx = line.split("Reaction idx:")[1].strip()
+        if line.startswith("Reactants:"):
+            reactants = [reactant.lower() for reactant in line.split("Reactants:")[1].strip().split(', ')]
+        elif line.startswith("Products:"):
+            products = [product.lower() for product in line.split("Products:")[1].strip().split(', ')]
+        elif line.startswith("Conditions:"):
+            conditions = line.split("Conditions:")[1].strip()
+        elif line.startswith("Source:"):
+            source = line.split("Source:")[1].strip()
+            reactions_dict[str(idx)] = {'reactants': tuple(reactants), 'products': tuple(products),
+                                        'conditions': conditions, 'source': source}
+    return reactions_dict
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-reactions', type=int, default=100000)
+    parser.add_argument('--per-pdf', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    def parse_results(result_dict):
+        # Tree.parse_results
+        return {reaction.idx: reaction_to_dict(reaction) for reaction in iter_results(result_dict)}
+
+    def parse_reactions_txt(reactions_txt):
+        # Tree.parse_reactions_txt
+        return {reaction.idx: reaction_to_dict(reaction) for reaction in iter_reactions(reactions_txt, numbered=True)}
+
+    result_dict, _ = make_results(args.num_reactions, per_pdf=args.per_pdf, seed=args.seed)
+    rows = []
+    (legacy, legacy_txt), elapsed, peak = measure(legacy_parse_results, result_dict)
+    rows.append(('results', 'legacy', elapsed, peak))
+    streamed, elapsed, peak = measure(parse_results, result_dict)
+    rows.append(('results', 'stream', elapsed, peak))
+    assert streamed == legacy
+
+    reactions_txt = tree_reactions_txt(legacy)
+    legacy, elapsed, peak = measure(legacy_parse_reactions_txt, reactions_txt)
+    rows.append(('tree txt', 'legacy', elapsed, peak))
+    streamed, elapsed, peak = measure(parse_reactions_txt, reactions_txt)
+    rows.append(('tree txt', 'stream', elapsed, peak))
+    assert streamed == legacy
+
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'reactions.txt')
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(reactions_txt)
+        del reactions_txt
+
+        def read_legacy():
+            with open(filename, 'r', encoding='utf-8') as f:
+                return legacy_parse_reactions_txt(f.read())
+
+        def read_stream():
+            return {reaction.idx: reaction_to_dict(reaction) for reaction in iter_reaction_file(filename)}
+
+        legacy, elapsed, peak = measure(read_legacy)
+        rows.append(('file', 'legacy', elapsed, peak))
+        streamed, elapsed, peak = measure(read_stream)
+        rows.append(('file', 'stream', elapsed, peak))
+        assert streamed == legacy
+
+    # malformed records are skipped and reported, the other records keep the idx of the former parser
+    result_dict, num_malformed = make_results(2000, per_pdf=args.per_pdf, malformed_rate=0.05, seed=args.seed)
+    errors = []
+    reactions = list(iter_reactions((line for values in result_dict.values() for line in values[0].splitlines()),
+                                    errors=errors))
+    assert len(errors) == num_malformed and len(reactions) == 2000 - num_malformed
+    legacy, _ = legacy_parse_results(result_dict)
+    assert len(legacy) == 2000
+    assert all(reaction_to_dict(reaction, with_source=False).items() <= legacy[reaction.idx].items()
+               for reaction in reactions)
+    tree = Tree('substance 0', result_dict=result_dict)
+    assert tree.reactions == {idx: legacy[idx] for idx in tree.reactions} and tree.next_idx == 2001
+
+    print(f"{args.num_reactions} reactions, same reactions as the former parsers, "
+          f"{num_malformed} of 2000 malformed records reported")
+    print(f"{'input':>10} {'parser':>8} {'s':>8} {'peak MB':>9}")
+    for name, parser_name, elapsed, peak in rows:
+        print(f"{name:>10} {parser_name:>8} {elapsed:>8.3f} {peak / 2 ** 20:>9.1f}")
@@ -0,0 +1,110 @@
+'''
+Time of the reaction / pathway filtering of 3_filter_reactions.py and 4_recommend_pathways.py on the indexed
+stores (reactionstore) against the former substring scans, with checks: same pathway text as the former
+concat_pathway_and_reactions, filtered reactions / pathways equal to an exact-idx reference, and the number of
+entries the former scans kept because an idx is a prefix of another ("Reaction idx: 1" found in "Reaction idx: 10").
+
+usage (from the repository root):
+    python -m utils.benchmark_reaction_store --num-reactions 5000 --num-pathways 20000
+'''
+import argparse
+import random
+import time
+from RetroSynAgent.reactionstore import ReactionStore, PathwayStore, reaction_entry
+
+
+def legacy_filter_reactions(id_list, reactions_txt):
+    # former filter_reactions, after the idx are read from the LLM response
+    filtered_entries = []
+    for entry in reactions_txt.strip().split("\n\n"):
+        if any(f"Reaction idx: {rid}" in entry for rid in id_list):
+            filtered_entries.append(entry)
+    return "\n\n".join(filtered_entries)
+
+
+def legacy_concat_pathway_and_reactions(reactions_txt, all_path_list):
+    # former concat_pathway_and_reactions
+    reaction_dict = {}
+    for reaction in reactions_txt.strip().split('\n\n'):
+        idx = reaction.split('\n')[0].split(': ')[-1]
+        reaction_dict[idx] = reaction
+    output = []
+    for path in all_path_list:
+        output.append(f"Pathway: {', '.join(path)}\n")
+        for idx in path:
+            if idx in reaction_dict:
+                output.append(reaction_dict[idx] + "\n")
+        output.append('\n')
+    return ''.join(output)
+
+
+def legacy_filter_pathways(id_list, pathways_txt):
+    # former filter_pathways, after the pathways are read from the LLM response
+    filtered_entries = []
+    for entry in pathways_txt.strip().split("\n\n"):
+        if any(f"Pathway: {id}" in entry for id in id_list):
+            filtered_entries.append(entry)
+    return "\n\n".join(filtered_entries)
+
+
+def make_data(num_reactions, num_pathways, seed=0):
+    rng = random.Random(seed)
+    reactions = {str(idx): {'reactants': (f'substance {rng.randrange(num_reactions)}',),
+                            'products': (f'substance {idx}',), 'conditions': 'synthetic', 'source': 'synthetic'}
+                 for idx in range(1, num_reactions + 1)}
+    pathways = {tuple(sorted(rng.sample(list(reactions), rng.randint(1, 6)), key=int)) for _ in range(num_pathways)}
+    return reactions, [list(path) for path in sorted(pathways)]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-reactions', type=int, default=5000)
+    parser.add_argument('--num-pathways', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    reactions, all_path = make_data(args.num_reactions, args.num_pathways, seed=args.seed)
+    reactions_txt = ''.join(reaction_entry(idx, reaction) + '\n\n' for idx, reaction in reactions.items())
+    kept_idx = rng.sample(list(reactions), len(reactions) // 2)
+    kept_pathways = [', '.join(path) for path in rng.sample(all_path, len(all_path) // 20)]
+    rows = []
+
+    legacy, elapsed = timed(legacy_filter_reactions, kept_idx, reactions_txt)
+    rows.append(('filter reactions', 'legacy', elapsed))
+    store = ReactionStore.from_text(reactions_txt)
+    filtered, elapsed = timed(lambda: store.select(kept_idx).text())
+    rows.append(('filter reactions', 'store', elapsed))
+    kept = set(kept_idx)
+    assert filtered == '\n\n'.join(reaction_entry(idx, reaction) for idx, reaction in reactions.items() if idx in kept)
+    extra_reactions = legacy.count('Reaction idx: ') - filtered.count('Reaction idx: ')
+
+    legacy, elapsed = timed(legacy_concat_pathway_and_reactions, reactions_txt, all_path)
+    rows.append(('join pathways', 'legacy', elapsed))
+    pathways, elapsed = timed(lambda: PathwayStore(all_path, ReactionStore.from_text(reactions_txt)).text())
+    rows.append(('join pathways', 'store', elapsed))
+    assert pathways == legacy
+    assert PathwayStore.from_text(pathways).text() == pathways
+
+    legacy, elapsed = timed(legacy_filter_pathways, kept_pathways, pathways)
+    rows.append(('filter pathways', 'legacy', elapsed))
+    pathway_store = PathwayStore.from_text(pathways)
+    filtered, elapsed = timed(lambda: pathway_store.select(kept_pathways).text(separator='\n\n'))
+    rows.append(('filter pathways', 'store', elapsed))
+    kept = set(kept_pathways)
+    assert filtered == '\n\n'.join(block for block in pathways.strip().split('\n\n')
+                                   if block.split('\n', 1)[0][len('Pathway: '):] in kept)
+    extra_pathways = legacy.count('Pathway: ') - filtered.count('Pathway: ')
+
+    print(f"{args.num_reactions} reactions, {len(all_path)} pathways, kept: {len(kept_idx)} reactions, "
+          f"{len(kept_pathways)} pathways")
+    print(f"idx prefix matches of the former scans: {extra_reactions} reactions, {extra_pathways} pathways")
+    print(f"{'step':>16} {'method':>8} {'s':>8}")
+    for step, method, elapsed in rows:
+        print(f"{step:>16} {method:>8} {elapsed:>8.3f}")
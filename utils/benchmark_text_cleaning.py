@@ -0,0 +1,120 @@
+'''
+Throughput (pages/sec) of PDFProcessor.pdf_to_long_string against the former implementation on generated PDFs,
+with a check that both produce the same text, and a fuzz check of rfind_ignore_case against text.upper().rfind.
+
+usage (from the repository root):
+    python -m utils.benchmark_text_cleaning --pdfs 20 --pages 30
+'''
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+import fitz  # PyMuPDF
+from RetroSynAgent.pdfprocessor import PDFProcessor, rfind_ignore_case
+
+
+def make_pdfs(folder, num_pdfs, num_pages, seed=0):
+    '''
+    Papers with punctuation, formulas, non-ASCII symbols and a references section on the last page
+    '''
+    rng = random.Random(seed)
+    words = ('polyimide', 'dianhydride', '4,4-oxydianiline', 'N,N-dimethylacetamide', '(PMDA)', 'yield:', '95%',
+             '180 °C', 'α-olefin', 'reflux;', 'Fig. 2', '[12]', 'H2O', 'e.g.', 'References', 'tetrahydrofuran')
+    paths = []
+    for i in range(num_pdfs):
+        doc = fitz.open()
+        for page_num in range(num_pages):
+            page = doc.new_page()
+            lines = [' '.join(rng.choice(words) for _ in range(rng.randint(6, 12))) for _ in range(70)]
+            if page_num == num_pages - 1:
+                lines.insert(20, 'REFERENCES')
+            page.insert_text((40, 40), '\n'.join(lines), fontsize=7)
+        path = os.path.join(folder, f'paper_{i}.pdf')
+        doc.save(path)
+        doc.close()
+        paths.append(path)
+    return paths
+
+
+def legacy_pdf_to_long_string(pdf_path, remove_references=True, keyword="REFERENCES"):
+    # Former PDFProcessor.pdf_to_long_string / remove_references_section
+    document = fitz.open(pdf_path)
+    raw_text = ''
+    for page_num in range(len(document)):
+        page = document.load_page(page_num)
+        raw_text += page.get_text()
+    document.close()
+    text = raw_text.replace("\n", " ").replace("\r", " ")
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\w\s,.]', '', text)
+    cleaned_text = text.strip()
+    if remove_references:
+        keyword_pos = cleaned_text.upper().rfind(keyword)
+        if keyword_pos != -1:
+            cleaned_text = cleaned_text[:keyword_pos].strip()
+    return cleaned_text
+
+
+def legacy_clean(raw_text):
+    text = raw_text.replace("\n", " ").replace("\r", " ")
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\w\s,.]', '', text)
+    cleaned_text = text.strip()
+    keyword_pos = cleaned_text.upper().rfind("REFERENCES")
+    return cleaned_text[:keyword_pos].strip() if keyword_pos != -1 else cleaned_text
+
+
+def check_rfind(num_texts=2000, seed=0):
+    # characters whose upper case differs in length (ß -> SS, ﬁ -> FI) or maps onto ASCII (ſ -> S, ı -> I)
+    rng = random.Random(seed)
+    alphabet = 'referncsREFERNCS ßﬁſıİα°'
+    for _ in range(num_texts):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 300)))
+        if rng.random() < 0.5:
+            pos = rng.randint(0, len(text))
+            text = text[:pos] + rng.choice(('references', 'REFERENCES', 'Reference', 'ﬁ')) + text[pos:]
+        for keyword in ('REFERENCES', 'S', 'SS', 'FI', 'CES'):
+            expected = text.upper().rfind(keyword)
+            for window in (1, 7, 64, 65536):
+                assert rfind_ignore_case(text, keyword, window=window) == expected, (text, keyword, window)
+
+
+def timed(func, items, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [func(item) for item in items]
+    return results, (time.perf_counter() - start) / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdfs', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    check_rfind()
+    processor = PDFProcessor()
+    with tempfile.TemporaryDirectory() as folder:
+        pdf_paths = make_pdfs(folder, args.pdfs, args.pages)
+        num_pages = args.pdfs * args.pages
+        raw_texts = []
+        for pdf_path in pdf_paths:
+            with fitz.open(pdf_path) as document:
+                raw_texts.append(''.join(page.get_text() for page in document))
+
+        print(f"{args.pdfs} PDFs x {args.pages} pages, {sum(map(len, raw_texts)) / 2 ** 20:.1f} MB of text")
+        print(f"{'stage':>22} {'legacy pages/s':>15} {'new pages/s':>12} {'speedup':>8}")
+        rows = [
+            ('cleaning only', legacy_clean, lambda raw: processor.remove_references_section(processor.clean_text(raw)),
+             raw_texts),
+            ('pdf_to_long_string', legacy_pdf_to_long_string, processor.pdf_to_long_string, pdf_paths),
+        ]
+        for name, legacy_func, new_func, items in rows:
+            expected, legacy_time = timed(legacy_func, items, args.repeat)
+            result, new_time = timed(new_func, items, args.repeat)
+            assert result == expected, f'{name}: output differs from the former implementation'
+            print(f"{name:>22} {num_pages / legacy_time:>15.0f} {num_pages / new_time:>12.0f} "
+                  f"{legacy_time / new_time:>7.2f}x")
@@ -0,0 +1,75 @@
+'''
+Fuzzy title deduplication: TitleIndex against the former difflib scan (check_pdf_existence) on synthetic titles,
+with a check that both give the same answers.
+
+usage (from the repository root):
+    python -m utils.benchmark_title_index --sizes 1000 5000 10000 --queries 100
+'''
+import argparse
+import difflib
+import random
+import time
+from RetroSynAgent.titleindex import TitleIndex
+
+words = ('synthesis', 'polyimide', 'characterization', 'of', 'novel', 'soluble', 'aromatic', 'fluorinated',
+         'dianhydride', 'diamine', 'thermal', 'properties', 'membranes', 'films', 'high', 'performance', 'and',
+         'based', 'on', 'with', 'pendant', 'groups', 'transparent', 'colorless', 'low', 'dielectric', 'constant',
+         'gas', 'separation', 'copolyimides', 'containing', 'ether', 'linkages', 'preparation', 'study')
+
+
+def make_titles(num_titles, rng):
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(6, 14))).capitalize() for _ in range(num_titles)]
+
+
+def perturb(title, rng):
+    # Small typo / punctuation / file-name differences, as between a search result and a downloaded PDF name
+    chars = list(title)
+    for _ in range(rng.randint(1, 4)):
+        i = rng.randrange(len(chars))
+        op = rng.random()
+        if op < 0.4:
+            del chars[i]
+        elif op < 0.7:
+            chars.insert(i, rng.choice('abcdefghij -_,'))
+        else:
+            chars[i] = rng.choice('abcdefghij')
+    return ''.join(chars)
+
+
+def check_pdf_existence(target_pdf_name, pdf_name_list, similarity_threshold=0.9):
+    # Former PDFDownloader / PDFProcessor.check_pdf_existence
+    for pdf_name in pdf_name_list:
+        similarity = difflib.SequenceMatcher(None, target_pdf_name, pdf_name).ratio()
+        if similarity > similarity_threshold:
+            return True
+    return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 10000])
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'known':>8} {'queries':>8} {'found':>6} {'scan s':>9} {'build s':>8} {'index s':>8} {'speedup':>8}")
+    for num_known in args.sizes:
+        rng = random.Random(args.seed)
+        known = make_titles(num_known, rng)
+        # half near-duplicates of known titles, half new titles
+        queries = [perturb(rng.choice(known), rng) if i % 2 else make_titles(1, rng)[0] for i in range(args.queries)]
+
+        start = time.perf_counter()
+        expected = [check_pdf_existence(query, known) for query in queries]
+        scan_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = TitleIndex(known)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        result = [query in index for query in queries]
+        index_time = time.perf_counter() - start
+
+        assert result == expected, 'TitleIndex differs from the difflib scan'
+        print(f"{num_known:>8} {len(queries):>8} {sum(result):>6} {scan_time:>9.2f} {build_time:>8.2f} "
+              f"{index_time:>8.2f} {scan_time / (build_time + index_time):>7.0f}x")
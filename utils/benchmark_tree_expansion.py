@@ -0,0 +1,100 @@
+'''
+Compare the memoized AND/OR expansion engine with the original recursive Node.expand
+on synthetic reaction sets.
+
+usage (from the repository root):
+    python -m utils.benchmark_tree_expansion --sizes 1000 5000 10000 50000 --timeout 120
+'''
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+from RetroSynAgent.treebuilder import Tree
+
+
+def make_reactions_txt(num_reactions, seed=0, cycle_rate=0.05, common_rate=0.4, block_size=4):
+    '''
+    Synthetic corpus: substance i is made from substances with a larger index (a deep, mostly acyclic
+    reaction graph). A few reactions point back into the same block of substances, which creates small
+    cycles such as protection / deprotection pairs.
+    return: reactions_txt (same format as the LLM output parsed by Tree.parse_reactions_txt), {substance: is common}
+    '''
+    rng = random.Random(seed)
+    num_substances = max(num_reactions // 3, 10)
+    names = [f'substance {i}' for i in range(num_substances)]
+    common = {name: (i > 0 and rng.random() < common_rate) for i, name in enumerate(names)}
+    lines = []
+    for idx in range(1, num_reactions + 1):
+        product = 0 if idx <= 3 else rng.randrange(num_substances - 1)
+        reactants = set()
+        for _ in range(rng.choice((1, 2, 2, 3))):
+            if rng.random() < cycle_rate:
+                reactants.add(min(num_substances - 1, product - product % block_size + rng.randrange(block_size)))
+            else:
+                reactants.add(min(num_substances - 1, product + rng.randint(1, 12)))
+        lines.append(f"Reaction idx: {idx}\n"
+                     f"Reactants: {', '.join(names[r] for r in sorted(reactants))}\n"
+                     f"Products: {names[product]}\n"
+                     f"Conditions: synthetic\n"
+                     f"Source: synthetic\n")
+    return '\n'.join(lines), common
+
+
+def build_tree(reactions_txt, common, engine):
+    tree = Tree('substance 0', reactions_txt=reactions_txt)
+    tree.chemical_cache = dict(common)
+    start = time.perf_counter()
+    result = tree.construct_tree(engine=engine)
+    elapsed = time.perf_counter() - start
+    return tree, result, elapsed
+
+
+def count_nodes(root):
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+
+def run(num_reactions, engine, seed, common_rate, queue):
+    sys.setrecursionlimit(100000)  # both engines recurse once per tree level
+    reactions_txt, common = make_reactions_txt(num_reactions, seed=seed, common_rate=common_rate)
+    tree, result, elapsed = build_tree(reactions_txt, common, engine)
+    # recursive: Node objects created, andor: AND/OR graph nodes (the Node tree is materialized lazily)
+    expanded = count_nodes(tree.root) if engine == 'recursive' else len(tree.expander.graph)
+    queue.put((result, elapsed, expanded, len(tree.unexpandable_substances)))
+
+
+def run_with_timeout(num_reactions, engine, seed, common_rate, timeout):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run, args=(num_reactions, engine, seed, common_rate, queue))
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return None
+    return queue.get() if not queue.empty() else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 10000, 50000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--common-rate', type=float, default=0.6)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    print(f"{'reactions':>10} {'engine':>10} {'result':>7} {'seconds':>10} {'nodes':>10} {'unexpandable':>13}")
+    for num_reactions in args.sizes:
+        for engine in ('recursive', 'andor'):
+            stats = run_with_timeout(num_reactions, engine, args.seed, args.common_rate, args.timeout)
+            if stats is None:
+                print(f"{num_reactions:>10} {engine:>10} {'-':>7} {'timeout':>10} {'-':>10} {'-':>13}")
+                continue
+            result, elapsed, nodes, unexpandable = stats
+            print(f"{num_reactions:>10} {engine:>10} {str(result):>7} {elapsed:>10.3f} {nodes:>10} {unexpandable:>13}")
@@ -0,0 +1,118 @@
+'''
+File size, save and load time of the binary tree file (treefile) against the former pickled Tree,
+and round-trip check of the binary format (reactions and nodes of the loaded tree).
+Trees pickled by the original Node / Tree classes (a __dict__ per node) are checked to load as well.
+
+usage (from the repository root):
+    python -m utils.benchmark_tree_format --sizes 200 500 1000
+'''
+import argparse
+import copyreg
+import os
+import pickle
+import sys
+import tempfile
+import time
+from RetroSynAgent.treebuilder import Node, Tree, TreeLoader
+from utils.benchmark_tree_expansion import make_reactions_txt, build_tree
+
+
+def node_rows(root):
+    # (depth, substance, reaction idx, is_leaf, number of children) in breadth-first order
+    rows = []
+    queue = [root]
+    for node in queue:
+        rows.append((node.depth, node.substance, node.reaction_index, node.is_leaf, len(node.children)))
+        queue.extend(node.children)
+    return rows
+
+
+def check_round_trip(tree, loaded):
+    assert loaded.target_substance == tree.target_substance
+    assert loaded.reactions == tree.reactions
+    assert loaded.product_dict == tree.product_dict
+    assert loaded.unexpandable_substances == tree.unexpandable_substances
+    assert node_rows(loaded.root) == node_rows(tree.root)
+
+
+class LegacyPickler(pickle.Pickler):
+    # pickles Node / Tree with the __dict__ of the original classes
+    def reducer_override(self, obj):
+        if type(obj) is Node:
+            state = {'reaction_index': obj.reaction_index, 'substance': obj.substance, 'children': obj.children,
+                     'fathers_set': set(obj.fathers_set), 'father': obj.father, 'reaction_line': obj.reaction_line,
+                     'is_leaf': obj.is_leaf, 'cache_func': obj.cache_func, 'reactions': obj.reactions,
+                     'product_dict': obj.product_dict, 'unexpandable_substances': obj.unexpandable_substances}
+            return copyreg.__newobj__, (Node,), state
+        if type(obj) is Tree:
+            state = {'reactions': obj.reactions, 'product_dict': obj.product_dict,
+                     'target_substance': obj.target_substance, 'reaction_infos': obj.reaction_infos,
+                     'all_path': obj.all_path, 'chemical_cache': dict(obj.chemical_cache),
+                     'unexpandable_substances': obj.unexpandable_substances, 'root': obj.root,
+                     'reactions_txt': obj.reactions_txt}
+            return copyreg.__newobj__, (Tree,), state
+        return NotImplemented
+
+
+def save_legacy_pickle(tree, filename):
+    with open(filename, 'wb') as f:
+        LegacyPickler(f).dump(tree)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200, 500, 1000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--common-rate', type=float, default=0.6)
+    args = parser.parse_args()
+    sys.setrecursionlimit(100000)  # pickle recurses once per tree level
+    loader = TreeLoader()
+
+    print(f"{'reactions':>10} {'nodes':>9} {'format':>8} {'MB':>8} {'save s':>8} {'load s':>8} "
+          f"{'load+walk s':>12}")
+    with tempfile.TemporaryDirectory() as folder:
+        for num_reactions in args.sizes:
+            reactions_txt, common = make_reactions_txt(num_reactions, seed=args.seed, common_rate=args.common_rate)
+            tree, result, _ = build_tree(reactions_txt, common, 'andor')
+            num_nodes = len(node_rows(tree.root))  # materializes the whole tree, as show_tree does
+            pickle_path = os.path.join(folder, 'tree.pkl')
+            binary_path = os.path.join(folder, 'tree.bin')
+            _, pickle_save = timed(loader.save_tree, tree, pickle_path, format='pickle')
+            pickle_size = os.path.getsize(pickle_path)
+            _, binary_save = timed(loader.save_tree, tree, binary_path)
+            binary_size = os.path.getsize(binary_path)  # both files are overwritten by the checks below
+
+            rows = []
+            loaded, elapsed = timed(loader.load_tree, pickle_path)
+            _, walk = timed(node_rows, loaded.root)
+            rows.append(('pickle', pickle_size, pickle_save, elapsed, elapsed + walk))
+            loaded, elapsed = timed(loader.load_tree, binary_path)
+            _, walk = timed(node_rows, loaded.root)
+            rows.append(('lazy', binary_size, binary_save, elapsed, elapsed + walk))
+            check_round_trip(tree, loaded)
+            loaded, elapsed = timed(loader.load_tree, binary_path, lazy=False)
+            _, walk = timed(node_rows, loaded.root)
+            rows.append(('eager', binary_size, binary_save, elapsed, elapsed + walk))
+            check_round_trip(tree, loaded)
+            # a pickled tree converted to the binary format
+            with open(pickle_path, 'rb') as f:
+                loader.save_tree(pickle.load(f), binary_path)
+            check_round_trip(tree, loader.load_tree(binary_path))
+            # a tree pickled by the original classes
+            save_legacy_pickle(tree, pickle_path)
+            loaded = loader.load_tree(pickle_path)
+            check_round_trip(tree, loaded)
+            # pathways compared without enumerating them all (millions on the larger trees)
+            assert loaded.count_paths(minimal=False) == tree.count_paths(minimal=False)
+            assert [len(path) for path in loaded.iter_paths(limit=100)] == \
+                   [len(path) for path in tree.iter_paths(limit=100)]
+
+            for name, size, save, load, load_walk in rows:
+                print(f"{num_reactions:>10} {num_nodes:>9} {name:>8} {size / 2 ** 20:>8.2f} "
+                      f"{save:>8.3f} {load:>8.3f} {load_walk:>12.3f}")
@@ -0,0 +1,126 @@
+'''
+Time and peak memory of the level-order tree renderer (treerender, sets and names built once per node) against
+the former Tree.add_nodes_edges_level_order2 (list membership checks, names rebuilt per use), with a check that
+both give the same DOT source and the same reaction_infos. The Graphviz image itself is not rendered.
+'headless' is Tree.get_tree_reactions on the freshly built tree (AND/OR graph walk, no node materialized),
+checked against the reactions of all the nodes.
+
+The synthetic corpora give deep trees with few distinct names per level, the wide trees (the target made by
+--widths reactions from distinct precursors) give the wide levels on which the former list checks are quadratic.
+
+usage (from the repository root):
+    python -m utils.benchmark_tree_render --sizes 200 500 1000 --widths 2000 10000
+'''
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from graphviz import Digraph
+from RetroSynAgent.treerender import iter_tree_dot, write_tree_dot
+from utils.benchmark_tree_expansion import make_reactions_txt, build_tree
+from utils.benchmark_tree_format import node_rows
+
+
+def make_wide_reactions_txt(width):
+    # 'substance 0' made from precursor i, made from common reagent i: two levels of width distinct nodes
+    lines = []
+    for i in range(width):
+        lines.append(f"Reaction idx: {2 * i + 1}\nReactants: precursor {i}\nProducts: substance 0\n"
+                     f"Conditions: synthetic\nSource: synthetic\n")
+        lines.append(f"Reaction idx: {2 * i + 2}\nReactants: reagent {i}\nProducts: precursor {i}\n"
+                     f"Conditions: synthetic\nSource: synthetic\n")
+    common = {'substance 0': False}
+    for i in range(width):
+        common[f'precursor {i}'] = False
+        common[f'reagent {i}'] = True
+    return '\n'.join(lines), common
+
+
+def legacy_level_order(tree, node, reaction_infos, simple=False):
+    # former Tree.add_nodes_edges_level_order2
+    dot = Digraph(comment='Substances Tree', graph_attr={'rankdir': 'LR'})
+    dot.attr('node', shape='ellipse', style='filled', fillcolor='#82b0d2', color='#999999', fontname="Arial", fontsize="8")
+    dot.attr('edge', color='#999999', fontname="Arial", fontsize="8")
+    root_fillcolor = '#beb8dc'
+    dot.node(name=tree.get_name_level_order(node), label='' if simple else node.substance, width='0.1', height='0.1', fillcolor=root_fillcolor)
+    queue = deque([node])
+    while queue:
+        level_nodes = []
+        level_edges = []
+        for _ in range(len(queue)):
+            cur_node = queue.popleft()
+            if cur_node.reaction_index is not None:
+                edge_name = (tree.get_name_level_order(cur_node.father) + tree.get_name_level_order(cur_node))
+                if edge_name not in level_edges:
+                    dot.edge(tree.get_name_level_order(cur_node.father), tree.get_name_level_order(cur_node), label=f"", arrowhead='none')
+                    level_edges.append(edge_name)
+                    reaction_infos.add(str(cur_node.reaction_index))
+                node_name = cur_node.substance
+                node_color = '#8ecfc9' if cur_node.is_leaf else '#82b0d2'
+                if node_name not in level_nodes:
+                    dot.node(name=tree.get_name_level_order(cur_node), label='' if simple else cur_node.substance, width='0.1', height='0.1', fillcolor=node_color)
+                    level_nodes.append(node_name)
+            for child in cur_node.children:
+                queue.append(child)
+    return dot
+
+
+def legacy_source(tree, reaction_infos, dpi='500'):
+    # former show_tree up to dot.render
+    dot = legacy_level_order(tree, tree.root, reaction_infos)
+    dot.attr(dpi=dpi)
+    return dot.source
+
+
+def measure(func, *args, **kwargs):
+    # timed without tracemalloc, then run again for the peak memory
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200, 500, 1000])
+    parser.add_argument('--widths', type=int, nargs='*', default=[2000, 10000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--common-rate', type=float, default=0.6)
+    args = parser.parse_args()
+
+    print(f"{'reactions':>10} {'nodes':>9} {'renderer':>10} {'s':>8} {'peak MB':>8} {'DOT MB':>7}")
+    with tempfile.TemporaryDirectory() as folder:
+        corpora = [(num_reactions, make_reactions_txt(num_reactions, seed=args.seed, common_rate=args.common_rate))
+                   for num_reactions in args.sizes]
+        corpora += [(2 * width, make_wide_reactions_txt(width)) for width in args.widths]
+        for num_reactions, (reactions_txt, common) in corpora:
+            tree, _, _ = build_tree(reactions_txt, common, 'andor')
+            headless_ids, headless, headless_peak = measure(tree.get_tree_reaction_ids)
+            tree.get_tree_reactions()
+            num_nodes = len(node_rows(tree.root))  # children materialized before timing
+            queue = [tree.root]
+            for node in queue:
+                queue.extend(node.children)
+            assert headless_ids == {node.reaction_id for node in queue[1:]}
+
+            legacy_infos, new_infos = set(), set()
+            source, legacy, legacy_peak = measure(legacy_source, tree, legacy_infos)
+            new_source, elapsed, peak = measure(lambda: ''.join(iter_tree_dot(tree.root, dpi='500', reaction_infos=new_infos)))
+            assert new_source == source and new_infos == legacy_infos
+            # the drawn edges miss the reactions whose edges have the name of an edge already drawn
+            assert legacy_infos <= tree.reaction_infos
+            path = os.path.join(folder, 'tree.dot')
+            _, streamed, streamed_peak = measure(write_tree_dot, tree.root, path, dpi='500')
+            assert open(path, encoding='utf-8').read() == source
+
+            size = len(source.encode('utf-8')) / 2 ** 20
+            for name, seconds, peak_bytes in (('legacy', legacy, legacy_peak), ('source', elapsed, peak),
+                                              ('streamed', streamed, streamed_peak),
+                                              ('headless', headless, headless_peak)):
+                print(f"{num_reactions:>10} {num_nodes:>9} {name:>10} {seconds:>8.3f} {peak_bytes / 2 ** 20:>8.1f} {size:>7.2f}")